@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+DNS Tunnel Pro - Crypto benchmark
+Copyright (c) 2025 Mr-X-01
+
+Times sealing and opening of response chunks, per fragment, the way the
+tunnel did it before crypto sessions (a random nonce drawn per chunk,
+replies sliced into nonce and ciphertext copies) against the crypto
+session: counter nonces, chunks opened in place, then also checked
+against the replay window, one at a time and in batches of a poll
+window. Chunks carry their CHUNK header as associated data, as on the
+wire. The report gives the fastest of --repeat runs in microseconds per
+fragment for each fragment size.
+
+Usage:
+    python benchmarks/crypto_bench.py
+    python benchmarks/crypto_bench.py --sizes 200,1200,4000 --window 8 --count 20000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'client'))
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from crypto_session import CryptoSession, CLIENT_TO_SERVER, SERVER_TO_CLIENT
+from tunnel_codec import CHUNK, ST_PARTIAL
+
+
+def fastest(cases, repeat, count):
+    """
+    Run the cases in turn repeat times, so drift of the host hits them
+    alike; return the fastest run of each in microseconds per fragment
+    """
+    best = {}
+    for _ in range(repeat):
+        for name, run in cases:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return {name: round(best[name] / count * 1e6, 2) for name, _ in cases}
+
+
+def bench_size(size, args):
+    key = AESGCM.generate_key(bit_length=256)
+    cipher = AESGCM(key)
+    chunks = [
+        (os.urandom(size), CHUNK.pack(ST_PARTIAL, 1, index * size, 1 << 30))
+        for index in range(args.count)
+    ]
+    window = args.window
+    batches = [chunks[i:i + window] for i in range(0, len(chunks), window)]
+
+    def seal_random():
+        for data, header in chunks:
+            nonce = os.urandom(12)
+            nonce + cipher.encrypt(nonce, data, header)
+
+    def seal_counter():
+        server = CryptoSession(key, SERVER_TO_CLIENT)
+        for data, header in chunks:
+            server.seal(data, header)
+
+    def seal_batch():
+        server = CryptoSession(key, SERVER_TO_CLIENT)
+        for batch in batches:
+            server.seal_batch(batch)
+
+    # Replies as the client gets them: the chunk header, then the sealed chunk
+    server = CryptoSession(key, SERVER_TO_CLIENT)
+    replies = [header + server.seal(data, header) for data, header in chunks]
+
+    def open_sliced():
+        for reply in replies:
+            header, sealed = reply[:CHUNK.size], reply[CHUNK.size:]
+            cipher.decrypt(sealed[:12], sealed[12:], header)
+
+    def open_in_place():
+        client = CryptoSession(key, CLIENT_TO_SERVER)
+        for reply in replies:
+            client.open(memoryview(reply)[CHUNK.size:], reply[:CHUNK.size])
+
+    def open_checked():
+        client = CryptoSession(key, CLIENT_TO_SERVER)
+        for reply in replies:
+            client.open(memoryview(reply)[CHUNK.size:], reply[:CHUNK.size], replay=True)
+
+    reply_batches = [replies[i:i + window] for i in range(0, len(replies), window)]
+
+    def open_batch():
+        client = CryptoSession(key, CLIENT_TO_SERVER)
+        for batch in reply_batches:
+            results = client.open_batch([
+                (memoryview(reply)[CHUNK.size:], reply[:CHUNK.size]) for reply in batch
+            ], replay=True)
+            assert not any(isinstance(result, Exception) for result in results)
+
+    report = {'size': size}
+    report.update(fastest((
+        ('seal_random_nonce', seal_random),
+        ('seal_counter_nonce', seal_counter),
+        ('seal_batch', seal_batch),
+        ('open_sliced', open_sliced),
+        ('open_in_place', open_in_place),
+        ('open_checked', open_checked),
+        ('open_batch', open_batch),
+    ), args.repeat, args.count))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DNS Tunnel Pro crypto benchmark')
+    parser.add_argument('--sizes', default='200,1200,4000', help='Fragment sizes in bytes')
+    parser.add_argument('--window', type=int, default=8, help='Fragments per batch')
+    parser.add_argument('--count', type=int, default=20000, help='Fragments per run')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case, the fastest counts')
+    args = parser.parse_args()
+
+    report = {
+        'window': args.window,
+        'count': args.count,
+        'us_per_fragment': [bench_size(int(size), args) for size in args.sizes.split(',')],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+DNS Tunnel Pro - Fleet load test
+Copyright (c) 2025 Mr-X-01
+
+Creates a panel database of --clients Client rows with fresh keys, starts
+the real server on it (it loads them at startup like a production
+server) next to a local origin, then runs growing numbers of active
+clients straight at the server's UDP port. Each simulated client speaks
+the tunnel protocol with the client's codec, crypto sessions and header
+tables: requests are sealed and sent as DATA fragments, responses are
+read with held FETCH queries, several at a time for bulk downloads.
+Clients pick from a mix of small page loads, form uploads, downloads
+and long polls (an origin that answers late), with a random think time
+in between.
+
+For every step the report gives the server's resident size, the growth
+per session over the idle server with every client registered, queries
+per second, query and request error rates and latency percentiles per
+kind of request. The simulated clients cost CPU too: on a small host
+spread them over --drivers processes (or run the server alone on a
+bigger one) before reading the query rate as the server's limit.
+
+Usage:
+    python benchmarks/fleet_load.py --clients 10000 --active 100,500,1000
+    python benchmarks/fleet_load.py --clients 2000 --active 200 --duration 60 --drivers 4
+    python benchmarks/fleet_load.py --active 500 --mix get=50,download=50 --think 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import secrets
+import sqlite3
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'server'))
+sys.path.insert(0, str(ROOT / 'client'))
+
+DOMAIN = 'fleet.tunnel.local'
+
+# Share of each kind of request in the traffic mix
+DEFAULT_MIX = 'get=60,post=15,download=10,poll=15'
+# Browser-like request headers, indexed against the header tables
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'identity',
+}
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss(pid, field='VmRSS'):
+    """Resident (or, with VmHWM, peak resident) size of a process in KiB"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('get', 'post', 'download', 'poll'):
+            raise ValueError(f"Unknown request kind in mix: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def create_clients(database, count):
+    """Fill a panel database with count active clients, the way the panel creates them"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from config.config_loader import load_config
+    from web_panel.app import create_app, db, Client
+
+    config = load_config(os.devnull)
+    config['web_panel']['database'] = database
+    app = create_app(config, None)
+    with app.app_context():
+        for start in range(0, count, 1000):
+            db.session.add_all([
+                Client(
+                    client_id=secrets.token_hex(16),
+                    name=f'load-{index}',
+                    encryption_key=base64.b64encode(AESGCM.generate_key(bit_length=256)).decode(),
+                    is_active=True
+                )
+                for index in range(start, min(start + 1000, count))
+            ])
+            db.session.commit()
+
+
+def serve_origin(args):
+    """Subprocess entry point: origin answering /bytes/<n>, /slow/<ms> and POSTs"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    payload = os.urandom(1 << 20)
+
+    class OriginHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *a):
+            pass
+
+        def _reply(self, body, content_type='application/octet-stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            _, kind, value = self.path.split('/', 2)
+            if kind == 'slow':
+                time.sleep(int(value) / 1000)
+                self._reply(b'{"events":[]}', 'application/json')
+            else:
+                self._reply(payload[:int(value)])
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self._reply(b'{"ok":true}', 'application/json')
+
+    origin = ThreadingHTTPServer(('127.0.0.1', args.origin_port), OriginHandler)
+    origin.daemon_threads = True
+    print('ready', flush=True)
+    origin.serve_forever()
+
+
+def serve(args):
+    """Subprocess entry point: the tunnel server, loading its clients from the database"""
+    from config.config_loader import load_config
+    from dns_server.server import DNSTunnelServer
+
+    logging.basicConfig(level=logging.WARNING)
+    config = load_config(os.devnull)
+    config['dns']['port'] = args.port
+    config['dns']['domain'] = DOMAIN
+    config['web_panel']['database'] = args.database
+
+    empty = rss(os.getpid())
+    server = DNSTunnelServer(config)
+    loaded = server.load_clients(args.database)
+    print(json.dumps({'loaded': loaded, 'rss_empty_kib': empty}), flush=True)
+    server.start()
+
+
+class Link:
+    """UDP socket to the server, matching answers to queries by DNS id"""
+
+    def __init__(self, port, timeout):
+        self.address = ('127.0.0.1', port)
+        self.timeout = timeout
+        self.pending = {}
+        self.transport = None
+        self.queries = 0
+        self.timeouts = 0
+        self.latency = []
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: self, remote_addr=self.address
+        )
+        # Answers to a thousand clients arrive in bursts; losses should
+        # be the server's, not this socket's
+        self.transport.get_extra_info('socket').setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20
+        )
+
+    def connection_made(self, transport):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+    def error_received(self, exc):
+        pass
+
+    def datagram_received(self, data, addr):
+        future = self.pending.pop(int.from_bytes(data[:2], 'big'), None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    async def exchange(self, name, hold=0.0):
+        """Send a TXT query, return its answer records as DoH JSON dicts (None on timeout)"""
+        import dns.message
+
+        query = dns.message.make_query(name, 'TXT', use_edns=0, payload=65535)
+        while query.id in self.pending:
+            query.id = random.randrange(65536)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[query.id] = future
+        self.queries += 1
+        started = time.monotonic()
+        self.transport.sendto(query.to_wire())
+        try:
+            wire = await asyncio.wait_for(future, self.timeout + hold)
+        except asyncio.TimeoutError:
+            self.pending.pop(query.id, None)
+            self.timeouts += 1
+            return None
+        self.latency.append(time.monotonic() - started)
+        reply = dns.message.from_wire(wire)
+        return [
+            {'type': int(rrset.rdtype), 'data': rdata.to_text()}
+            for rrset in reply.answer for rdata in rrset
+        ]
+
+
+class SimulatedClient:
+    """One tunnel client: its key, message ids and header tables"""
+
+    def __init__(self, client_id, key, link, args):
+        from crypto_session import CryptoSession, CLIENT_TO_SERVER
+        from header_table import HeaderEncoder, HeaderDecoder
+        from tunnel_codec import HEADER, DATA, max_packet_size
+
+        self.raw = bytes.fromhex(client_id)
+        self.crypto = CryptoSession(base64.b64decode(key), CLIENT_TO_SERVER)
+        self.link = link
+        self.args = args
+        self.request_headers = HeaderEncoder(args.header_table_size)
+        self.response_headers = HeaderDecoder(args.header_table_size, acknowledge=True)
+        self.msg_id = random.randrange(65536)
+        self.fragment_size = max_packet_size(DOMAIN) - HEADER.size - DATA.size
+
+    async def query(self, op, body, hold=0.0):
+        """Run one tunnel query, retrying lost ones; return the reply bytes"""
+        from tunnel_codec import HEADER, ST_ERROR, encode_query_name, decode_answer
+
+        name = encode_query_name(HEADER.pack(op, self.raw, self.args.answer_bytes) + body, DOMAIN)
+        for _ in range(self.args.retries):
+            answers = await self.link.exchange(name, hold)
+            if answers is None:
+                continue
+            reply = decode_answer('TXT', answers, DOMAIN)
+            if not reply:
+                raise RuntimeError('Empty reply')
+            if reply[0] == ST_ERROR:
+                raise RuntimeError(reply[1:].decode(errors='replace'))
+            return reply
+        raise TimeoutError('Query lost')
+
+    async def request(self, method, url, body=b''):
+        """Send one request and read its response, return (status code, body length)"""
+        from tunnel_codec import OP_DATA, DATA
+
+        block, block_id = self.request_headers.encode(REQUEST_HEADERS.items())
+        payload = {'url': url, 'method': method, 'headers': block}
+        if body:
+            payload['body'] = base64.b64encode(body).decode()
+        table_id, acks = self.response_headers.take_acknowledgements()
+        if acks:
+            payload['header_acks'] = [table_id] + acks
+        blob = self.crypto.seal(json.dumps(payload, separators=(',', ':')).encode())
+
+        self.msg_id = (self.msg_id + 1) & 0xFFFF
+        msg_id = self.msg_id
+        size = self.fragment_size
+        chunks = [blob[i:i + size] for i in range(0, len(blob), size)]
+        try:
+            await asyncio.gather(*(
+                self.query(OP_DATA, DATA.pack(msg_id, index, len(chunks), 0) + chunk)
+                for index, chunk in enumerate(chunks)
+            ))
+            head, length = await self.response(msg_id)
+        except BaseException:
+            self.request_headers.release(block_id)
+            raise
+        self.request_headers.acknowledge(block_id)
+        return head['status_code'], length
+
+    async def fetch(self, msg_id, offset, acked):
+        """Fetch the response bytes at an offset, holding while there are none"""
+        from tunnel_codec import OP_FETCH, FETCH, CHUNK, ST_OK, ST_PENDING, ST_PARTIAL
+
+        hold = self.args.hold
+        while True:
+            reply = await self.query(OP_FETCH, FETCH.pack(msg_id, offset, acked, int(hold * 1000)), hold)
+            if reply[0] != ST_PENDING:
+                break
+        header, sealed = reply[:CHUNK.size], reply[CHUNK.size:]
+        status, reply_msg, reply_offset, total = CHUNK.unpack(header)
+        if status not in (ST_OK, ST_PARTIAL) or reply_msg != msg_id or reply_offset != offset:
+            raise RuntimeError('Mismatched fetch reply')
+        data = self.crypto.open(sealed, header, replay=True)
+        return total, status == ST_OK, data
+
+    async def response(self, msg_id):
+        """Read a whole response, up to --window fetches at a time once its length is known"""
+        from tunnel_codec import CHUNK, SEAL_OVERHEAD, HEAD_LENGTH
+
+        chunk = self.args.answer_bytes - CHUNK.size - SEAL_OVERHEAD
+        data = bytearray()
+        total = None
+        final = False
+        while not (final and len(data) >= total):
+            offsets = [len(data)]
+            while (total is not None and len(offsets) < self.args.window
+                   and offsets[-1] + chunk < total):
+                offsets.append(offsets[-1] + chunk)
+            acked = len(data)
+            results = await asyncio.gather(*(self.fetch(msg_id, o, acked) for o in offsets))
+            for offset, (end, done, piece) in zip(offsets, results):
+                # A short chunk moves the following offsets: fetch them again
+                if offset != len(data):
+                    break
+                data += piece
+                total, final = end, done
+
+        (length,) = HEAD_LENGTH.unpack_from(data)
+        head = json.loads(bytes(data[HEAD_LENGTH.size:HEAD_LENGTH.size + length]))
+        headers = head.get('headers') or {}
+        if 'fields' in headers:
+            self.response_headers.decode(headers)
+        return head, len(data) - HEAD_LENGTH.size - length
+
+
+async def drive_client(client, args, mix, origin, results, deadline):
+    """Run requests of the mix with think times until the deadline"""
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    await asyncio.sleep(random.uniform(0, args.think))
+    while time.monotonic() < deadline:
+        kind = random.choices(kinds, weights)[0]
+        if kind == 'get':
+            call = client.request('GET', f'{origin}/bytes/{args.page_size}')
+        elif kind == 'post':
+            call = client.request('POST', f'{origin}/form', os.urandom(args.upload_size))
+        elif kind == 'download':
+            call = client.request('GET', f'{origin}/bytes/{args.download_size}')
+        else:
+            call = client.request('GET', f'{origin}/slow/{random.randint(500, args.poll_delay)}')
+        started = time.monotonic()
+        stats = results.setdefault(kind, {'ok': 0, 'errors': 0, 'latency': []})
+        try:
+            status, _ = await call
+            if status != 200:
+                raise RuntimeError(f'HTTP {status}')
+        except Exception:
+            stats['errors'] += 1
+        else:
+            if time.monotonic() <= deadline:
+                stats['ok'] += 1
+                stats['latency'].append(round(time.monotonic() - started, 4))
+        await asyncio.sleep(random.expovariate(1 / args.think))
+
+
+async def drive(args):
+    """Driver body: run a slice of the database's clients for --duration seconds"""
+    conn = sqlite3.connect(args.database)
+    try:
+        rows = conn.execute(
+            'SELECT client_id, encryption_key FROM client ORDER BY id LIMIT ? OFFSET ?',
+            (args.count, args.offset)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    link = Link(args.port, args.timeout)
+    await link.open()
+    mix = parse_mix(args.mix)
+    origin = f'http://127.0.0.1:{args.origin_port}'
+    results = {}
+    deadline = time.monotonic() + args.duration
+    tasks = [
+        asyncio.ensure_future(drive_client(
+            SimulatedClient(client_id, key, link, args), args, mix, origin, results, deadline
+        ))
+        for client_id, key in rows
+    ]
+    # Requests still running at the deadline get a grace period, then are dropped
+    await asyncio.wait(tasks, timeout=args.duration + args.timeout * args.retries)
+    for task in tasks:
+        task.cancel()
+    link.transport.close()
+    return {
+        'requests': results,
+        'queries': link.queries,
+        'query_timeouts': link.timeouts,
+        'query_latency': [round(t, 4) for t in link.latency],
+    }
+
+
+def run_driver(args):
+    """Subprocess entry point: one load generator process"""
+    logging.basicConfig(level=logging.WARNING)
+    print(json.dumps(asyncio.run(drive(args))), flush=True)
+
+
+def run_step(args, active, dns_port, origin_port, database, server):
+    """Drive the first active clients for --duration seconds, return the step's report"""
+    drivers = max(min(args.drivers, active), 1)
+    share, extra = divmod(active, drivers)
+    common = [
+        '--drive', '--database', database, '--port', str(dns_port),
+        '--origin-port', str(origin_port), '--duration', str(args.duration),
+        '--timeout', str(args.timeout), '--retries', str(args.retries),
+        '--hold', str(args.hold), '--window', str(args.window), '--think', str(args.think),
+        '--mix', args.mix, '--answer-bytes', str(args.answer_bytes),
+        '--header-table-size', str(args.header_table_size),
+        '--page-size', str(args.page_size), '--upload-size', str(args.upload_size),
+        '--download-size', str(args.download_size), '--poll-delay', str(args.poll_delay),
+    ]
+    processes = []
+    offset = 0
+    for index in range(drivers):
+        count = share + (index < extra)
+        processes.append(subprocess.Popen(
+            [sys.executable, __file__, '--offset', str(offset), '--count', str(count)] + common,
+            stdout=subprocess.PIPE, text=True
+        ))
+        offset += count
+    outputs = [json.loads(p.communicate()[0]) for p in processes]
+
+    requests = {}
+    for output in outputs:
+        for kind, stats in output['requests'].items():
+            merged = requests.setdefault(kind, {'ok': 0, 'errors': 0, 'latency': []})
+            merged['ok'] += stats['ok']
+            merged['errors'] += stats['errors']
+            merged['latency'] += stats['latency']
+    queries = sum(o['queries'] for o in outputs)
+    timeouts = sum(o['query_timeouts'] for o in outputs)
+    latency = [t for o in outputs for t in o['query_latency']]
+    done = sum(r['ok'] for r in requests.values())
+    failed = sum(r['errors'] for r in requests.values())
+
+    def ms(values, pct):
+        return round(percentile(values, pct) * 1000, 1) if values else None
+
+    return {
+        'active': active,
+        'server_rss_kib': rss(server.pid),
+        'server_max_rss_kib': rss(server.pid, 'VmHWM'),
+        'queries_per_s': round(queries / args.duration, 1),
+        'query_loss_rate': round(timeouts / queries, 4) if queries else None,
+        'query_ms_p50': ms(latency, 50),
+        'query_ms_p90': ms(latency, 90),
+        'query_ms_p99': ms(latency, 99),
+        'requests_per_s': round(done / args.duration, 1),
+        'request_error_rate': round(failed / (done + failed), 4) if done + failed else None,
+        'requests': {
+            kind: {
+                'ok': stats['ok'],
+                'errors': stats['errors'],
+                'ms_p50': ms(stats['latency'], 50),
+                'ms_p90': ms(stats['latency'], 90),
+                'ms_p99': ms(stats['latency'], 99),
+            }
+            for kind, stats in sorted(requests.items())
+        },
+    }
+
+
+def run(args):
+    steps = sorted(int(n) for n in args.active.split(','))
+    if steps[-1] > args.clients:
+        raise SystemExit(f"--active {steps[-1]} is more than --clients {args.clients}")
+    parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix='dnstunnel-fleet-')
+    database = os.path.join(workdir, 'tunnel.db')
+    started = time.time()
+    create_clients(database, args.clients)
+    created = time.time() - started
+
+    dns_port = free_port()
+    origin_port = free_port(socket.SOCK_STREAM)
+    origin = subprocess.Popen(
+        [sys.executable, __file__, '--serve-origin', '--origin-port', str(origin_port)],
+        stdout=subprocess.PIPE, text=True
+    )
+    origin.stdout.readline()
+    started = time.time()
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', '--port', str(dns_port), '--database', database],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        loaded = json.loads(server.stdout.readline())
+        load_time = time.time() - started
+        time.sleep(0.5)
+        registered = rss(server.pid)
+        report = {
+            'clients': args.clients,
+            'clients_loaded': loaded['loaded'],
+            'create_s': round(created, 2),
+            'server_start_s': round(load_time, 2),
+            'server_rss_empty_kib': loaded['rss_empty_kib'],
+            'server_rss_registered_kib': registered,
+            'rss_per_registered_client_b': round(
+                (registered - loaded['rss_empty_kib']) * 1024 / max(args.clients, 1), 1
+            ),
+            'drivers': args.drivers,
+            'duration_s': args.duration,
+            'mix': parse_mix(args.mix),
+            'think_s': args.think,
+            'answer_bytes': args.answer_bytes,
+            'steps': [],
+        }
+        for active in steps:
+            step = run_step(args, active, dns_port, origin_port, database, server)
+            # Earlier steps used a subset of these clients, so every
+            # session created so far is among them
+            step['rss_per_session_kib'] = round(
+                (step['server_rss_kib'] - registered) / active, 2
+            )
+            report['steps'].append(step)
+            print(json.dumps(step), file=sys.stderr, flush=True)
+        print(json.dumps(report, indent=2))
+        return report
+    finally:
+        for process in (server, origin):
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DNS Tunnel Pro fleet load test')
+    parser.add_argument('--clients', type=int, default=10000, help='Client rows created (registered clients)')
+    parser.add_argument('--active', default='100,500,1000', help='Comma-separated active client counts, one step each')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds each step runs')
+    parser.add_argument('--drivers', type=int, default=1, help='Load generator processes')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Request kinds and weights (get, post, download, poll)')
+    parser.add_argument('--think', type=float, default=2.0, help='Mean pause between requests of a client (s)')
+    parser.add_argument('--page-size', type=int, default=2048, help='Response size of get and post requests')
+    parser.add_argument('--upload-size', type=int, default=4096, help='Body size of post requests')
+    parser.add_argument('--download-size', type=int, default=65536, help='Response size of download requests')
+    parser.add_argument('--poll-delay', type=int, default=3000, help='Longest origin delay of poll requests (ms)')
+    parser.add_argument('--answer-bytes', type=int, default=512, help='Answer budget of every query')
+    parser.add_argument('--window', type=int, default=4, help='Fetches in flight per response')
+    parser.add_argument('--hold', type=float, default=1.0, help='Server hold of empty fetches (s)')
+    parser.add_argument('--timeout', type=float, default=2.0, help='Query timeout (s)')
+    parser.add_argument('--retries', type=int, default=3, help='Attempts per query')
+    parser.add_argument('--header-table-size', type=int, default=4096, help='Header table size')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--serve-origin', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--drive', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--origin-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--offset', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_origin:
+        serve_origin(args)
+    elif args.serve:
+        serve(args)
+    elif args.drive:
+        run_driver(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+DNS Tunnel Pro - Loopback benchmark
+Copyright (c) 2025 Mr-X-01
+
+Runs the real server (in a subprocess, next to a local origin HTTP server)
+and the real client (in this process) over loopback UDP, then fetches a
+file through the SOCKS5 proxy and reports time-to-first-byte, goodput,
+payload bytes per query and client and server memory. With --loss and
+--delay, queries and answers pass a relay that drops datagrams with that
+probability and delays them; --concurrency runs requests in parallel, and
+--background keeps a bulk download running next to them. --nodes runs a
+cluster of server processes with a stand-in store, the client spreading
+its queries over all of them.
+
+Usage:
+    python benchmarks/loopback_bench.py --size 1048576 --requests 3
+    python benchmarks/loopback_bench.py --loss 0.05 --delay 40 --fec-group 4
+    python benchmarks/loopback_bench.py --size 200 --requests 200 --concurrency 50
+    python benchmarks/loopback_bench.py --size 2000 --requests 20 --background 8388608
+    python benchmarks/loopback_bench.py --nodes 3 --size 65536 --requests 50 --concurrency 10
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import logging
+import argparse
+import resource
+import secrets
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'server'))
+sys.path.insert(0, str(ROOT / 'client'))
+
+DOMAIN = 'bench.tunnel.local'
+CLUSTER_SECRET = 'bench'
+
+
+class QuietDNSLogger:
+    """Drop dnslib's per-packet prints"""
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+def lossy_relay(listen_port, target_port, loss, delay=0.0):
+    """
+    Forward DNS datagrams to the server, dropping each with a probability
+    and delaying each way by a fixed time
+    """
+    front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    front.bind(('127.0.0.1', listen_port))
+    back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    clients = {}
+
+    def send(sock, data, addr):
+        if delay:
+            threading.Timer(delay, sock.sendto, (data, addr)).start()
+        else:
+            sock.sendto(data, addr)
+
+    def forward():
+        while True:
+            data, addr = front.recvfrom(65535)
+            if random.random() >= loss:
+                clients[data[:2]] = addr
+                send(back, data, ('127.0.0.1', target_port))
+
+    def answer():
+        while True:
+            data, _ = back.recvfrom(65535)
+            addr = clients.pop(data[:2], None)
+            if addr and random.random() >= loss:
+                send(front, data, addr)
+
+    threading.Thread(target=forward, daemon=True).start()
+    threading.Thread(target=answer, daemon=True).start()
+
+
+def serve_store(args):
+    """Subprocess entry point: the cluster's stand-in store"""
+    from dns_server.cluster import StoreServer
+
+    logging.basicConfig(level=logging.WARNING)
+    store = StoreServer(f'127.0.0.1:{args.store_port}', CLUSTER_SECRET)
+    threading.Timer(0.2, print, ('ready',), {'flush': True}).start()
+    store.serve_forever()
+
+
+def serve(args):
+    """
+    Subprocess entry point: tunnel server, plus the origin HTTP server on
+    the first (or only) node
+    """
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+    from config.config_loader import load_config
+    from dns_server.server import DNSTunnelServer
+
+    logging.basicConfig(level=logging.WARNING)
+
+    class OriginHandler(SimpleHTTPRequestHandler):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, directory=args.dir, **kw)
+
+        def log_message(self, *a):
+            pass
+
+        def do_POST(self):
+            # Uploads are read and dropped, the answer is the GET body
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.do_GET()
+
+    if not args.node_index:
+        origin = ThreadingHTTPServer(('127.0.0.1', args.origin_port), OriginHandler)
+        threading.Thread(target=origin.serve_forever, daemon=True).start()
+
+    config = load_config(os.devnull)
+    config['dns']['port'] = args.port
+    config['dns']['domain'] = DOMAIN
+    if args.cluster:
+        config['cluster'].update({
+            'enabled': True,
+            'node_id': f'node{args.node_index}',
+            'nodes': json.loads(args.cluster),
+            'store': f'127.0.0.1:{args.store_port}',
+            'secret': CLUSTER_SECRET,
+        })
+    server = DNSTunnelServer(config)
+    server.dns_server.server.logger = QuietDNSLogger()
+    # In a cluster the other nodes learn the client from the store
+    if not args.node_index:
+        server.register_client(args.client_id, base64.b64decode(args.key))
+    lossy_relay(args.relay_port, args.port, args.loss, args.delay / 1000)
+    print('ready', flush=True)
+    server.start()
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def socks_fetch(port, host, target_port, path, body=b''):
+    """Fetch a path through SOCKS5 (POST with a body), return (ttfb, total time, bytes)"""
+    start = time.time()
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        sock.sendall(b'\x05\x01\x00')
+        sock.recv(2)
+        sock.sendall(b'\x05\x01\x00\x03' + bytes([len(host)]) + host.encode()
+                     + target_port.to_bytes(2, 'big'))
+        reply = b''
+        while len(reply) < 10:
+            reply += sock.recv(10 - len(reply))
+        if body:
+            request = (f'POST {path} HTTP/1.1\r\nHost: {host}\r\n'
+                       f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+        else:
+            request = f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode()
+        sock.sendall(request)
+
+        ttfb = None
+        received = 0
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            if ttfb is None:
+                ttfb = time.time() - start
+            received += len(data)
+        return ttfb, time.time() - start, received
+    finally:
+        sock.close()
+
+
+def peak_rss(pid):
+    """Peak resident size of a process in KiB, from /proc"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def run(args):
+    from dns_client import DNSTunnelClient
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix='dnstunnel-bench-')
+    payload = os.urandom(args.size)
+    Path(workdir, 'payload.bin').write_bytes(payload)
+    if args.background:
+        Path(workdir, 'background.bin').write_bytes(os.urandom(args.background))
+
+    client_id = secrets.token_hex(16)
+    key = base64.b64encode(os.urandom(32)).decode()
+    dns_ports = [free_port() for _ in range(args.nodes)]
+    relay_ports = [free_port() for _ in range(args.nodes)]
+    origin_port = free_port(socket.SOCK_STREAM)
+    socks_port = free_port(socket.SOCK_STREAM)
+
+    cluster = []
+    servers = []
+    if args.nodes > 1:
+        store_port = free_port(socket.SOCK_STREAM)
+        nodes = {f'node{i}': f'127.0.0.1:{free_port()}' for i in range(args.nodes)}
+        cluster = ['--cluster', json.dumps(nodes), '--store-port', str(store_port)]
+        servers.append(subprocess.Popen(
+            [sys.executable, __file__, '--serve-store', '--store-port', str(store_port)],
+            stdout=subprocess.PIPE, text=True
+        ))
+        servers[0].stdout.readline()
+    for index in range(args.nodes):
+        servers.append(subprocess.Popen(
+            [sys.executable, __file__, '--serve', '--port', str(dns_ports[index]),
+             '--origin-port', str(origin_port), '--dir', workdir,
+             '--client-id', client_id, '--key', key,
+             '--relay-port', str(relay_ports[index]), '--loss', str(args.loss),
+             '--delay', str(args.delay), '--node-index', str(index)] + cluster,
+            stdout=subprocess.PIPE, text=True
+        ))
+        # Node 0 registers the client before the others start
+        servers[-1].stdout.readline()
+    nodes = servers[-args.nodes:]
+    try:
+
+        config_path = Path(workdir, 'client.json')
+        config_path.write_text(json.dumps({
+            'client_id': client_id,
+            'encryption_key': key,
+            'dns_domain': DOMAIN,
+            'doh_resolvers': [
+                f'udp://127.0.0.1:{port}' for port in dns_ports for _ in range(args.resolvers)
+            ],
+            'answer_type': args.answer_type,
+            'fec_group': args.fec_group,
+            'batch_delay': args.batch_delay,
+            'qos': not args.no_qos,
+            'socks5_port': socks_port,
+        }))
+        client = DNSTunnelClient(str(config_path))
+        # Path discovery runs without loss so every run uses the same sizes
+        client.discover_paths()
+        relays = dict(zip(dns_ports, relay_ports))
+        for resolver in client.pool.resolvers:
+            resolver.port = relays[resolver.port]
+        client.start_socks_server()
+        time.sleep(0.2)
+
+        upload = os.urandom(args.upload)
+        done = threading.Event()
+        background = []
+
+        def download():
+            while not done.is_set():
+                background.append(socks_fetch(socks_port, '127.0.0.1', origin_port, '/background.bin'))
+
+        if args.background:
+            for _ in range(args.background_streams):
+                threading.Thread(target=download, daemon=True).start()
+            # Let the download take the resolver slots first
+            time.sleep(1)
+        # Allocation tracing slows the client down several times, so
+        # timings from a traced run are not comparable
+        if args.trace_alloc:
+            tracemalloc.start()
+        before = client.transport.snapshot()
+        started = time.time()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(
+                lambda _: socks_fetch(socks_port, '127.0.0.1', origin_port, '/payload.bin', upload),
+                range(args.requests)
+            ))
+        wall = time.time() - started
+        done.set()
+        after = client.transport.snapshot()
+        peak = None
+        if args.trace_alloc:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        ttfb = [r[0] for r in results if r[0] is not None]
+        total = [r[1] for r in results]
+        received = sum(r[2] for r in results)
+        queries = after['queries'] - before['queries']
+        payload = (after['payload_up'] + after['payload_down']
+                   - before['payload_up'] - before['payload_down'])
+        report = {
+            'body_bytes': args.size,
+            'upload_bytes': args.upload,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'resolvers': args.resolvers,
+            'nodes': args.nodes,
+            'loss': args.loss,
+            'delay_ms': args.delay,
+            'fec_group': args.fec_group,
+            'background_bytes': args.background,
+            'background_streams': args.background_streams if args.background else 0,
+            'qos': not args.no_qos,
+            'batch_delay_ms': args.batch_delay * 1000,
+            'answer_type': client.pool.resolvers[0].answer_type,
+            'answer_bytes': client.pool.resolvers[0].down_capacity,
+            'ttfb_ms_p50': round(percentile(ttfb, 50) * 1000, 1) if ttfb else None,
+            'total_ms_p50': round(percentile(total, 50) * 1000, 1),
+            'total_ms_p90': round(percentile(total, 90) * 1000, 1),
+            'goodput_kib_s': round(received / wall / 1024, 1),
+            'queries': queries,
+            'payload_per_query': round(payload / queries, 1) if queries else None,
+            'client_peak_alloc_kib': round(peak / 1024, 1) if peak is not None else None,
+            'client_max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'server_max_rss_kib': sum(peak_rss(node.pid) or 0 for node in nodes),
+            'query_errors': sum(r.errors for r in client.pool.resolvers),
+            'qos_classes': client.pool.qos_snapshot(),
+        }
+        print(json.dumps(report, indent=2))
+        return report
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DNS Tunnel Pro loopback benchmark')
+    parser.add_argument('--size', type=int, default=1048576, help='Response body size in bytes')
+    parser.add_argument('--requests', type=int, default=3, help='Requests to run')
+    parser.add_argument('--concurrency', type=int, default=1, help='Requests run at once')
+    parser.add_argument('--resolvers', type=int, default=2, help='Loopback resolver entries (per node)')
+    parser.add_argument('--nodes', type=int, default=1, help='Server nodes run as a cluster')
+    parser.add_argument('--answer-type', default='auto', help='Answer record type or auto')
+    parser.add_argument('--loss', type=float, default=0.0, help='Datagram drop probability')
+    parser.add_argument('--delay', type=float, default=0.0, help='One-way relay delay in ms')
+    parser.add_argument('--fec-group', type=int, default=0, help='Fragments per XOR parity group')
+    parser.add_argument('--batch-delay', type=float, default=0.005, help='Frame aggregation delay in s (0: off)')
+    parser.add_argument('--background', type=int, default=0, help='Bulk download size kept running alongside (bytes)')
+    parser.add_argument('--background-streams', type=int, default=4, help='Parallel bulk downloads')
+    parser.add_argument('--no-qos', action='store_true', help='Disable the interactive/bulk scheduler')
+    parser.add_argument('--upload', type=int, default=0, help='Request body size in bytes (POST)')
+    parser.add_argument('--trace-alloc', action='store_true', help='Report peak Python allocations (slow)')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--origin-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    parser.add_argument('--client-id', help=argparse.SUPPRESS)
+    parser.add_argument('--key', help=argparse.SUPPRESS)
+    parser.add_argument('--relay-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--node-index', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--cluster', help=argparse.SUPPRESS)
+    parser.add_argument('--store-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--serve-store', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_store:
+        serve_store(args)
+    elif args.serve:
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+DNS Tunnel Pro - Cross-stream frame aggregation
+Copyright (c) 2025 Mr-X-01
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class Batcher:
+    """
+    Nagle-style aggregation of small frames from every stream into shared
+    queries. A frame waits at most delay seconds for company; the batch
+    goes out at once when it fills a query or holds an urgent frame. The
+    batch is cut only once a query slot is free, so frames queued while
+    every resolver is busy ride together. A delay of 0 sends every frame
+    on its own.
+
+    acquire(items) and cancel(slot) take and return a query slot for the
+    pending items; send(slot, items) runs one query for a list of items
+    on it and returns one result per item, an exception instance failing
+    just that item.
+    """
+
+    def __init__(self, send, capacity, delay, acquire, cancel):
+        self.send = send
+        self.capacity = capacity
+        self.delay = delay
+        self.acquire = acquire
+        self.cancel = cancel
+        self.lock = threading.Lock()
+        self.items = []
+        self.size = 0
+        self.urgent = 0
+        self.timer = None
+
+    def submit(self, item, size, urgent=False):
+        """Queue an item costing size bytes of a query, return its Future"""
+        future = Future()
+        with self.lock:
+            self.items.append((item, size, urgent, future))
+            self.size += size
+            self.urgent += urgent
+            flush = self._due()
+            if not flush:
+                self._arm()
+        if flush:
+            self._flush()
+        return future
+
+    def _due(self):
+        """Whether the pending items should go out now (lock held)"""
+        return bool(self.items) and (
+            self.urgent or not self.delay or self.size >= self.capacity()
+        )
+
+    def _arm(self):
+        """Start the delay timer for pending items (lock held)"""
+        if self.timer is None and self.items:
+            self.timer = threading.Timer(self.delay, self._expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _expire(self):
+        with self.lock:
+            self.timer = None
+        self._flush()
+
+    def _take(self):
+        """Detach as many pending items as fit one query, oldest first (lock held)"""
+        capacity = self.capacity() if self.delay else 0
+        count = size = 0
+        for _, item_size, _, _ in self.items:
+            if count and size + item_size > capacity:
+                break
+            count += 1
+            size += item_size
+        batch = self.items[:count]
+        del self.items[:count]
+        self.size -= size
+        self.urgent -= sum(urgent for _, _, urgent, _ in batch)
+        if not self.items and self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    def _flush(self):
+        """Send pending items one query at a time while they are due"""
+        while True:
+            with self.lock:
+                pending = [item for item, _, _, _ in self.items]
+            if not pending:
+                return
+            slot = self.acquire(pending)
+            with self.lock:
+                batch = self._take()
+                again = self._due()
+                if not again:
+                    self._arm()
+            if not batch:
+                self.cancel(slot)
+                return
+            self._send(slot, batch)
+            if not again:
+                return
+
+    def _send(self, slot, batch):
+        try:
+            results = self.send(slot, [item for item, _, _, _ in batch])
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
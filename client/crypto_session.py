@@ -0,0 +1,186 @@
+"""
+DNS Tunnel Pro - Counter-nonce AES-GCM sessions
+Copyright (c) 2025 Mr-X-01
+"""
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Nonce: an 8-byte epoch, then a 4-byte counter within it
+NONCE = struct.Struct('!QI')
+TAG_SIZE = 16
+COUNTER_LIMIT = 1 << 32
+
+# Top bit of the epoch: the way the message goes, so the two sides of a
+# key never seal under the same nonce
+CLIENT_TO_SERVER = 0
+SERVER_TO_CLIENT = 1 << 63
+
+# Counters remembered behind the newest one of a peer epoch
+REPLAY_WINDOW = 4096
+# Peer epochs remembered, most recently used first out: one per restart
+# of the peer (or node of a cluster)
+MAX_EPOCHS = 8
+
+
+class ReplayError(Exception):
+    """A message was opened before, or is too far behind to tell"""
+
+
+class ReplayWindow:
+    """
+    Counters seen from one peer epoch: the newest, and a bitmap of the
+    size counters behind it (bit n for newest - n), as IPsec keeps them.
+    Anything further behind counts as seen, so bits past the window are
+    only trimmed once they have piled up.
+    """
+
+    __slots__ = ('size', 'mask', 'top', 'bitmap')
+
+    def __init__(self, size=REPLAY_WINDOW):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.top = -1
+        self.bitmap = 0
+
+    def seen(self, counter):
+        if counter > self.top:
+            return False
+        behind = self.top - counter
+        return behind >= self.size or bool(self.bitmap >> behind & 1)
+
+    def add(self, counter):
+        if counter > self.top:
+            shift = counter - self.top
+            self.bitmap = self.bitmap << shift | 1 if shift < self.size else 1
+            self.top = counter
+            if self.bitmap.bit_length() > 2 * self.size:
+                self.bitmap &= self.mask
+        else:
+            self.bitmap |= 1 << (self.top - counter)
+
+
+class CryptoSession:
+    """
+    AES-GCM on a client's key with counted nonces instead of random ones.
+    Each side seals under an epoch of its own (random, with the top bit
+    set to the direction) and a counter, and starts a new epoch before
+    the counter wraps, so a nonce is never used twice under a key across
+    restarts, cluster nodes and both directions. The nonce is also the
+    message's sequence number: opening with replay checks it against a
+    window per peer epoch, which stops duplicated or replayed messages
+    from being acted on twice. A replay from an epoch the session never
+    saw (e.g. sent to a server before it restarted) looks like a new one.
+
+    Sealed messages are the nonce, the ciphertext and the tag, as with
+    random nonces. They can be opened from any bytes-like object, so a
+    message in a larger buffer isn't copied to split its nonce off, and
+    the batch calls take a window's fragments at once.
+    """
+
+    def __init__(self, key, direction):
+        self.cipher = AESGCM(key)
+        self.direction = direction
+        self.lock = threading.Lock()
+        self.windows = OrderedDict()
+        self.peer_epoch = None
+        self._new_epoch()
+
+    def _new_epoch(self):
+        epoch = int.from_bytes(os.urandom(NONCE.size - 4), 'big')
+        self.epoch = epoch & ~SERVER_TO_CLIENT | self.direction
+        self.counter = 0
+
+    def _nonces(self, count):
+        """Reserve count consecutive nonces of one epoch"""
+        with self.lock:
+            if self.counter + count > COUNTER_LIMIT:
+                self._new_epoch()
+            start = self.counter
+            self.counter += count
+            epoch = self.epoch
+        return [NONCE.pack(epoch, counter) for counter in range(start, start + count)]
+
+    def seal(self, data, aad=None):
+        """Encrypt data, authenticating aad along with it"""
+        with self.lock:
+            if self.counter == COUNTER_LIMIT:
+                self._new_epoch()
+            nonce = NONCE.pack(self.epoch, self.counter)
+            self.counter += 1
+        return nonce + self.cipher.encrypt(nonce, data, aad)
+
+    def seal_batch(self, items):
+        """Seal (data, aad) pairs under consecutive nonces, return the sealed messages in order"""
+        encrypt = self.cipher.encrypt
+        return [
+            nonce + encrypt(nonce, data, aad)
+            for nonce, (data, aad) in zip(self._nonces(len(items)), items)
+        ]
+
+    def open(self, sealed, aad=None, replay=False):
+        """
+        Decrypt a message sealed by the peer. Raises InvalidTag if it
+        fails authentication and, with replay, ReplayError if it was
+        opened before or was sealed in this session's own direction.
+        """
+        plaintext, epoch, counter = self._decrypt(sealed, aad, replay)
+        if replay:
+            with self.lock:
+                self._accept(epoch, counter)
+        return plaintext
+
+    def open_batch(self, items, replay=False):
+        """
+        Open (sealed, aad) pairs, return their plaintexts in order; one
+        that fails gives its InvalidTag or ReplayError in its place
+        """
+        results = []
+        for sealed, aad in items:
+            try:
+                results.append(self._decrypt(sealed, aad, replay))
+            except (InvalidTag, ReplayError) as e:
+                results.append(e)
+        if replay:
+            # The window is moved once for the whole batch
+            with self.lock:
+                for index, result in enumerate(results):
+                    if isinstance(result, Exception):
+                        continue
+                    try:
+                        self._accept(result[1], result[2])
+                    except ReplayError as e:
+                        results[index] = e
+        return [result if isinstance(result, Exception) else result[0] for result in results]
+
+    def _decrypt(self, sealed, aad, replay):
+        """Return (plaintext, epoch, counter) of a sealed message"""
+        view = memoryview(sealed)
+        if len(view) < NONCE.size + TAG_SIZE:
+            raise InvalidTag()
+        nonce = view[:NONCE.size]
+        epoch, counter = NONCE.unpack(nonce)
+        if replay and epoch & SERVER_TO_CLIENT == self.direction:
+            raise ReplayError("Message sealed in this session's own direction")
+        return self.cipher.decrypt(nonce, view[NONCE.size:], aad), epoch, counter
+
+    def _accept(self, epoch, counter):
+        """
+        Record an authenticated counter, so forged nonces can't move the
+        window; raise ReplayError if it was seen. Call with the lock held.
+        """
+        window = self.windows.get(epoch)
+        if window is None:
+            window = self.windows[epoch] = ReplayWindow()
+            if len(self.windows) > MAX_EPOCHS:
+                self.windows.popitem(last=False)
+        elif epoch != self.peer_epoch:
+            self.windows.move_to_end(epoch)
+        self.peer_epoch = epoch
+        if window.seen(counter):
+            raise ReplayError("Message opened before")
+        window.add(counter)
@@ -4,17 +4,22 @@ DNS Tunnel Pro - Client
 Copyright (c) 2025 Mr-X-01
 """
 
-import os
 import sys
 import json
 import base64
 import time
 import logging
-import socket
+import asyncio
 import threading
-import requests
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import argparse
+from tunnel_codec import ANSWER_TYPES, TYPE_PREFERENCE, HEAD_LENGTH
+from resolvers import ResolverPool
+from transport import TunnelTransport, AsyncTunnel
+from header_table import HeaderEncoder, HeaderDecoder
+from crypto_session import CryptoSession, CLIENT_TO_SERVER
+from scheduler import QueryScheduler, TrafficClassifier
+from socks5 import Socks5Server
+from field_bench import FieldBench, DOWN_URL, UP_URL
 
 # Setup logging
 logging.basicConfig(
@@ -23,6 +28,60 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade'
+}
+
+
+class ResponseParser:
+    """
+    Split a tunnel response stream into its head and body. Indexed header
+    blocks are decoded with the given header table. With raw=True the head
+    is rendered as an HTTP/1.1 status line and headers for the SOCKS
+    client; the connection is closed after the body.
+    """
+    
+    def __init__(self, header_table, raw=True):
+        self.header_table = header_table
+        self.raw = raw
+        self.buffer = b''
+        self.head = None
+    
+    def feed(self, chunk):
+        """Return the parts of a chunk ready to be written to the client"""
+        if self.head is not None:
+            return [chunk]
+        
+        self.buffer += chunk
+        if len(self.buffer) < HEAD_LENGTH.size:
+            return []
+        (length,) = HEAD_LENGTH.unpack_from(self.buffer)
+        if len(self.buffer) < HEAD_LENGTH.size + length:
+            return []
+        
+        self.head = json.loads(self.buffer[HEAD_LENGTH.size:HEAD_LENGTH.size + length])
+        headers = self.head.get('headers') or {}
+        if 'fields' in headers:
+            self.head['headers'] = self.header_table.decode(headers)
+        else:
+            self.head['headers'] = list(headers.items())
+        body = self.buffer[HEAD_LENGTH.size + length:]
+        self.buffer = b''
+        
+        parts = [self._render_head()] if self.raw else []
+        if body:
+            parts.append(body)
+        return parts
+    
+    def _render_head(self):
+        lines = [f"HTTP/1.1 {self.head['status_code']} {self.head.get('reason') or ''}"]
+        for name, value in self.head['headers']:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                lines.append(f"{name}: {value}")
+        lines.append('Connection: close')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+
 
 class DNSTunnelClient:
     """DNS Tunnel Client"""
@@ -35,7 +94,56 @@ class DNSTunnelClient:
         
         # Initialize encryption
         key_bytes = base64.b64decode(self.config['encryption_key'])
-        self.aesgcm = AESGCM(key_bytes)
+        self.crypto = CryptoSession(key_bytes, CLIENT_TO_SERVER)
+        
+        # Header tables shared with the server session, one per direction
+        self.request_headers = HeaderEncoder(self.config['header_table_size'])
+        self.response_headers = HeaderDecoder(self.config['header_table_size'], acknowledge=True)
+        
+        # Answer record type used for tunnel replies ('auto' is probed)
+        answer_type = self.config['answer_type']
+        if answer_type == 'auto':
+            answer_type = 'TXT'
+        
+        # Interactive connections jump ahead of bulk ones for query slots
+        scheduler = None
+        if self.config['qos']:
+            scheduler = QueryScheduler(
+                self.config['qos_interactive_weight'], self.config['qos_interactive_reserve']
+            )
+        self.classifier = TrafficClassifier(self.config['qos_rules'])
+        
+        # Queries are striped over all configured resolvers
+        self.pool = ResolverPool(
+            self.config['doh_resolvers'],
+            self.config['dns_domain'],
+            window=self.config['resolver_window'],
+            timeout=self.config['query_timeout'],
+            answer_type=answer_type,
+            min_answer=self.config['mtu_min_answer'],
+            max_answer=self.config['mtu_max_answer'],
+            probe_attempts=self.config['mtu_probe_attempts'],
+            mtu_interval=self.config['mtu_probe_interval'],
+            loss_threshold=self.config['mtu_loss_threshold'],
+            min_rto=self.config['min_rto'],
+            scheduler=scheduler
+        )
+        self.transport = TunnelTransport(
+            self.pool,
+            self.config['client_id'],
+            self.config['dns_domain'],
+            self.crypto,
+            retries=self.config['retries'],
+            response_timeout=self.config['response_timeout'],
+            reorder_window=self.config['reorder_window'],
+            poll_hold=self.config['poll_hold'],
+            max_poll_interval=self.config['max_poll_interval'],
+            fec_group=self.config['fec_group'],
+            batch_delay=self.config['batch_delay'],
+            bulk_bytes=self.config['qos_bulk_bytes'],
+            max_streams=self.config['tunnel_streams']
+        )
+        self.async_tunnel = AsyncTunnel(self.transport, self.config['tunnel_concurrency'])
         
         logger.info(f"Client initialized: {self.config['client_id'][:16]}...")
     
@@ -45,13 +153,54 @@ class DNSTunnelClient:
             with open(config_path, 'r') as f:
                 self.config = json.load(f)
             
-            required_keys = ['client_id', 'encryption_key', 'dns_domain', 'doh_resolver']
+            required_keys = ['client_id', 'encryption_key', 'dns_domain']
             for key in required_keys:
                 if key not in self.config:
                     raise ValueError(f"Missing required config key: {key}")
             
+            # A single 'doh_resolver' is still accepted
+            if 'doh_resolvers' not in self.config:
+                if 'doh_resolver' not in self.config:
+                    raise ValueError("Missing required config key: doh_resolvers")
+                self.config['doh_resolvers'] = [self.config['doh_resolver']]
+            if not self.config['doh_resolvers']:
+                raise ValueError("doh_resolvers must not be empty")
+            
             # Set defaults
             self.config.setdefault('socks5_port', 1080)
+            self.config.setdefault('socks5_host', '127.0.0.1')
+            self.config.setdefault('socks5_backlog', 1024)
+            self.config.setdefault('socks5_max_connections', 4096)
+            self.config.setdefault('tunnel_concurrency', 32)
+            self.config.setdefault('tunnel_streams', 128)
+            self.config.setdefault('request_timeout', 30)
+            self.config.setdefault('reorder_window', 262144)
+            self.config.setdefault('answer_type', 'auto')
+            self.config.setdefault('mtu_min_answer', 32)
+            self.config.setdefault('mtu_max_answer', 4096)
+            self.config.setdefault('mtu_probe_attempts', 2)
+            self.config.setdefault('mtu_probe_interval', 600)
+            self.config.setdefault('mtu_loss_threshold', 0.9)
+            self.config.setdefault('resolver_window', 8)
+            self.config.setdefault('query_timeout', 5)
+            self.config.setdefault('retries', 4)
+            self.config.setdefault('response_timeout', 30)
+            self.config.setdefault('poll_hold', 1.5)
+            self.config.setdefault('max_poll_interval', 5)
+            self.config.setdefault('min_rto', 0.2)
+            self.config.setdefault('fec_group', 0)
+            self.config.setdefault('batch_delay', 0.005)
+            self.config.setdefault('header_table_size', 4096)
+            self.config.setdefault('qos', True)
+            self.config.setdefault('qos_interactive_weight', 8)
+            self.config.setdefault('qos_interactive_reserve', 0.25)
+            self.config.setdefault('qos_bulk_bytes', 262144)
+            self.config.setdefault('qos_rules', [])
+            self.config.setdefault('stats_interval', 60)
+            self.config.setdefault('health_check_interval', 30)
+            
+            if self.config['answer_type'] != 'auto' and self.config['answer_type'] not in ANSWER_TYPES:
+                raise ValueError(f"Unsupported answer_type: {self.config['answer_type']}")
             
             logger.info(f"Configuration loaded from {config_path}")
             
@@ -66,20 +215,30 @@ class DNSTunnelClient:
         logger.info("DNS Tunnel Pro Client Starting...")
         logger.info("=" * 60)
         logger.info(f"DNS Domain: {self.config['dns_domain']}")
-        logger.info(f"DoH Resolver: {self.config['doh_resolver']}")
+        for url in self.config['doh_resolvers']:
+            logger.info(f"DoH Resolver: {url}")
         logger.info(f"SOCKS5 Port: {self.config['socks5_port']}")
         logger.info("=" * 60)
         
+        self.discover_paths()
+        self.pool.start_health_checks(self.config['health_check_interval'])
+        
         # Start SOCKS5 proxy server
         self.start_socks_server()
         
         logger.info("Client is ready!")
-        logger.info(f"Use SOCKS5 proxy: 127.0.0.1:{self.config['socks5_port']}")
+        logger.info(f"Use SOCKS5 proxy: {self.config['socks5_host']}:{self.config['socks5_port']}")
         logger.info("=" * 60)
         
         try:
+            last_stats = time.time()
             while self.running:
                 time.sleep(1)
+                interval = self.config['stats_interval']
+                if interval and time.time() - last_stats >= interval:
+                    last_stats = time.time()
+                    stats = self.stats()
+                    logger.info(f"Transport: {stats['transport']} QoS: {stats['qos']}")
         except KeyboardInterrupt:
             logger.info("\nShutting down...")
             self.stop()
@@ -87,6 +246,7 @@ class DNSTunnelClient:
     def stop(self):
         """Stop the client"""
         self.running = False
+        self.pool.stop()
         if self.socks_server:
             self.socks_server.close()
         logger.info("Client stopped")
@@ -94,263 +254,222 @@ class DNSTunnelClient:
     def start_socks_server(self):
         """Start local SOCKS5 server"""
         try:
-            self.socks_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socks_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socks_server.bind(('127.0.0.1', self.config['socks5_port']))
-            self.socks_server.listen(5)
-            
-            logger.info(f"SOCKS5 server started on 127.0.0.1:{self.config['socks5_port']}")
+            self.socks_server = Socks5Server(
+                self._proxy_connection,
+                host=self.config['socks5_host'],
+                port=self.config['socks5_port'],
+                backlog=self.config['socks5_backlog'],
+                max_connections=self.config['socks5_max_connections'],
+                username=self.config.get('socks5_username'),
+                password=self.config.get('socks5_password')
+            )
+            self.socks_server.bind()
             
-            # Accept connections in background
-            accept_thread = threading.Thread(target=self._accept_connections, daemon=True)
-            accept_thread.start()
+            # Serve all connections from one event loop in the background
+            socks_thread = threading.Thread(target=self.socks_server.run, daemon=True)
+            socks_thread.start()
             
         except Exception as e:
             logger.error(f"Failed to start SOCKS5 server: {e}")
             sys.exit(1)
     
-    def _accept_connections(self):
-        """Accept incoming SOCKS5 connections"""
-        while self.running:
-            try:
-                client_sock, addr = self.socks_server.accept()
-                logger.debug(f"New connection from {addr}")
-                
-                # Handle in new thread
-                handler = threading.Thread(
-                    target=self._handle_socks_connection,
-                    args=(client_sock,),
-                    daemon=True
-                )
-                handler.start()
-                
-            except Exception as e:
-                if self.running:
-                    logger.error(f"Error accepting connection: {e}")
-    
-    def _handle_socks_connection(self, client_sock):
-        """Handle SOCKS5 connection"""
-        try:
-            # SOCKS5 handshake
-            data = client_sock.recv(256)
-            if len(data) < 2 or data[0] != 0x05:
-                client_sock.close()
-                return
-            
-            # No authentication
-            client_sock.sendall(b'\x05\x00')
-            
-            # Get request
-            data = client_sock.recv(4)
-            if len(data) < 4:
-                client_sock.close()
-                return
-            
-            cmd = data[1]
-            atyp = data[3]
-            
-            if cmd != 0x01:  # Only support CONNECT
-                client_sock.sendall(b'\x05\x07\x00\x01\x00\x00\x00\x00\x00\x00')
-                client_sock.close()
-                return
-            
-            # Parse address
-            if atyp == 0x01:  # IPv4
-                addr = socket.inet_ntoa(client_sock.recv(4))
-            elif atyp == 0x03:  # Domain
-                length = client_sock.recv(1)[0]
-                addr = client_sock.recv(length).decode()
-            else:
-                client_sock.sendall(b'\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00')
-                client_sock.close()
-                return
-            
-            # Get port
-            port = int.from_bytes(client_sock.recv(2), 'big')
-            
-            logger.debug(f"CONNECT {addr}:{port}")
-            
-            # Send success response
-            client_sock.sendall(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
-            
-            # Proxy the connection through DNS tunnel
-            self._proxy_connection(client_sock, addr, port)
-            
-        except Exception as e:
-            logger.error(f"SOCKS connection error: {e}")
-        finally:
-            client_sock.close()
-    
-    def _proxy_connection(self, client_sock, target_host, target_port):
-        """Proxy connection through DNS tunnel"""
+    async def _proxy_connection(self, reader, writer, target_host, target_port):
+        """Proxy an HTTP request from a SOCKS connection through the tunnel"""
         try:
-            # For now, implement simple HTTP proxy
-            # In production, this would use full bidirectional tunneling
-            
-            # Read client request
-            request_data = b''
-            client_sock.settimeout(5)
-            
-            while True:
-                try:
-                    chunk = client_sock.recv(4096)
-                    if not chunk:
-                        break
-                    request_data += chunk
-                    
-                    # Check if HTTP request is complete
-                    if b'\r\n\r\n' in request_data:
+            request = await asyncio.wait_for(
+                self._read_http_request(reader), self.config['request_timeout']
+            )
+        except (ValueError, asyncio.LimitOverrunError) as e:
+            logger.debug(f"HTTP parsing error: {e}")
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            return
+        
+        if request is None:
+            return
+        method, path, headers, body = request
+        
+        # Build full URL (proxy-style requests already carry one)
+        if path.startswith('http://') or path.startswith('https://'):
+            url = path
+        else:
+            host = f'[{target_host}]' if ':' in target_host else target_host
+            url = f"http://{host}:{target_port}{path}"
+        
+        # Send through DNS tunnel and relay the response as it arrives
+        # A session the server lost rejects the header table once; the
+        # request is then resent against a fresh one
+        traffic_class = self.classifier.classify(target_host, target_port)
+        for attempt in range(2):
+            blob, block_id = self._seal_request(url, method, headers, body)
+            parser = ResponseParser(self.response_headers)
+            chunks = self.async_tunnel.stream(blob, traffic_class=traffic_class)
+            try:
+                async for chunk in chunks:
+                    parts = parser.feed(chunk)
+                    if not attempt and self._table_reset(parser.head):
                         break
-                except socket.timeout:
-                    break
-            
-            if not request_data:
+                    for part in parts:
+                        writer.write(part)
+                        await writer.drain()
+            finally:
+                await chunks.aclose()
+                self._settle_headers(block_id, parser.head)
+            if attempt or not self._table_reset(parser.head):
                 return
-            
-            # Parse HTTP request
-            try:
-                request_line = request_data.split(b'\r\n')[0].decode()
-                method, path, _ = request_line.split(' ')
-                
-                # Build full URL
-                url = f"http://{target_host}:{target_port}{path}"
-                
-                # Send through DNS tunnel
-                response_data = self.send_request(url, method, request_data)
-                
-                if response_data:
-                    # Send response back to client
-                    client_sock.sendall(response_data)
-                    
-            except Exception as e:
-                logger.debug(f"HTTP parsing error: {e}")
-                
-        except Exception as e:
-            logger.error(f"Proxy error: {e}")
     
-    def send_request(self, url, method='GET', data=None):
-        """Send HTTP request through DNS tunnel"""
+    async def _read_http_request(self, reader):
+        """Read one HTTP request head and its Content-Length or chunked body"""
         try:
-            # Prepare request payload
-            request_payload = {
-                'url': url,
-                'method': method,
-                'headers': {},
-                'body': base64.b64encode(data).decode() if data else None
-            }
-            
-            # Encrypt payload
-            payload_json = json.dumps(request_payload)
-            nonce = os.urandom(12)
-            ciphertext = self.aesgcm.encrypt(nonce, payload_json.encode(), None)
-            encrypted_payload = base64.b64encode(nonce + ciphertext).decode()
-            
-            # Prepare DNS query data
-            tunnel_data = {
-                'client_id': self.config['client_id'],
-                'payload': encrypted_payload
-            }
-            
-            # Encode for DNS subdomain
-            encoded = self._encode_for_dns(tunnel_data)
-            
-            # Make DoH query
-            response = self._query_doh(encoded)
-            
-            if response and 'payload' in response:
-                # Decrypt response
-                encrypted_response = base64.b64decode(response['payload'])
-                nonce = encrypted_response[:12]
-                ciphertext = encrypted_response[12:]
-                
-                plaintext = self.aesgcm.decrypt(nonce, ciphertext, None)
-                response_data = json.loads(plaintext)
-                
-                # Extract response body
-                if 'body' in response_data:
-                    return base64.b64decode(response_data['body'])
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Request error: {e}")
-            return None
-    
-    def _encode_for_dns(self, data):
-        """Encode data for DNS subdomain"""
-        # Serialize to JSON
-        json_data = json.dumps(data)
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise ValueError("Truncated request head")
         
-        # Base64 encode (DNS-safe)
-        encoded = base64.b64encode(json_data.encode()).decode()
-        encoded = encoded.replace('+', '-').replace('/', '_').replace('=', '')
+        lines = head.decode('latin-1').split('\r\n')
+        method, path, _ = lines[0].split(' ', 2)
         
-        # Split into DNS labels (max 63 chars each)
-        labels = [encoded[i:i+63] for i in range(0, len(encoded), 63)]
+        headers = {}
+        codings = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'transfer-encoding':
+                codings += [c.strip().lower() for c in value.split(',') if c.strip()]
+            # Hop-by-hop headers are meaningless past the proxy
+            if name.strip().lower() in HOP_BY_HOP_HEADERS:
+                continue
+            headers[name.strip()] = value.strip()
         
-        # Create subdomain
-        subdomain = '.'.join(labels) + '.' + self.config['dns_domain']
+        body = b''
+        lengths = [v for k, v in headers.items() if k.lower() == 'content-length']
+        if codings:
+            # The body is forwarded decoded, its length set by the server
+            if codings != ['chunked']:
+                raise ValueError(f"Unsupported transfer coding {', '.join(codings)}")
+            headers = {k: v for k, v in headers.items() if k.lower() != 'content-length'}
+            body = await self._read_chunked(reader)
+        elif lengths:
+            body = await reader.readexactly(int(lengths[0]))
         
-        return subdomain
+        return method, path, headers, body
     
-    def _query_doh(self, domain):
-        """Query DoH resolver"""
+    async def _read_chunked(self, reader):
+        """Read and decode a chunked request body, trailers included"""
+        parts = []
         try:
-            params = {
-                'name': domain,
-                'type': 'TXT'
-            }
-            
-            headers = {
-                'Accept': 'application/dns-json'
-            }
-            
-            response = requests.get(
-                self.config['doh_resolver'],
-                params=params,
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Extract TXT record
-                if 'Answer' in data:
-                    for answer in data['Answer']:
-                        if answer['type'] == 16:  # TXT record
-                            txt_data = answer['data'].strip('"')
-                            return self._decode_from_dns(txt_data)
-            
-            return None
-            
-        except Exception as e:
-            logger.debug(f"DoH query error: {e}")
-            return None
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                size = int(line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    break
+                parts.append(await reader.readexactly(size))
+                if await reader.readexactly(2) != b'\r\n':
+                    raise ValueError("Malformed chunk")
+            # Trailers are dropped like the other hop-by-hop fields
+            while await reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+        except asyncio.IncompleteReadError:
+            raise ValueError("Truncated chunked body")
+        return b''.join(parts)
+    
+    def _seal_request(self, url, method, headers, body):
+        """
+        Serialize and encrypt a request message, return it with the id of
+        its header block
+        """
+        block, block_id = {}, None
+        if headers:
+            block, block_id = self.request_headers.encode(headers.items())
+        request_payload = {
+            'url': url,
+            'method': method,
+            'headers': block
+        }
+        if body:
+            request_payload['body'] = base64.b64encode(body).decode()
+        # Response header blocks decoded since the last request
+        table_id, acks = self.response_headers.take_acknowledgements()
+        if acks:
+            request_payload['header_acks'] = [table_id] + acks
+        
+        payload_json = json.dumps(request_payload, separators=(',', ':'))
+        return self.crypto.seal(payload_json.encode()), block_id
+    
+    @staticmethod
+    def _table_reset(head):
+        """Whether the server lost the request header table"""
+        return head is not None and bool(head.get('header_table_reset'))
     
-    def _decode_from_dns(self, encoded):
-        """Decode data from DNS response"""
+    def _settle_headers(self, block_id, head):
+        """
+        Once a response is over, mark its request's header block decoded
+        (the server answered it) or lost
+        """
+        if self._table_reset(head):
+            self.request_headers.reset()
+        elif head is not None and 'error' not in head:
+            self.request_headers.acknowledge(block_id)
+        else:
+            self.request_headers.release(block_id)
+    
+    def stats(self):
+        """Resolver, transport and per traffic class QoS counters"""
+        return {
+            'resolvers': self.pool.snapshot(),
+            'transport': self.transport.snapshot(),
+            'qos': self.pool.qos_snapshot(),
+        }
+    
+    def discover_paths(self):
+        """Probe answer types and path sizes of every resolver"""
+        if self.config['answer_type'] == 'auto':
+            types = TYPE_PREFERENCE
+        else:
+            types = [self.config['answer_type']]
+        logger.info("Probing resolver paths...")
+        self.pool.discover_all(types)
+    
+    def send_request(self, url, method='GET', data=None, headers=None):
+        """Send HTTP request through DNS tunnel"""
         try:
-            # Restore base64
-            encoded = encoded.replace('-', '+').replace('_', '/')
-            padding = 4 - (len(encoded) % 4)
-            if padding != 4:
-                encoded += '=' * padding
+            # Send through the tunnel, fragmented over all resolvers
+            for attempt in range(2):
+                blob, block_id = self._seal_request(url, method, headers or {}, data)
+                parser = ResponseParser(self.response_headers, raw=False)
+                try:
+                    body = b''.join(
+                        part for chunk in self.transport.open_stream(blob)
+                        for part in parser.feed(chunk)
+                    )
+                finally:
+                    self._settle_headers(block_id, parser.head)
+                if not self._table_reset(parser.head):
+                    break
             
-            # Decode
-            decoded = base64.b64decode(encoded)
-            return json.loads(decoded)
+            if parser.head is None or 'error' in parser.head:
+                return None
+            return body
             
         except Exception as e:
-            logger.debug(f"Decode error: {e}")
+            logger.error(f"Request error: {e}")
             return None
 
-
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(description='DNS Tunnel Pro Client')
-    parser.add_argument('action', choices=['connect', 'test'], help='Action to perform')
+    parser.add_argument('action', choices=['connect', 'test', 'bench'], help='Action to perform')
     parser.add_argument('config', help='Path to configuration file')
+    bench = parser.add_argument_group('bench')
+    bench.add_argument('--output', help='JSON report path (default: bench-<time>.json)')
+    bench.add_argument('--levels', default='1,4,16', help='Comma-separated concurrency levels')
+    bench.add_argument('--size', type=int, default=262144, help='Download size in bytes')
+    bench.add_argument('--upload', type=int, default=65536, help='Upload size in bytes')
+    bench.add_argument('--down-url', default=DOWN_URL, help='URL returning {size} bytes')
+    bench.add_argument('--up-url', default=UP_URL, help='URL accepting POST bodies')
+    bench.add_argument('--probes', type=int, default=10, help='RTT probes per resolver')
     
     args = parser.parse_args()
     
@@ -359,12 +478,32 @@ def main():
         client.start()
     elif args.action == 'test':
         client = DNSTunnelClient(args.config)
+        client.discover_paths()
         logger.info("Testing connection...")
         response = client.send_request('http://example.com', 'GET')
         if response:
             logger.info(f"✓ Connection test successful! ({len(response)} bytes received)")
         else:
             logger.error("✗ Connection test failed")
+    elif args.action == 'bench':
+        client = DNSTunnelClient(args.config)
+        report = FieldBench(
+            client, args.down_url, args.up_url, args.size, args.upload,
+            [int(level) for level in args.levels.split(',')], args.probes
+        ).run()
+        output = args.output or time.strftime('bench-%Y%m%d-%H%M%S.json')
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for resolver in report['resolvers']:
+            logger.info(f"{resolver['url']}: RTT p50 {resolver['rtt_ms_p50']} ms, "
+                        f"{resolver['answer_type']} answers of "
+                        f"{resolver['answer_bytes'].get(resolver['answer_type'])} bytes, "
+                        f"query names of {resolver['qname_chars']} chars")
+        for direction in ('downstream', 'upstream'):
+            for level in report[direction]:
+                logger.info(f"{direction} x{level['concurrency']}: {level['goodput_kib_s']} KiB/s, "
+                            f"{level['failed']}/{level['requests']} failed, loss {level['loss_rate']}")
+        logger.info(f"✓ Report written to {output} (loss rate {report['loss_rate']})")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+"""
+DNS Tunnel Pro - Field benchmark
+Copyright (c) 2025 Mr-X-01
+"""
+
+import time
+import logging
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from resolvers import QueryRefused
+
+logger = logging.getLogger(__name__)
+
+# Speed test endpoints answering any size: GET returns {size} bytes,
+# POST swallows the body
+DOWN_URL = 'https://speed.cloudflare.com/__down?bytes={size}'
+UP_URL = 'https://speed.cloudflare.com/__up'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class FieldBench:
+    """
+    Measures a tunnel the way a user's network sees it, using the real
+    client config: the RTT of each resolver, the largest query names and
+    answers that pass it, goodput both ways at several concurrency levels
+    and the share of queries lost. The report is a plain dict, meant to
+    be saved as JSON and compared across networks and versions.
+    """
+
+    def __init__(self, client, down_url=DOWN_URL, up_url=UP_URL, size=262144,
+                 upload=65536, levels=(1, 4, 16), probes=10):
+        self.client = client
+        self.pool = client.pool
+        self.transport = client.transport
+        self.down_url = down_url
+        self.up_url = up_url
+        self.size = size
+        self.upload = upload
+        self.levels = levels
+        self.probes = probes
+
+    def run(self):
+        started = time.time()
+        logger.info("Probing resolver paths...")
+        discovery = time.time()
+        self.client.discover_paths()
+        discovery = time.time() - discovery
+
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(started)),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'dns_domain': self.client.config['dns_domain'],
+            'settings': {
+                key: self.client.config[key] for key in (
+                    'answer_type', 'fec_group', 'batch_delay', 'resolver_window',
+                    'tunnel_concurrency', 'tunnel_streams', 'qos'
+                )
+            },
+            'discovery_s': round(discovery, 2),
+            'resolvers': [self._resolver(r) for r in self.pool.resolvers],
+            'downstream': [],
+            'upstream': [],
+        }
+        for level in self.levels:
+            for direction in ('downstream', 'upstream'):
+                logger.info(f"Measuring {direction} goodput with {level} concurrent requests...")
+                report[direction].append(self._goodput(direction, level))
+
+        queries = sum(r.queries for r in self.pool.resolvers)
+        errors = sum(r.errors for r in self.pool.resolvers)
+        report['queries'] = queries
+        report['loss_rate'] = round(errors / queries, 4) if queries else None
+        report['duration_s'] = round(time.time() - started, 1)
+        return report
+
+    def _resolver(self, resolver):
+        """RTT of small probes and path sizes found for one resolver"""
+        rtts = []
+        lost = 0
+        refused = 0
+        for _ in range(self.probes):
+            start = time.time()
+            try:
+                ok = self.pool.probe(resolver, resolver.answer_type, 16)
+            except QueryRefused:
+                # Rate-limited by the server, not lost on the path
+                refused += 1
+                continue
+            if ok:
+                rtts.append(time.time() - start)
+            else:
+                lost += 1
+        return {
+            'url': resolver.url,
+            'answer_type': resolver.answer_type,
+            # Largest answer per record type and longest query name passing
+            'answer_bytes': dict(resolver.answer_capacity),
+            'qname_chars': resolver.up_mtu,
+            'rtt_ms_min': _ms(min(rtts)) if rtts else None,
+            'rtt_ms_p50': _ms(percentile(rtts, 50)) if rtts else None,
+            'rtt_ms_p90': _ms(percentile(rtts, 90)) if rtts else None,
+            'probe_loss': round(lost / self.probes, 3) if self.probes else None,
+            'probe_refused': refused,
+        }
+
+    def _goodput(self, direction, concurrency):
+        """Run 2 x concurrency requests, concurrency at a time, in one direction"""
+        if direction == 'downstream':
+            url, method, body = self.down_url.format(size=self.size), 'GET', None
+        else:
+            url, method, body = self.up_url, 'POST', b'\0' * self.upload
+
+        def request(_):
+            start = time.time()
+            response = self.client.send_request(url, method, body)
+            return response, time.time() - start
+
+        before = self.transport.snapshot()
+        lost = sum(r.errors for r in self.pool.resolvers)
+        sent = sum(r.queries for r in self.pool.resolvers)
+        start = time.time()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(request, range(2 * concurrency)))
+        wall = time.time() - start
+        after = self.transport.snapshot()
+        lost = sum(r.errors for r in self.pool.resolvers) - lost
+        sent = sum(r.queries for r in self.pool.resolvers) - sent
+
+        done = [(response, elapsed) for response, elapsed in results if response is not None]
+        if direction == 'downstream':
+            moved = sum(len(response) for response, _ in done)
+        else:
+            moved = len(body) * len(done)
+        queries = after['queries'] - before['queries']
+        payload = (after['payload_up'] + after['payload_down']
+                   - before['payload_up'] - before['payload_down'])
+        latency = [elapsed for _, elapsed in done]
+        return {
+            'concurrency': concurrency,
+            'requests': len(results),
+            'failed': len(results) - len(done),
+            'bytes': moved,
+            'goodput_kib_s': round(moved / wall / 1024, 1),
+            'request_ms_p50': _ms(percentile(latency, 50)) if latency else None,
+            'request_ms_max': _ms(max(latency)) if latency else None,
+            'queries': queries,
+            'payload_per_query': round(payload / queries, 1) if queries else None,
+            'loss_rate': round(lost / sent, 4) if sent else None,
+        }
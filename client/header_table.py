@@ -0,0 +1,241 @@
+"""
+DNS Tunnel Pro - Indexed HTTP header tables
+Copyright (c) 2025 Mr-X-01
+"""
+
+import os
+import threading
+
+# Per-entry overhead counted against the table size, as in HPACK
+ENTRY_OVERHEAD = 32
+
+# Credentials are never stored in a table
+NEVER_INDEXED = frozenset(('authorization', 'proxy-authorization'))
+
+# Values that change on almost every message are sent against an indexed
+# name but never inserted, so they don't churn the table
+VOLATILE = frozenset(('content-length', 'date', 'age', 'expires'))
+
+
+class HeaderTableError(Exception):
+    """A header block referred to an entry the decoder doesn't have"""
+
+
+class HeaderEncoder:
+    """
+    Encodes header lists against a table shared with the peer's decoder.
+    Blocks can be decoded out of order, so an entry is only referred to
+    once the peer has acknowledged the block that inserted it, and
+    entries used by blocks still in flight are never evicted. Eviction is
+    oldest first; every block carries the oldest live index (its base)
+    so the decoder drops what the encoder evicted.
+
+    A block is a JSON-ready dict whose fields are, relative to the base:
+    n (the entry's name and value), [name, value] or [name, value, n]
+    (a literal inserted as entry n); name may be an entry's index.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every entry; the next block makes the decoder start over"""
+        with self.lock:
+            self.table_id = int.from_bytes(os.urandom(4), 'big')
+            # index -> [name, value, acknowledged, blocks using it]
+            self.entries = {}
+            self.pairs = {}
+            self.names = {}
+            self.blocks = {}
+            self.base = 0
+            self.next_index = 0
+            self.next_block = 0
+            self.size = 0
+
+    def encode(self, headers):
+        """Encode (name, value) pairs, return (block, block id)"""
+        with self.lock:
+            fields = []
+            used = []
+            inserted = []
+            for name, value in headers:
+                name, value = str(name), str(value)
+                lower = name.lower()
+                index = self.pairs.get((name, value))
+                if index is not None and self.entries[index][2]:
+                    fields.append(index)
+                    self._pin(index, used)
+                    continue
+
+                name_index = self.names.get(name)
+                if name_index is not None:
+                    self._pin(name_index, used)
+                key = name if name_index is None else name_index
+                if lower in NEVER_INDEXED or lower in VOLATILE or index is not None:
+                    fields.append([key, value])
+                    continue
+                index = self._insert(name, value)
+                if index is None:
+                    fields.append([key, value])
+                else:
+                    fields.append([key, value, index])
+                    self._pin(index, inserted)
+
+            block_id = self.next_block
+            self.next_block += 1
+            self.blocks[block_id] = (used + inserted, inserted)
+
+            # Entries still used are pinned, so none is below the base
+            block = {
+                'table': self.table_id,
+                'id': block_id,
+                'base': self.base,
+                'fields': [self._relative(field) for field in fields],
+            }
+            return block, block_id
+
+    def _pin(self, index, indexes):
+        """Keep an entry a block uses from eviction until the block is done"""
+        self.entries[index][3] += 1
+        indexes.append(index)
+
+    def _relative(self, field):
+        if isinstance(field, int):
+            return field - self.base
+        key = field[0] - self.base if isinstance(field[0], int) else field[0]
+        return [key] + field[1:2] + [index - self.base for index in field[2:]]
+
+    def _insert(self, name, value):
+        """Add an entry, evicting the oldest unused ones; None if it can't fit"""
+        size = len(name) + len(value) + ENTRY_OVERHEAD
+        if size > self.max_size:
+            return None
+        while self.size + size > self.max_size:
+            oldest = self.entries[self.base]
+            if oldest[3]:
+                return None
+            self._evict()
+        index = self.next_index
+        self.next_index += 1
+        self.entries[index] = [name, value, False, 0]
+        self.pairs.setdefault((name, value), index)
+        self.size += size
+        return index
+
+    def _evict(self):
+        name, value, _, _ = self.entries.pop(self.base)
+        self.size -= len(name) + len(value) + ENTRY_OVERHEAD
+        if self.pairs.get((name, value)) == self.base:
+            del self.pairs[(name, value)]
+        if self.names.get(name) == self.base:
+            del self.names[name]
+        self.base += 1
+
+    def acknowledge(self, block_id):
+        """The peer decoded a block: its entries may now be referred to"""
+        with self.lock:
+            block = self.blocks.pop(block_id, None)
+            if block is None:
+                return
+            used, inserted = block
+            for index in inserted:
+                # Insertion pins, so the entry is still there
+                entry = self.entries[index]
+                entry[2] = True
+                self.names[entry[0]] = index
+            self._unpin(used)
+
+    def release(self, block_id):
+        """A block will never be decoded (or its outcome is unknown)"""
+        with self.lock:
+            block = self.blocks.pop(block_id, None)
+            if block is not None:
+                self._unpin(block[0])
+
+    def _unpin(self, indexes):
+        for index in indexes:
+            self.entries[index][3] -= 1
+
+
+class HeaderDecoder:
+    """
+    Decodes blocks of a HeaderEncoder in any order. The table is capped
+    at max_size, which must not be below the encoder's. With acknowledge
+    the ids of decoded blocks that inserted entries are kept for the
+    owner to send back to the encoder; other blocks are left to the
+    encoder to release.
+    """
+
+    def __init__(self, max_size=4096, acknowledge=False):
+        self.max_size = max_size
+        self.acknowledge = acknowledge
+        self.lock = threading.Lock()
+        self.table_id = None
+        self.entries = {}
+        self.base = 0
+        self.size = 0
+        self.decoded = []
+
+    def decode(self, block):
+        """Return the (name, value) pairs of a block, storing its new entries"""
+        with self.lock:
+            if block['table'] != self.table_id:
+                # The encoder started over
+                self.table_id = block['table']
+                self.entries = {}
+                self.base = 0
+                self.size = 0
+                self.decoded = []
+
+            base = block['base']
+            if base > self.base:
+                for index in [i for i in self.entries if i < base]:
+                    self._drop(index)
+                self.base = base
+
+            headers = []
+            inserted = False
+            for field in block['fields']:
+                if isinstance(field, int):
+                    headers.append(self._entry(base + field))
+                    continue
+                name, value = field[0], field[1]
+                if isinstance(name, int):
+                    name = self._entry(base + name)[0]
+                if len(field) > 2 and base + field[2] >= self.base:
+                    self._store(base + field[2], name, value)
+                    inserted = True
+                headers.append((name, value))
+
+            if self.acknowledge and inserted:
+                self.decoded.append(block['id'])
+            return headers
+
+    def take_acknowledgements(self):
+        """Return the table id and the ids of blocks decoded since the last call"""
+        with self.lock:
+            decoded = self.decoded
+            self.decoded = []
+            return self.table_id, decoded
+
+    def _entry(self, index):
+        entry = self.entries.get(index)
+        if entry is None:
+            raise HeaderTableError(f"Unknown header table entry {index}")
+        return entry
+
+    def _store(self, index, name, value):
+        if index in self.entries:
+            self._drop(index)
+        self.entries[index] = (name, value)
+        self.size += len(name) + len(value) + ENTRY_OVERHEAD
+        # A well-behaved encoder never gets here; a table past the cap
+        # loses its oldest entries
+        while self.size > self.max_size:
+            self._drop(min(self.entries))
+
+    def _drop(self, index):
+        name, value = self.entries.pop(index)
+        self.size -= len(name) + len(value) + ENTRY_OVERHEAD
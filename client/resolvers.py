@@ -0,0 +1,460 @@
+"""
+DNS Tunnel Pro - Resolver pool
+Copyright (c) 2025 Mr-X-01
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+from urllib.parse import urlparse
+from tunnel_codec import (
+    TYPE_PREFERENCE, DEFAULT_CAPACITY, QNAME_SIZE,
+    decode_answer, probe_name, probe_pattern
+)
+
+logger = logging.getLogger(__name__)
+
+# DNS response codes a server or resolver refuses a query with
+RCODE_SERVFAIL = 2
+RCODE_REFUSED = 5
+# Pauses before probing again after a refusal (sec): the server limits
+# probes per resolver address, which other clients may share
+REFUSED_DELAYS = (1, 2, 4, 8)
+
+
+class QueryError(Exception):
+    """A tunnel query did not produce a usable answer"""
+
+
+class QueryRefused(QueryError):
+    """The server or resolver refused the query (REFUSED or SERVFAIL)"""
+
+
+class Resolver:
+    """One upstream resolver with its latency and health statistics"""
+
+    # EWMA gains for RTT, RTT deviation and success rate
+    RTT_GAIN = 0.125
+    RTTVAR_GAIN = 0.25
+    SUCCESS_GAIN = 0.1
+
+    # Congestion window in queries, grown like TCP Reno up to the window
+    INITIAL_CWND = 4.0
+
+    def __init__(self, url, window, answer_type='TXT'):
+        self.url = url
+        self.window = window
+        self.answer_type = answer_type
+        self.answer_capacity = {}
+        self.up_mtu = QNAME_SIZE
+        self.mtu_checked = 0.0
+
+        self.rtt = None
+        self.rttvar = None
+        self.cwnd = min(self.INITIAL_CWND, window)
+        self.ssthresh = float(window)
+        self.recovery_until = 0.0
+        self.success = 1.0
+        self.inflight = 0
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.queries = 0
+        self.errors = 0
+
+        parsed = urlparse(url)
+        self.scheme = parsed.scheme
+        if self.scheme == 'udp':
+            self.host = parsed.hostname
+            self.port = parsed.port or 53
+        else:
+            self.http = requests.Session()
+
+    @property
+    def down_capacity(self):
+        """Bytes one answer can carry through this resolver"""
+        return self.answer_capacity.get(
+            self.answer_type, DEFAULT_CAPACITY[self.answer_type]
+        )
+
+    @property
+    def send_window(self):
+        """Queries that may be in flight now"""
+        return max(1, min(int(self.cwnd), self.window))
+
+    def rto(self, min_rto, max_rto, attempt=0):
+        """Retransmission timeout from smoothed RTT and deviation, doubled per retransmission"""
+        if self.rtt is None:
+            return max_rto
+        rto = max(self.rtt + 4 * self.rttvar, min_rto) * 2 ** attempt
+        return min(rto, max_rto)
+
+    def cost(self):
+        """Expected time to get an answer, used to rank resolvers"""
+        # Unmeasured resolvers go first so every path gets an RTT sample
+        rtt = self.rtt if self.rtt is not None else 0.0
+        return rtt * (self.inflight + 1) / max(self.success, 0.05)
+
+    def record(self, ok, rtt, max_backoff):
+        """Update statistics after a query (rtt None: not a latency sample)"""
+        self.queries += 1
+        self.success += self.SUCCESS_GAIN * ((1.0 if ok else 0.0) - self.success)
+        if ok:
+            self.failures = 0
+            self.backoff_until = 0.0
+            if rtt is None:
+                pass
+            elif self.rtt is None:
+                self.rtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar += self.RTTVAR_GAIN * (abs(self.rtt - rtt) - self.rttvar)
+                self.rtt += self.RTT_GAIN * (rtt - self.rtt)
+
+            # Slow start below the threshold, then one query per window
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+            self.cwnd = min(self.cwnd, self.window)
+        else:
+            self.errors += 1
+            self.failures += 1
+            # A single loss is left to the RTO and window; repeated ones
+            # take the resolver out of rotation for a while
+            if self.failures > 1:
+                delay = min(0.5 * (2 ** (self.failures - 2)), max_backoff)
+                self.backoff_until = time.time() + delay
+
+            # Halve the window once per round trip of losses
+            now = time.time()
+            if now >= self.recovery_until:
+                self.ssthresh = max(self.cwnd / 2, 1.0)
+                self.cwnd = self.ssthresh
+                self.recovery_until = now + (self.rtt or 0.0)
+
+    def exchange(self, name, qtype, timeout):
+        """Send one query and return its answers as DoH JSON style records"""
+        if self.scheme == 'udp':
+            return self._exchange_udp(name, qtype, timeout)
+        return self._exchange_doh(name, qtype, timeout)
+
+    def _exchange_doh(self, name, qtype, timeout):
+        """Query a DoH JSON resolver"""
+        response = self.http.get(
+            self.url,
+            params={'name': name, 'type': qtype},
+            headers={'Accept': 'application/dns-json'},
+            timeout=timeout
+        )
+        if response.status_code != 200:
+            raise QueryError(f"HTTP {response.status_code}")
+        reply = response.json()
+        if reply.get('Status') in (RCODE_SERVFAIL, RCODE_REFUSED):
+            raise QueryRefused(f"Rcode {reply['Status']}")
+        return reply.get('Answer', [])
+
+    def _exchange_udp(self, name, qtype, timeout):
+        """Query a plain DNS resolver over UDP"""
+        import dns.message
+        import dns.query
+
+        # The server answers over UDP up to the EDNS size; answers are
+        # sized by probing, so the largest one is offered
+        query = dns.message.make_query(name, qtype, use_edns=0, payload=65535)
+        reply = dns.query.udp(query, self.host, port=self.port, timeout=timeout)
+        if reply.rcode() in (RCODE_SERVFAIL, RCODE_REFUSED):
+            raise QueryRefused(f"Rcode {reply.rcode()}")
+        return [
+            {'type': int(rrset.rdtype), 'data': rdata.to_text()}
+            for rrset in reply.answer for rdata in rrset
+        ]
+
+    def snapshot(self):
+        """Statistics for logging and diagnostics"""
+        return {
+            'url': self.url,
+            'answer_type': self.answer_type,
+            'answer_bytes': self.down_capacity,
+            'qname_chars': self.up_mtu,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'rttvar_ms': round(self.rttvar * 1000, 1) if self.rttvar is not None else None,
+            'cwnd': round(self.cwnd, 2),
+            'success': round(self.success, 3),
+            'inflight': self.inflight,
+            'queries': self.queries,
+            'errors': self.errors,
+        }
+
+
+class ResolverPool:
+    """Spread tunnel queries over several resolvers by RTT and success rate"""
+
+    def __init__(self, urls, domain, window=8, timeout=5, max_backoff=30,
+                 answer_type='TXT', min_answer=32, max_answer=4096, min_qname=64,
+                 probe_attempts=2, mtu_interval=600, loss_threshold=0.9, min_rto=0.2,
+                 scheduler=None):
+        self.domain = domain
+        self.timeout = timeout
+        self.min_rto = min_rto
+        self.max_backoff = max_backoff
+        self.min_answer = min_answer
+        self.max_answer = max_answer
+        self.min_qname = min_qname
+        self.probe_attempts = probe_attempts
+        self.mtu_interval = mtu_interval
+        self.loss_threshold = loss_threshold
+        self.resolvers = [Resolver(url, window, answer_type) for url in urls]
+        self.scheduler = scheduler
+        self.cond = threading.Condition()
+        self.health_thread = None
+        self.running = False
+
+    @property
+    def total_window(self):
+        return sum(r.window for r in self.resolvers)
+
+    def acquire(self, traffic_class=None):
+        """
+        Pick the cheapest resolver with a free slot, waiting if all are
+        busy. With a scheduler, waiters of a traffic class take free slots
+        in the turn it gives them.
+        """
+        with self.cond:
+            ticket = None
+            if self.scheduler is not None and traffic_class is not None:
+                ticket = self.scheduler.enqueue(traffic_class)
+            try:
+                while True:
+                    if ticket is None or self._next_ticket() is ticket:
+                        resolver = self._pick()
+                        if resolver is not None:
+                            if ticket is not None:
+                                self.scheduler.grant(ticket)
+                                ticket = None
+                                # Whoever is next may take a remaining slot
+                                self.cond.notify_all()
+                            return resolver
+                    self.cond.wait(0.1)
+            finally:
+                if ticket is not None:
+                    self.scheduler.cancel(ticket)
+
+    def _next_ticket(self):
+        """Scheduler's choice given the slots in use (lock held)"""
+        inflight = sum(r.inflight for r in self.resolvers)
+        capacity = sum(r.send_window for r in self.resolvers)
+        return self.scheduler.next(inflight, capacity)
+
+    def _pick(self):
+        """Take a slot on the cheapest usable resolver, or None (lock held)"""
+        now = time.time()
+        free = [r for r in self.resolvers if r.inflight < r.send_window]
+        healthy = [r for r in free if r.backoff_until <= now]
+        if not healthy and free and all(r.backoff_until > now for r in self.resolvers):
+            # Everything is backing off: use the one that recovers first
+            healthy = [min(free, key=lambda r: r.backoff_until)]
+        if not healthy:
+            return None
+        resolver = min(healthy, key=lambda r: r.cost())
+        resolver.inflight += 1
+        return resolver
+
+    def release(self, resolver, ok, rtt, record=True):
+        """Return a slot and record the outcome of the query"""
+        with self.cond:
+            resolver.inflight -= 1
+            if record:
+                resolver.record(ok, rtt, self.max_backoff)
+            self.cond.notify_all()
+
+    def cancel(self, resolver):
+        """Return an acquired slot that was not used"""
+        with self.cond:
+            resolver.inflight -= 1
+            self.cond.notify_all()
+
+    def run(self, resolver, build, record=True, hold=0.0, attempt=0):
+        """
+        Run one tunnel query on an acquired resolver. build(resolver)
+        returns (name, qtype) so the packet can be sized for the resolver
+        that carries it. The query times out after the resolver's RTO
+        plus any time the server may hold it; held queries count for
+        health but not for RTT. Returns the answer bytes.
+        """
+        start = time.time()
+        ok = False
+        timeout = min(resolver.rto(self.min_rto, self.timeout, attempt) + hold, self.timeout)
+        try:
+            name, qtype = build(resolver)
+            answers = resolver.exchange(name, qtype, timeout)
+            data = decode_answer(qtype, answers, self.domain)
+            if data is None:
+                raise QueryError("No answer data")
+            ok = True
+            return data
+        except QueryError:
+            raise
+        except Exception as e:
+            raise QueryError(str(e))
+        finally:
+            rtt = time.time() - start if not hold else None
+            self.release(resolver, ok, rtt, record)
+
+    def query(self, build, resolver=None, record=True):
+        """Run one tunnel query on the best resolver (or the given one)"""
+        if resolver is None:
+            resolver = self.acquire()
+        else:
+            with self.cond:
+                resolver.inflight += 1
+        return self.run(resolver, build, record)
+
+    def probe(self, resolver, qtype, size, length=None, record=False):
+        """
+        Check that an answer of the given type and size, and optionally a
+        query name of the given length, pass a resolver. Size probes are
+        expected to fail, so they don't count against the resolver's
+        health unless asked to. Raises QueryRefused if the probe was
+        refused, which says nothing about the size.
+        """
+        nonce = os.urandom(4).hex()
+        name, filler = probe_name(nonce, size, self.domain, length)
+        try:
+            data = self.query(lambda r: (name, qtype), resolver, record)
+        except QueryRefused:
+            raise
+        except QueryError:
+            return False
+        return data == probe_pattern(nonce + filler, size)
+
+    def _reliable(self, check):
+        """
+        A size fails only when every attempt is lost: one that is too big
+        never gets through, while packet loss on a lossy path (when sizes
+        are re-probed) only drops some of the attempts. Refused attempts
+        are tried again after a pause; QueryRefused is raised once the
+        pauses run out.
+        """
+        for _ in range(self.probe_attempts):
+            for delay in REFUSED_DELAYS + (None,):
+                try:
+                    if check():
+                        return True
+                    break
+                except QueryRefused:
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        return False
+
+    @staticmethod
+    def _search(check, low, high):
+        """Largest value in [low, high] passing a monotone check, 0 if none"""
+        if not check(low):
+            return 0
+        while low < high:
+            mid = (low + high + 1) // 2
+            if check(mid):
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    def discover(self, resolver, types):
+        """
+        Binary-search the answer size per type and the query name length.
+        A server that keeps refusing probes leaves the sizes as they were
+        until the next health check.
+        """
+        try:
+            self._discover(resolver, types)
+        except QueryRefused as e:
+            logger.warning(f"{resolver.url}: probes refused ({e}), keeping path sizes")
+
+    def _discover(self, resolver, types):
+        capacity = {}
+        for qtype in types:
+            size = self._search(
+                lambda n: self._reliable(lambda: self.probe(resolver, qtype, n)),
+                self.min_answer, self.max_answer
+            )
+            if size:
+                capacity[qtype] = size
+
+        resolver.answer_capacity.update(capacity)
+        if capacity:
+            # Largest capacity wins, preference order breaks ties
+            resolver.answer_type = max(
+                capacity, key=lambda t: (capacity[t], -TYPE_PREFERENCE.index(t))
+            )
+        elif resolver.answer_type not in resolver.answer_capacity:
+            logger.warning(f"{resolver.url}: no answer type passed the probe, using TXT")
+            resolver.answer_type = 'TXT'
+
+        up_mtu = self._search(
+            lambda n: self._reliable(
+                lambda: self.probe(resolver, resolver.answer_type, 16, length=n)
+            ),
+            self.min_qname, QNAME_SIZE
+        )
+        # A path that lost every probe keeps the sizes found before
+        if up_mtu or not resolver.mtu_checked:
+            resolver.up_mtu = up_mtu or self.min_qname
+        resolver.mtu_checked = time.time()
+        logger.info(f"{resolver.url}: {resolver.answer_type} answers of "
+                    f"{resolver.down_capacity} bytes, query names of {resolver.up_mtu} chars")
+
+    def discover_all(self, types):
+        """Run path discovery on every resolver in parallel"""
+        threads = [
+            threading.Thread(target=self.discover, args=(resolver, types), daemon=True)
+            for resolver in self.resolvers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def up_mtu(self):
+        """Query name length every resolver carries, used to size fragments"""
+        return min(r.up_mtu for r in self.resolvers)
+
+    def start_health_checks(self, interval):
+        """Periodically probe every resolver so backed-off ones can recover"""
+        self.running = True
+        self.health_thread = threading.Thread(
+            target=self._health_loop, args=(interval,), daemon=True
+        )
+        self.health_thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _health_loop(self, interval):
+        while self.running:
+            time.sleep(interval)
+            for resolver in self.resolvers:
+                try:
+                    if not self.probe(resolver, resolver.answer_type, 16, record=True):
+                        logger.warning(f"Resolver {resolver.url} failed health check")
+                except QueryRefused as e:
+                    logger.warning(f"Resolver {resolver.url} refused health check: {e}")
+
+                # Re-probe sizes periodically, or sooner when losses rise
+                age = time.time() - resolver.mtu_checked
+                lossy = resolver.success < self.loss_threshold and age > interval
+                if age > self.mtu_interval or lossy:
+                    logger.info(f"Re-probing path sizes of {resolver.url}")
+                    self.discover(resolver, [resolver.answer_type])
+
+    def snapshot(self):
+        return [r.snapshot() for r in self.resolvers]
+
+    def qos_snapshot(self):
+        """Per traffic class queue depth and slot wait, if scheduling"""
+        if self.scheduler is None:
+            return None
+        with self.cond:
+            return self.scheduler.snapshot()
@@ -0,0 +1,115 @@
+"""
+DNS Tunnel Pro - QoS query scheduling
+Copyright (c) 2025 Mr-X-01
+"""
+
+import time
+import fnmatch
+from collections import deque
+
+# Traffic classes, in tie-break order
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+TRAFFIC_CLASSES = (INTERACTIVE, BULK)
+
+
+class QueryScheduler:
+    """
+    Decides which waiting query takes the next free resolver slot.
+    Classes share slots by weight: while both wait, interactive queries
+    get interactive_weight slots for every bulk one, so interactive
+    frames jump the queue and bulk traffic still moves. Bulk queries
+    never take the last interactive_reserve share of the slots, so an
+    interactive query rarely waits for a bulk one (often a held poll) to
+    finish. Within a class slots go in arrival order. All methods are
+    called with the pool's lock held.
+    """
+
+    def __init__(self, interactive_weight=8, interactive_reserve=0.25):
+        self.weights = {INTERACTIVE: interactive_weight, BULK: 1}
+        self.interactive_reserve = interactive_reserve
+        self.queues = {c: deque() for c in TRAFFIC_CLASSES}
+        # Slots served per unit of weight; the lowest class goes next
+        self.served = {c: 0.0 for c in TRAFFIC_CLASSES}
+        self.granted = {c: 0 for c in TRAFFIC_CLASSES}
+        self.wait_total = {c: 0.0 for c in TRAFFIC_CLASSES}
+        self.wait_max = {c: 0.0 for c in TRAFFIC_CLASSES}
+
+    def enqueue(self, traffic_class):
+        """Queue a waiter, return its ticket"""
+        if not self.queues[traffic_class]:
+            # An idle class doesn't bank credit for later bursts
+            active = [self.served[c] for c in TRAFFIC_CLASSES if self.queues[c]]
+            if active:
+                self.served[traffic_class] = max(self.served[traffic_class], min(active))
+        ticket = (traffic_class, time.time())
+        self.queues[traffic_class].append(ticket)
+        return ticket
+
+    def next(self, inflight, capacity):
+        """Ticket whose turn it is with inflight of capacity slots taken, or None"""
+        waiting = [
+            c for c in TRAFFIC_CLASSES
+            if self.queues[c] and self._admits(c, inflight, capacity)
+        ]
+        if not waiting:
+            return None
+        traffic_class = min(waiting, key=lambda c: (self.served[c], TRAFFIC_CLASSES.index(c)))
+        return self.queues[traffic_class][0]
+
+    def _admits(self, traffic_class, inflight, capacity):
+        if traffic_class != BULK:
+            return True
+        reserved = int(capacity * self.interactive_reserve)
+        return inflight < max(capacity - reserved, 1)
+
+    def grant(self, ticket):
+        """The ticket at the head of its queue took a slot"""
+        traffic_class, queued = ticket
+        self.queues[traffic_class].popleft()
+        self.served[traffic_class] += 1 / self.weights[traffic_class]
+        wait = time.time() - queued
+        self.granted[traffic_class] += 1
+        self.wait_total[traffic_class] += wait
+        self.wait_max[traffic_class] = max(self.wait_max[traffic_class], wait)
+
+    def cancel(self, ticket):
+        self.queues[ticket[0]].remove(ticket)
+
+    def snapshot(self):
+        """Queue depth and slot wait time per class"""
+        return {
+            c: {
+                'queued': len(self.queues[c]),
+                'granted': self.granted[c],
+                'wait_avg_ms': round(self.wait_total[c] / self.granted[c] * 1000, 1)
+                if self.granted[c] else 0.0,
+                'wait_max_ms': round(self.wait_max[c] * 1000, 1),
+            }
+            for c in TRAFFIC_CLASSES
+        }
+
+
+class TrafficClassifier:
+    """
+    Class of a connection from config rules, first match wins. Each rule
+    has a 'class' and optionally a 'host' glob and a 'port'. Connections
+    no rule matches get None: they start interactive and the transport
+    moves them to bulk once they carry more than its bulk threshold.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        for rule in rules:
+            if rule.get('class') not in TRAFFIC_CLASSES:
+                raise ValueError(f"Unknown traffic class in QoS rule: {rule}")
+            self.rules.append(rule)
+
+    def classify(self, host, port):
+        for rule in self.rules:
+            if 'port' in rule and rule['port'] != port:
+                continue
+            if 'host' in rule and not fnmatch.fnmatch(host.lower(), rule['host'].lower()):
+                continue
+            return rule['class']
+        return None
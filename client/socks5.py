@@ -0,0 +1,163 @@
+"""
+DNS Tunnel Pro - asyncio SOCKS5 front end
+Copyright (c) 2025 Mr-X-01
+"""
+
+import socket
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOCKS_VERSION = 0x05
+
+# Authentication methods
+AUTH_NONE = 0x00
+AUTH_PASSWORD = 0x02
+AUTH_NO_ACCEPTABLE = 0xFF
+
+# Commands and address types
+CMD_CONNECT = 0x01
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+# Reply codes
+REP_SUCCESS = 0x00
+REP_FAILURE = 0x01
+REP_COMMAND_NOT_SUPPORTED = 0x07
+REP_ADDRESS_NOT_SUPPORTED = 0x08
+
+
+class SocksError(Exception):
+    """Malformed or refused SOCKS5 negotiation"""
+
+
+class Socks5Server:
+    """
+    Single-threaded SOCKS5 server. Each connection is a coroutine, so
+    thousands of idle connections cost only their stream buffers; the
+    tunnel work is done by the handler coroutine.
+    """
+
+    def __init__(self, handler, host='127.0.0.1', port=1080, backlog=1024,
+                 max_connections=4096, username=None, password=None,
+                 handshake_timeout=30):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.username = username
+        self.password = password
+        self.handshake_timeout = handshake_timeout
+
+        self.connections = 0
+        self.sock = None
+        self.loop = None
+        self.server = None
+        self.closed = None
+
+    def bind(self):
+        """Bind the listening socket (raises OSError if the port is taken)"""
+        self.sock = socket.create_server((self.host, self.port), backlog=self.backlog)
+
+    def run(self):
+        """Run the server until close() is called"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        if self.sock is None:
+            self.bind()
+        self.loop = asyncio.get_running_loop()
+        self.closed = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, sock=self.sock)
+        logger.info(f"SOCKS5 server started on {self.host}:{self.port}")
+        async with self.server:
+            await self.closed.wait()
+
+    def close(self):
+        """Stop accepting connections (safe to call from any thread)"""
+        if self.loop and self.closed:
+            self.loop.call_soon_threadsafe(self.closed.set)
+
+    async def _handle(self, reader, writer):
+        if self.connections >= self.max_connections:
+            logger.warning("SOCKS5 connection limit reached, refusing connection")
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            target = await asyncio.wait_for(
+                self._negotiate(reader, writer), self.handshake_timeout
+            )
+            logger.debug(f"CONNECT {target[0]}:{target[1]}")
+            await self.handler(reader, writer, *target)
+        except (SocksError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logger.debug(f"SOCKS negotiation failed: {e!r}")
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error(f"SOCKS connection error: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _negotiate(self, reader, writer):
+        """Run the method selection and request phases, return (host, port)"""
+        version, nmethods = await reader.readexactly(2)
+        if version != SOCKS_VERSION:
+            raise SocksError(f"Unsupported SOCKS version {version}")
+        methods = await reader.readexactly(nmethods)
+
+        method = AUTH_PASSWORD if self.username is not None else AUTH_NONE
+        if method not in methods:
+            writer.write(bytes([SOCKS_VERSION, AUTH_NO_ACCEPTABLE]))
+            await writer.drain()
+            raise SocksError("No acceptable authentication method")
+        writer.write(bytes([SOCKS_VERSION, method]))
+        await writer.drain()
+
+        if method == AUTH_PASSWORD:
+            await self._authenticate(reader, writer)
+
+        version, cmd, _, atyp = await reader.readexactly(4)
+        if version != SOCKS_VERSION:
+            raise SocksError(f"Unsupported SOCKS version {version}")
+
+        if atyp == ATYP_IPV4:
+            host = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+        elif atyp == ATYP_IPV6:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        elif atyp == ATYP_DOMAIN:
+            length = (await reader.readexactly(1))[0]
+            host = (await reader.readexactly(length)).decode('idna')
+        else:
+            await self._reply(writer, REP_ADDRESS_NOT_SUPPORTED)
+            raise SocksError(f"Unsupported address type {atyp}")
+        port = int.from_bytes(await reader.readexactly(2), 'big')
+
+        if cmd != CMD_CONNECT:
+            await self._reply(writer, REP_COMMAND_NOT_SUPPORTED)
+            raise SocksError(f"Unsupported command {cmd}")
+
+        await self._reply(writer, REP_SUCCESS)
+        return host, port
+
+    async def _authenticate(self, reader, writer):
+        """Username/password sub-negotiation (RFC 1929)"""
+        version, ulen = await reader.readexactly(2)
+        username = (await reader.readexactly(ulen)).decode(errors='replace')
+        plen = (await reader.readexactly(1))[0]
+        password = (await reader.readexactly(plen)).decode(errors='replace')
+
+        ok = version == 0x01 and username == self.username and password == self.password
+        writer.write(bytes([0x01, 0x00 if ok else 0x01]))
+        await writer.drain()
+        if not ok:
+            raise SocksError("Authentication failed")
+
+    async def _reply(self, writer, code):
+        writer.write(bytes([SOCKS_VERSION, code, 0x00, ATYP_IPV4]) + b'\x00' * 6)
+        await writer.drain()
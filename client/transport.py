@@ -0,0 +1,791 @@
+"""
+DNS Tunnel Pro - Fragmenting tunnel transport
+Copyright (c) 2025 Mr-X-01
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+from crypto_session import ReplayError
+from batcher import Batcher
+from resolvers import QueryError
+from scheduler import INTERACTIVE, BULK
+from tunnel_codec import (
+    OP_DATA, OP_FETCH, OP_BATCH, OP_POLL, ST_OK, ST_PENDING, ST_ERROR, ST_PARTIAL,
+    HEADER, DATA, FETCH, ACK, CHUNK, LENGTH, POLL_HOLD, POLL, SEAL_OVERHEAD,
+    encode_query_name, max_packet_size, parity_fragment, sack_bits, pack_frame, split_frames
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(Exception):
+    """A message could not be delivered or its response collected"""
+
+
+class OutboundMessage:
+    """
+    Delivery state of one upstream message. Every fragment reply carries
+    the server's SACK state, so a fragment whose own reply was lost is
+    still known to have arrived, and the whole send ends as soon as the
+    server holds every fragment (some may be rebuilt from parity).
+    """
+
+    def __init__(self, msg_id, count, urgent=False, traffic_class=INTERACTIVE):
+        self.msg_id = msg_id
+        self.count = count
+        self.urgent = urgent
+        self.traffic_class = traffic_class
+        self.held = bytearray(count)
+        self.base = 0
+        self.complete = False
+        self.cond = threading.Condition()
+
+    def has(self, index):
+        return self.complete or (index < self.count and self.held[index])
+
+    def update(self, reply, index):
+        """Apply a fragment reply: ACK header plus SACK bitmap"""
+        _, _, held, base = ACK.unpack_from(reply)
+        with self.cond:
+            if index < self.count:
+                self.held[index] = 1
+            for i in range(self.base, min(base, self.count)):
+                self.held[i] = 1
+            self.base = max(self.base, base)
+            for offset in sack_bits(reply[ACK.size:]):
+                if base + offset < self.count:
+                    self.held[base + offset] = 1
+            if held >= self.count:
+                self.complete = True
+            self.cond.notify_all()
+
+    def notify(self):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class TunnelTransport:
+    """
+    Split messages into fragments striped over the resolver pool. Small
+    fragments and held polls of all streams are aggregated into shared
+    queries, so chatty traffic doesn't pay a query per frame. Queries
+    wait for resolver slots in their stream's traffic class; a stream
+    without one is interactive until it has carried bulk_bytes. At most
+    max_streams responses are open at once; open_stream waits for one
+    to close past that.
+    """
+
+    def __init__(self, pool, client_id, domain, crypto, retries=4, poll_interval=0.25,
+                 response_timeout=30, reorder_window=262144, poll_hold=1.5,
+                 max_poll_interval=5, fec_group=0, batch_delay=0.005, bulk_bytes=262144,
+                 max_streams=128):
+        self.pool = pool
+        self.crypto = crypto
+        self.reorder_window = reorder_window
+        self.client_raw = bytes.fromhex(client_id)
+        self.domain = domain
+        self.retries = retries
+        self.poll_interval = poll_interval
+        self.poll_hold = poll_hold
+        self.max_poll_interval = max_poll_interval
+        self.response_timeout = response_timeout
+        self.fec_group = fec_group
+        self.bulk_bytes = bulk_bytes
+        self.max_streams = max_streams
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+
+        # Random start so a restarted client does not reuse live ids
+        self.msg_id = int.from_bytes(os.urandom(2), 'big')
+        self.lock = threading.Lock()
+        # There are threads for every open stream's range workers, so the
+        # query slots, not the thread pool, decide which traffic goes
+        # first. Workers leave their thread while the stream's window is
+        # full, and fragments are sent from threads of their own, so
+        # responses nobody reads can't hold up uploads or other streams
+        self.stream_workers = min(pool.total_window, len(pool.resolvers) * 4)
+        self.executor = ThreadPoolExecutor(max_workers=max_streams * self.stream_workers)
+        self.senders = ThreadPoolExecutor(
+            max_workers=pool.total_window + max_streams, thread_name_prefix='fragment'
+        )
+        self.frames = Batcher(
+            self._send_frames, self._query_capacity, batch_delay,
+            lambda frames: self._acquire(frame[0].traffic_class for frame in frames),
+            pool.cancel
+        )
+        self.polls = Batcher(
+            self._send_polls, lambda: self._query_capacity() - POLL_HOLD.size, batch_delay,
+            lambda polls: self._acquire(poll[4] for poll in polls),
+            pool.cancel
+        )
+        self.stats = {'queries': 0, 'payload_up': 0, 'payload_down': 0}
+
+    @property
+    def fragment_size(self):
+        """Upstream bytes carried by one query on the narrowest path"""
+        return max(self._query_capacity() - DATA.size, 1)
+
+    def _query_capacity(self):
+        """Packet bytes after the tunnel header on the narrowest path"""
+        return max_packet_size(self.domain, qname_size=self.pool.up_mtu()) - HEADER.size
+
+    def exchange(self, blob, urgent=False, traffic_class=None):
+        """Send one message and return the server's whole response stream"""
+        return b''.join(self.open_stream(blob, urgent, traffic_class))
+
+    def open_stream(self, blob, urgent=False, traffic_class=None):
+        """
+        Send one message and return an in-order iterator over its response.
+        Frames of urgent messages are flushed at once instead of waiting to
+        share a query. Waits while max_streams responses are open; the
+        stream gives its place back once it ends, fails or is closed.
+        """
+        self.stream_slots.acquire()
+        try:
+            with self.lock:
+                self.msg_id = (self.msg_id + 1) & 0xFFFF
+                msg_id = self.msg_id
+
+            upload_class = traffic_class
+            if upload_class is None:
+                upload_class = BULK if len(blob) > self.bulk_bytes else INTERACTIVE
+            self._send_message(msg_id, blob, urgent, upload_class)
+            return ResponseStream(self, msg_id, self.reorder_window, urgent, traffic_class)
+        except BaseException:
+            self.stream_slots.release()
+            raise
+
+    def _acquire(self, classes):
+        """Slot for a query carrying frames of these classes: the best one wins"""
+        classes = set(classes)
+        return self.pool.acquire(INTERACTIVE if INTERACTIVE in classes else BULK)
+
+    def _count(self, queries=0, up=0, down=0):
+        with self.lock:
+            self.stats['queries'] += queries
+            self.stats['payload_up'] += up
+            self.stats['payload_down'] += down
+
+    def snapshot(self):
+        """Query and payload counters, with the payload bytes each query carried"""
+        with self.lock:
+            stats = dict(self.stats)
+        queries = stats['queries']
+        stats['payload_per_query'] = round(
+            (stats['payload_up'] + stats['payload_down']) / queries, 1
+        ) if queries else 0.0
+        return stats
+
+    def _query(self, resolver, op, body, hold=0.0, attempt=0):
+        """Run one query on an acquired resolver and check the reply status"""
+        def build(r):
+            packet = HEADER.pack(op, self.client_raw, r.down_capacity) + body
+            return encode_query_name(packet, self.domain), r.answer_type
+
+        self._count(queries=1)
+        reply = self.pool.run(resolver, build, hold=hold, attempt=attempt)
+        if not reply:
+            raise QueryError("Empty reply")
+        if reply[0] == ST_ERROR:
+            raise TransportError(reply[1:].decode(errors='replace'))
+        return reply
+
+    def _send_fragment(self, state, index, count, chunk, required=True):
+        """
+        Deliver one fragment, retransmitting through other resolvers after
+        each RTO until the server's SACKs show it (or the message) held.
+        Parity fragments are sent once and never required.
+        """
+        size = DATA.size + LENGTH.size + len(chunk)
+        attempts = self.retries if required else 1
+        try:
+            for attempt in range(attempts):
+                if state.has(index):
+                    return
+                try:
+                    reply = self.frames.submit(
+                        (state, index, count, chunk, attempt), size, state.urgent
+                    ).result()
+                    state.update(reply, index)
+                    return
+                except QueryError as e:
+                    logger.debug(f"Fragment {state.msg_id}/{index} attempt {attempt + 1} failed: {e}")
+            if required and not state.has(index):
+                raise TransportError(f"Fragment {index} of message {state.msg_id} lost")
+        finally:
+            state.notify()
+
+    def _send_frames(self, resolver, frames):
+        """
+        Deliver fragments of any messages in one query on an acquired
+        resolver, return one ACK reply (header plus SACK bitmap) per
+        fragment. A lone fragment goes as plain DATA.
+        """
+        attempt = max(frame[4] for frame in frames)
+        headers = [
+            DATA.pack(state.msg_id, index, count, self.fec_group)
+            for state, index, count, _, _ in frames
+        ]
+        if len(frames) == 1:
+            replies = [self._query(resolver, OP_DATA, headers[0] + frames[0][3], attempt=attempt)]
+        else:
+            body = b''.join(pack_frame(header, frame[3]) for header, frame in zip(headers, frames))
+            reply = self._query(resolver, OP_BATCH, body, attempt=attempt)
+            replies = [ACK.pack(*fields) + bitmap for fields, bitmap in split_frames(reply[1:], ACK)]
+            if len(replies) != len(frames):
+                raise QueryError("Mismatched batch reply")
+        self._count(up=sum(len(frame[3]) for frame in frames))
+        return replies
+
+    def _send_message(self, msg_id, blob, urgent=False, traffic_class=INTERACTIVE):
+        """Send all fragments (and parity) concurrently, return once all are held"""
+        size = self.fragment_size
+        if self.fec_group:
+            # Parity costs a little of every fragment for its length field
+            size = max(size - 2, 1)
+        chunks = [blob[i:i+size] for i in range(0, len(blob), size)] or [b'']
+        count = len(chunks)
+        state = OutboundMessage(msg_id, count, urgent, traffic_class)
+
+        futures = [
+            self.senders.submit(self._send_fragment, state, index, count, chunk)
+            for index, chunk in enumerate(chunks)
+        ]
+        if self.fec_group:
+            for group, start in enumerate(range(0, count, self.fec_group)):
+                parity = parity_fragment(chunks[start:start + self.fec_group])
+                futures.append(self.senders.submit(
+                    self._send_fragment, state, count + group, count, parity, False
+                ))
+
+        with state.cond:
+            state.cond.wait_for(lambda: state.complete or all(f.done() for f in futures))
+        if not state.complete:
+            for future in futures:
+                future.result()
+
+    def chunk_size(self, resolver):
+        """Response bytes one fetch through this resolver returns"""
+        return max(resolver.down_capacity - CHUNK.size - SEAL_OVERHEAD, 1)
+
+    def hold_time(self, resolver):
+        """
+        How long the server may hold a poll on this resolver: the
+        configured hold, kept well inside the query timeout
+        """
+        rtt = resolver.rtt or 0.0
+        return max(min(self.poll_hold, self.pool.timeout - 2 * rtt - 1.0), 0.0)
+
+    def fetch(self, resolver, msg_id, offset, acked=0, hold=0.0):
+        """
+        Fetch and decrypt response bytes at an offset on an acquired
+        resolver, acknowledging everything below acked. With a hold the
+        server answers as soon as the bytes exist, or when it runs out.
+        Returns (end, final, plaintext), where end is the response length
+        known so far, or None if the bytes aren't there yet.
+        """
+        body = FETCH.pack(msg_id, offset, acked, int(hold * 1000))
+        reply = self._query(resolver, OP_FETCH, body, hold=hold)
+        if reply[0] == ST_PENDING:
+            return None
+        return self._open_chunk(msg_id, offset, reply[:CHUNK.size], memoryview(reply)[CHUNK.size:])
+
+    def poll(self, msg_id, offset, acked, hold_scale, urgent=False, traffic_class=INTERACTIVE):
+        """
+        Queue a held poll for response bytes at an offset; polls of all
+        streams share queries, held for hold_scale RTOs at most. Returns a
+        Future of (result, hold, resolver): fetch()'s result, the hold the
+        server was given and the resolver that carried the poll. hold is
+        None when the poll came back empty only because another response
+        in the same query got data.
+        """
+        return self.polls.submit(
+            (msg_id, offset, acked, hold_scale, traffic_class), POLL.size, urgent
+        )
+
+    def _send_polls(self, resolver, polls):
+        """Run held polls in one query on an acquired resolver; a lone poll goes as plain FETCH"""
+        rto = resolver.rto(self.pool.min_rto, self.pool.timeout)
+        hold = min(self.hold_time(resolver), rto * min(poll[3] for poll in polls))
+        if len(polls) == 1:
+            msg_id, offset, acked, _, _ = polls[0]
+            return [(self.fetch(resolver, msg_id, offset, acked, hold), hold, resolver)]
+
+        body = POLL_HOLD.pack(int(hold * 1000)) + b''.join(POLL.pack(*poll[:3]) for poll in polls)
+        reply = self._query(resolver, OP_POLL, body, hold=hold)
+        chunks = {
+            (fields[1], fields[2]): (CHUNK.pack(*fields), sealed)
+            for fields, sealed in split_frames(memoryview(reply)[1:], CHUNK)
+        }
+        # The chunks of the reply are opened in one batch
+        opened = iter(self._open_chunks([
+            (msg_id, offset) + chunks[(msg_id, offset)]
+            for msg_id, offset, _, _, _ in polls if (msg_id, offset) in chunks
+        ]))
+        results = []
+        for msg_id, offset, _, _, _ in polls:
+            if (msg_id, offset) not in chunks:
+                results.append((None, None if chunks else hold, resolver))
+                continue
+            result = next(opened)
+            results.append(result if isinstance(result, Exception) else (result, hold, resolver))
+        return results
+
+    def _open_chunk(self, msg_id, offset, header, sealed):
+        """Check and decrypt one response chunk, return (end, final, plaintext)"""
+        (result,) = self._open_chunks([(msg_id, offset, header, sealed)])
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _open_chunks(self, chunks):
+        """
+        Check and decrypt (msg_id, offset, header, sealed) response chunks
+        in one batch; each gives (end, final, plaintext), or the
+        QueryError or TransportError it failed with
+        """
+        results = []
+        sealed = []
+        for msg_id, offset, header, chunk in chunks:
+            status, reply_msg, reply_offset, total = CHUNK.unpack(header)
+            if status == ST_ERROR:
+                results.append(TransportError(f"Response {msg_id} failed on the server"))
+            elif status not in (ST_OK, ST_PARTIAL) or reply_msg != msg_id or reply_offset != offset:
+                results.append(QueryError("Mismatched fetch reply"))
+            else:
+                # The header is authenticated so chunks can't be spliced
+                results.append((total, status == ST_OK))
+                sealed.append((chunk, header))
+        opened = iter(self.crypto.open_batch(sealed, replay=True))
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                continue
+            data = next(opened)
+            if isinstance(data, InvalidTag):
+                results[index] = QueryError("Chunk failed authentication")
+            elif isinstance(data, ReplayError):
+                results[index] = QueryError(f"Chunk refused: {data}")
+            else:
+                self._count(down=len(data))
+                results[index] = result + (data,)
+        return results
+
+
+class ResponseStream:
+    """
+    Iterator over a response fetched by concurrent range workers. Chunks
+    are decrypted as they arrive and handed out as soon as they are in
+    order; workers never fetch more than the reorder window ahead of what
+    the consumer has taken, so memory per response stays bounded. Each
+    fetch acknowledges what the consumer has taken, which lets the server
+    free its side of the stream. A worker with nothing to fetch until the
+    consumer takes more parks: it gives its thread back to the pool and
+    is submitted again once there is work. The response is waited for in the
+    background too, so opening a stream returns once the message is sent;
+    async consumers take chunks without waiting (take) and listen for
+    the stream to move instead of holding a thread on it.
+    """
+
+    def __init__(self, transport, msg_id, window, urgent=False, traffic_class=None):
+        self.transport = transport
+        self.pool = transport.pool
+        self.msg_id = msg_id
+        self.window = window
+        self.urgent = urgent
+        self.traffic_class = traffic_class
+
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.delivered = 0
+        self.requested = 0
+        self.retry = []
+        self.total = None
+        self.available = 0
+        self.failures = 0
+        self.error = None
+        self.workers = 0
+        self.parked = 0
+        self.listener = None
+        self.open = True
+
+        # Polls past the bytes the server has produced: how many may be
+        # held at once, how long (in RTOs) the server may hold them, and
+        # how long to wait between them when idle. The hold is about an
+        # RTO while data flows, so a lost answer is retried quickly, and
+        # grows to the full hold as the response idles
+        self.tail_polls = 0
+        self.poll_slots = 1
+        self.hold_scale = 1
+        self.idle_delay = 0.0
+
+        transport.executor.submit(self._first)
+
+    def _first(self):
+        """Wait for the response to start, then set the range workers going"""
+        try:
+            first = self._wait_first()
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self._wake()
+            return
+        if first is not None:
+            self._store(0, first)
+            self._start_workers()
+
+    def _wait_first(self):
+        """
+        Long-poll offset 0 until the server has started the response;
+        None if the stream is closed first
+        """
+        deadline = time.time() + self.transport.response_timeout
+        while True:
+            with self.cond:
+                if self.error:
+                    return None
+            try:
+                result, hold, resolver = self.transport.poll(
+                    self.msg_id, 0, 0, self.hold_scale, self.urgent, self.priority
+                ).result()
+            except QueryError as e:
+                logger.debug(f"Fetch {self.msg_id} failed: {e}")
+                result = hold = None
+                time.sleep(self.transport.poll_interval)
+            if result is not None:
+                end, final, data = result
+                with self.cond:
+                    self._update_end(end, final)
+                    self.requested = len(data)
+                return data
+            if time.time() > deadline:
+                raise TransportError(f"Timed out waiting for response {self.msg_id}")
+            if hold is None:
+                continue
+            with self.cond:
+                delay = self._adapt(False, hold, resolver)
+            if delay:
+                time.sleep(delay)
+
+    @property
+    def priority(self):
+        """Traffic class of the stream's queries right now"""
+        if self.traffic_class is not None:
+            return self.traffic_class
+        return BULK if self.delivered > self.transport.bulk_bytes else INTERACTIVE
+
+    def _start_workers(self):
+        if self.total is not None and self.requested >= self.total:
+            return
+        count = self.transport.stream_workers
+        with self.cond:
+            self.workers = count
+        for _ in range(count):
+            self.transport.executor.submit(self._worker)
+
+    def _next_start(self):
+        """Offset the next range would start at, or None (lock held)"""
+        if self.retry:
+            return min(start for start, _ in self.retry)
+        if ((self.total is None or self.requested < self.total)
+                and self.requested < self.delivered + self.window):
+            return self.requested
+        return None
+
+    def _is_tail(self, start):
+        """Whether a range starts past what the server has produced (lock held)"""
+        return self.total is None and start >= self.available
+
+    def _has_work(self):
+        """Whether a range can be fetched now (lock held)"""
+        start = self._next_start()
+        if start is None:
+            return False
+        return not self._is_tail(start) or self.tail_polls < self.poll_slots
+
+    def _done(self):
+        """Whether workers should stop (lock held)"""
+        if self.error or self.failures > self.transport.retries * 4:
+            return True
+        return not self.retry and self.total is not None and self.requested >= self.total
+
+    def _update_end(self, end, final):
+        """Record how far the server has got; drop ranges past a final end (lock held)"""
+        self.available = max(self.available, end)
+        if final:
+            self.total = end
+            self.requested = min(self.requested, end)
+            self.retry = [(start, min(stop, end)) for start, stop in self.retry if start < end]
+
+    def _claim_work(self):
+        """
+        Whether a range can be fetched now. A worker that finds none parks
+        (returns False) and is resubmitted by _resume; False too once
+        there is nothing left.
+        """
+        with self.cond:
+            if self._done():
+                return False
+            if self._has_work():
+                return True
+            self.parked += 1
+            return False
+
+    def _resume(self):
+        """Resubmit parked workers if a range can be fetched (lock held)"""
+        if self.parked and not self._done() and self._has_work():
+            self.workers += self.parked
+            for _ in range(self.parked):
+                self.transport.executor.submit(self._worker)
+            self.parked = 0
+
+    def _carve(self, size):
+        """Take the next range to fetch, sized for one answer, as (start, end, tail)"""
+        with self.cond:
+            if self._done() or not self._has_work():
+                return None
+            if self.retry:
+                # Lowest offset first, the consumer is waiting on it
+                self.retry.sort(reverse=True)
+                start, end = self.retry.pop()
+                if end - start > size:
+                    self.retry.append((start + size, end))
+                    end = start + size
+            else:
+                start = self.requested
+                end = start + size if self.total is None else min(start + size, self.total)
+                self.requested = end
+            tail = self._is_tail(start)
+            if tail:
+                self.tail_polls += 1
+            return start, end, tail
+
+    def _adapt(self, got_data, hold, resolver):
+        """
+        Adapt polling after a poll comes back (lock held): traffic opens
+        more concurrent polls with short holds; an idle stream drops to one
+        poll, lengthens its hold, then pauses between polls so idle
+        responses cost few queries. Returns the pause before the next poll.
+        """
+        if got_data:
+            self.idle_delay = 0.0
+            self.hold_scale = 1
+            self.poll_slots = min(self.poll_slots * 2, max(self.workers, 1))
+        else:
+            self.poll_slots = 1
+            if hold < self.transport.hold_time(resolver):
+                self.hold_scale = min(self.hold_scale * 2, 256)
+            else:
+                self.idle_delay = min(
+                    max(self.idle_delay * 2, self.transport.poll_interval),
+                    self.transport.max_poll_interval
+                )
+        return self.idle_delay
+
+    def _tail_answered(self, got_data, hold, resolver):
+        """
+        Adapt after a tail poll, pause if idle, then free its tail slot.
+        A poll woken by another response's data (hold None) says nothing
+        about this one and is retried at once.
+        """
+        delay = 0.0
+        if hold is not None:
+            with self.cond:
+                delay = self._adapt(got_data, hold, resolver)
+        if delay:
+            time.sleep(delay)
+        with self.cond:
+            self.tail_polls -= 1
+            self._wake()
+
+    def _worker(self):
+        try:
+            # Wait for window space before taking a resolver slot, so a
+            # slow consumer doesn't starve other streams of queries
+            while self._claim_work():
+                resolver = self.pool.acquire(self.priority)
+                span = self._carve(self.transport.chunk_size(resolver))
+                if span is None:
+                    self.pool.cancel(resolver)
+                    continue
+                start, end, tail = span
+                hold = 0.0
+                try:
+                    if tail:
+                        # Held polls go out with those of other streams
+                        self.pool.cancel(resolver)
+                        result, hold, resolver = self.transport.poll(
+                            self.msg_id, start, self.delivered, self.hold_scale,
+                            self.urgent, self.priority
+                        ).result()
+                    else:
+                        result = self.transport.fetch(
+                            resolver, self.msg_id, start, self.delivered
+                        )
+                except QueryError as e:
+                    logger.debug(f"Fetch {self.msg_id}@{start} failed: {e}")
+                    with self.cond:
+                        self.failures += 1
+                        self.retry.append((start, end))
+                        if tail:
+                            self.tail_polls -= 1
+                        self._wake()
+                    continue
+
+                if result is None:
+                    # The server hasn't read this far into the origin yet
+                    with self.cond:
+                        self.retry.append((start, end))
+                    if tail:
+                        self._tail_answered(False, hold, resolver)
+                    else:
+                        time.sleep(self.transport.poll_interval)
+                    continue
+
+                known, final, data = result
+                with self.cond:
+                    self._update_end(known, final)
+                    if final:
+                        end = min(end, known)
+                    data = data[:max(end - start, 0)]
+                    if start + len(data) < end:
+                        self.retry.append((start + len(data), end))
+                self._store(start, data)
+                if tail:
+                    self._tail_answered(bool(data), hold, resolver)
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self._wake()
+        finally:
+            with self.cond:
+                self.workers -= 1
+                unfetched = self.retry or self.total is None or self.requested < self.total
+                if self.workers == 0 and not self.parked and unfetched and not self.error:
+                    self.error = TransportError(f"Response {self.msg_id} incomplete")
+                self._wake()
+
+    def listen(self, callback):
+        """
+        Have callback() called whenever a chunk may be ready or the stream
+        ends; it runs on worker threads with the stream locked, so it must
+        only hand the news on
+        """
+        with self.cond:
+            self.listener = callback
+        callback()
+
+    def _wake(self):
+        """Wake the consumer, waiting or listening, and parked workers (lock held)"""
+        self.cond.notify_all()
+        if self.listener is not None:
+            self.listener()
+        self._resume()
+
+    def _release(self):
+        """Give the stream's place back to the transport, once (lock held)"""
+        if self.open:
+            self.open = False
+            self.transport.stream_slots.release()
+
+    def close(self):
+        """Abandon the response and release its workers"""
+        with self.cond:
+            self.listener = None
+            if (self.total is None or self.delivered < self.total) and not self.error:
+                self.error = TransportError(f"Response {self.msg_id} abandoned")
+            self.pending.clear()
+            self._release()
+            self._wake()
+
+    def _store(self, offset, data):
+        with self.cond:
+            if data and offset >= self.delivered:
+                self.pending[offset] = data
+            self._wake()
+
+    def __iter__(self):
+        return self
+
+    def take(self):
+        """
+        Next chunk in order without waiting, None if it hasn't arrived;
+        raises StopIteration at the end of the response
+        """
+        with self.cond:
+            return self._take()
+
+    def _take(self):
+        if self.total is not None and self.delivered >= self.total:
+            self._release()
+            raise StopIteration
+        data = self.pending.pop(self.delivered, None)
+        if data is not None:
+            self.delivered += len(data)
+            self._wake()
+            return data
+        if self.error:
+            self._release()
+            raise self.error
+        return None
+
+    def __next__(self):
+        with self.cond:
+            while True:
+                data = self._take()
+                if data is not None:
+                    return data
+                self.cond.wait(1)
+
+
+class AsyncTunnel:
+    """
+    Shares one transport between all asyncio connections. Exchanges run
+    on a bounded thread pool, so idle connections hold no threads, and
+    wait on the loop for one of the transport's streams, so no thread
+    blocks in open_stream while max_streams responses are open.
+    """
+
+    def __init__(self, transport, max_concurrent=32):
+        self.transport = transport
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix='tunnel'
+        )
+        self.streams = asyncio.Semaphore(transport.max_streams)
+
+    async def exchange(self, blob, urgent=False, traffic_class=None):
+        loop = asyncio.get_running_loop()
+        async with self.streams:
+            return await loop.run_in_executor(
+                self.executor, self.transport.exchange, blob, urgent, traffic_class
+            )
+
+    async def stream(self, blob, urgent=False, traffic_class=None):
+        """
+        Async iterator yielding response chunks as they arrive in order.
+        Only sending the message takes a pool thread: chunks are waited
+        for on the loop, woken by the stream's workers.
+        """
+        loop = asyncio.get_running_loop()
+        async with self.streams:
+            chunks = await loop.run_in_executor(
+                self.executor, self.transport.open_stream, blob, urgent, traffic_class
+            )
+            ready = asyncio.Event()
+            chunks.listen(lambda: loop.call_soon_threadsafe(ready.set))
+            try:
+                while True:
+                    ready.clear()
+                    try:
+                        chunk = chunks.take()
+                    except StopIteration:
+                        return
+                    if chunk is None:
+                        await ready.wait()
+                        continue
+                    yield chunk
+            finally:
+                chunks.close()
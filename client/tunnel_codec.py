@@ -0,0 +1,235 @@
+"""
+DNS Tunnel Pro - Client answer codecs
+Copyright (c) 2025 Mr-X-01
+"""
+
+import os
+import re
+import math
+import base64
+import socket
+import struct
+import hashlib
+
+# Record types data can be carried in, with their numeric codes
+ANSWER_TYPES = {
+    'TXT': 16,
+    'NULL': 10,
+    'CNAME': 5,
+    'AAAA': 28,
+}
+
+# Order used to break ties between types of equal capacity
+TYPE_PREFERENCE = ('NULL', 'TXT', 'AAAA', 'CNAME')
+
+# Answer bytes assumed per type until a probe has measured them
+DEFAULT_CAPACITY = {
+    'TXT': 300,
+    'NULL': 400,
+    'CNAME': 120,
+    'AAAA': 180,
+}
+
+PROBE_LABEL = '_probe'
+
+LABEL_SIZE = 63
+QNAME_SIZE = 253
+
+AAAA_CHUNK = 15
+
+_B64URL_JUNK = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def b64url_encode(data):
+    """Encode bytes to unpadded DNS-safe base64"""
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def b64url_decode(text):
+    """Decode unpadded DNS-safe base64"""
+    padding = 4 - (len(text) % 4)
+    if padding != 4:
+        text += '=' * padding
+    return base64.urlsafe_b64decode(text)
+
+
+def b32_encode(data):
+    """Encode bytes to unpadded lowercase base32 (case-insensitive)"""
+    return base64.b32encode(data).decode().rstrip('=').lower()
+
+
+def b32_decode(text):
+    """Decode unpadded base32, ignoring case"""
+    text = text.upper()
+    padding = 8 - (len(text) % 8)
+    if padding != 8:
+        text += '=' * padding
+    return base64.b32decode(text)
+
+
+def probe_pattern(nonce, size):
+    """Deterministic, incompressible probe payload shared with the server"""
+    out = bytearray()
+    counter = 0
+    while len(out) < size:
+        out += hashlib.sha256(f'{nonce}:{counter}'.encode()).digest()
+        counter += 1
+    return bytes(out[:size])
+
+
+def probe_name(nonce, size, domain, length=None, label_size=LABEL_SIZE):
+    """
+    Build the query name for a capacity probe. With a length, random
+    filler labels pad the name to that many characters; the expected
+    answer is probe_pattern(nonce + filler, size).
+    Returns (name, filler).
+    """
+    name = f'{nonce}.{size}.{PROBE_LABEL}.{domain.strip(".")}'
+    filler = ''
+    if length is not None and length > len(name) + 1:
+        # Each filler label costs its characters plus a dot
+        room = length - len(name)
+        labels = []
+        while room > 1:
+            label_len = min(label_size, room - 1)
+            labels.append(b32_encode(os.urandom(label_len))[:label_len])
+            room -= label_len + 1
+        filler = ''.join(labels)
+        name = '.'.join(labels + [name])
+    return name, filler
+
+
+def decode_answer(qtype, answers, domain):
+    """Extract tunnel bytes from DoH JSON answers of the given type"""
+    code = ANSWER_TYPES[qtype]
+    records = [a['data'] for a in answers if a.get('type') == code]
+    if not records:
+        return None
+
+    if qtype == 'NULL':
+        # RFC 3597 generic form: \# <length> <hex>
+        parts = records[0].split()
+        if len(parts) < 2 or parts[0] != '\\#':
+            return None
+        length = int(parts[1])
+        data = bytes.fromhex(''.join(parts[2:]))
+        return data if len(data) == length else None
+
+    if qtype == 'AAAA':
+        chunks = sorted(socket.inet_pton(socket.AF_INET6, r) for r in records)
+        framed = b''.join(chunk[1:] for chunk in chunks)
+        (length,) = struct.unpack('!H', framed[:2])
+        return framed[2:2 + length]
+
+    if qtype == 'CNAME':
+        target = records[0].rstrip('.')
+        if target.lower() == domain.strip('.').lower():
+            return b''
+        suffix = '.' + domain.strip('.')
+        if not target.lower().endswith(suffix.lower()):
+            return None
+        return b32_decode(target[:-len(suffix)].replace('.', ''))
+
+    # TXT: resolvers present multiple strings quoted or joined,
+    # so keep only the base64 alphabet
+    return b64url_decode(_B64URL_JUNK.sub('', records[0]))
+
+
+# Tunnel packet operations (client -> server)
+OP_DATA = 1
+OP_FETCH = 2
+# Several DATA frames, possibly of different messages, in one query
+OP_BATCH = 3
+# Held polls of several responses in one query
+OP_POLL = 4
+
+# Reply status codes (server -> client)
+ST_OK = 0
+ST_PENDING = 1
+ST_ERROR = 2
+# Chunk of a response that is still being read from the origin
+ST_PARTIAL = 3
+
+# op, client id, answer budget
+HEADER = struct.Struct('!B16sH')
+# msg id, fragment index, fragment count, parity group size (0: none)
+DATA = struct.Struct('!HHHB')
+# msg id, response offset, bytes consumed by the client so far,
+# how long the server may hold the query for data (ms)
+FETCH = struct.Struct('!HIIH')
+# status, msg id, fragments held, first missing fragment;
+# followed by a bitmap of the fragments held after it
+ACK = struct.Struct('!BHHH')
+# status, msg id, offset, response length (bytes so far while partial)
+CHUNK = struct.Struct('!BHII')
+
+# Batched frames: DATA or ACK or CHUNK header, then a length-prefixed body
+LENGTH = struct.Struct('!H')
+# poll hold in ms, then one entry per response: msg id, offset, bytes consumed
+POLL_HOLD = struct.Struct('!H')
+POLL = struct.Struct('!HII')
+
+# AES-GCM nonce and tag added to every sealed response chunk
+SEAL_OVERHEAD = 28
+
+# Response streams start with a length-prefixed JSON head
+HEAD_LENGTH = struct.Struct('!I')
+
+
+def pack_frame(header, data):
+    """One batched frame: its header, then its length-prefixed body"""
+    return header + LENGTH.pack(len(data)) + data
+
+
+def split_frames(body, header):
+    """Yield (header fields, body) for each batched frame"""
+    offset = 0
+    while offset + header.size + LENGTH.size <= len(body):
+        fields = header.unpack_from(body, offset)
+        offset += header.size
+        (length,) = LENGTH.unpack_from(body, offset)
+        offset += LENGTH.size
+        yield fields, body[offset:offset + length]
+        offset += length
+
+
+def encode_query_name(packet, domain, label_size=LABEL_SIZE):
+    """Encode a binary packet as base32 labels under the tunnel domain"""
+    encoded = b32_encode(packet)
+    labels = [encoded[i:i+label_size] for i in range(0, len(encoded), label_size)]
+    return '.'.join(labels + [domain.strip('.')])
+
+
+def query_name_length(size, domain, label_size=LABEL_SIZE):
+    """Length of the query name carrying a packet of the given size"""
+    chars = math.ceil(size * 8 / 5)
+    labels = math.ceil(chars / label_size)
+    return chars + labels + len(domain.strip('.'))
+
+
+def max_packet_size(domain, label_size=LABEL_SIZE, qname_size=QNAME_SIZE):
+    """Largest packet that fits in one query name"""
+    size = qname_size * 5 // 8
+    while size > 0 and query_name_length(size, domain, label_size) > qname_size:
+        size -= 1
+    return size
+
+
+def parity_fragment(fragments):
+    """XOR parity of a fragment group: XOR of the lengths, then of the zero-padded data"""
+    size = max(len(f) for f in fragments)
+    length = 0
+    value = 0
+    for fragment in fragments:
+        length ^= len(fragment)
+        value ^= int.from_bytes(fragment.ljust(size, b'\x00'), 'big')
+    return length.to_bytes(2, 'big') + value.to_bytes(size, 'big')
+
+
+def sack_bits(bitmap):
+    """Offsets of the set bits in a SACK bitmap (LSB first)"""
+    return [
+        byte_index * 8 + bit
+        for byte_index, byte in enumerate(bitmap) if byte
+        for bit in range(8) if byte >> bit & 1
+    ]
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+DNS Tunnel Pro - Cluster Store
+Copyright (c) 2025 Mr-X-01
+
+Stand-in shared store for cluster mode: keeps registered clients and
+per-node counters in memory and serves the nodes named in
+cluster.nodes on cluster.store.
+"""
+
+import sys
+import logging
+from pathlib import Path
+
+# Add server directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from dns_server.cluster import StoreServer
+from config.config_loader import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def main():
+    config = load_config(sys.argv[1] if len(sys.argv) > 1 else None)
+    StoreServer(config['cluster']['store'], config['cluster']['secret']).serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -16,7 +16,9 @@ def load_config(config_path=None):
             'port': 53,
             'domain': 'tunnel.example.com',
             'doh_resolver': 'https://common.dot.dns.yandex.net/dns-query',
-            'buffer_size': 512
+            'buffer_size': 512,
+            'probe_rate': 20,
+            'probe_burst': 200
         },
         'web_panel': {
             'host': '0.0.0.0',
@@ -25,7 +27,23 @@ def load_config(config_path=None):
             'ssl_key': 'ssl/key.pem',
             'secret_key': 'change-me-in-production',
             'admin_user': 'admin',
-            'admin_password': 'admin123'
+            'admin_password': 'admin123',
+            'database': 'database/tunnel.db',
+            'mode': 'process',
+            'log_file': 'logs/panel.log',
+            'control_socket': 'database/control.sock',
+            'stats_table': 'dns_tunnel_stats',
+            'stats_slots': 4096,
+            'stats_interval': 1.0,
+            'stats_sync_interval': 10,
+            'nice': 10
+        },
+        'profiler': {
+            'seconds': 10,
+            'max_seconds': 60,
+            'interval': 0.01,
+            'signal': 'SIGUSR2',
+            'output_dir': 'logs/profiles'
         },
         'proxy': {
             'socks5_host': '127.0.0.1',
@@ -35,7 +53,34 @@ def load_config(config_path=None):
             'level': 'INFO',
             'file': 'logs/server.log',
             'max_bytes': 10485760,
-            'backup_count': 5
+            'backup_count': 5,
+            'queue_size': 10000,
+            'sample_burst': 20,
+            'sample_window': 10,
+            'sample_rate': 0.01
+        },
+        'tunnel': {
+            'workers': 16,
+            'body_readers': 64,
+            'message_timeout': 120,
+            'stream_idle_timeout': 30,
+            'stream_window': 1048576,
+            'buffer_budget': 67108864,
+            'max_poll_hold': 2.0,
+            'max_held_polls': 256,
+            'header_table_size': 4096
+        },
+        'cluster': {
+            'enabled': False,
+            'node_id': 'node1',
+            'nodes': {'node1': '127.0.0.1:5400'},
+            'store': '127.0.0.1:5399',
+            'secret': 'change-me-in-production',
+            'sync_interval': 2.0,
+            'forward_timeout': 3.0,
+            'forward_workers': 64,
+            'heartbeat_interval': 0.5,
+            'node_timeout': 1.5
         },
         'security': {
             'encryption': 'aes-256-gcm',
@@ -49,7 +94,12 @@ def load_config(config_path=None):
         with open(config_path, 'r') as f:
             loaded_config = yaml.safe_load(f)
             if loaded_config:
-                default_config.update(loaded_config)
+                # Merge section by section so new defaults survive old files
+                for section, values in loaded_config.items():
+                    if isinstance(values, dict) and isinstance(default_config.get(section), dict):
+                        default_config[section].update(values)
+                    else:
+                        default_config[section] = values
     
     # Override with environment variables
     if os.getenv('DNS_DOMAIN'):
@@ -0,0 +1,474 @@
+"""Multi-node operation for DNS Tunnel Pro"""
+
+import hmac
+import json
+import time
+import base64
+import bisect
+import socket
+import struct
+import hashlib
+import secrets
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger(__name__)
+
+# Node-to-node datagrams: kind, request id, then a truncated HMAC of
+# kind, id and payload
+FORWARD = struct.Struct('!BI16s')
+FORWARD_REQUEST = 0
+FORWARD_REPLY = 1
+# Heartbeats between nodes
+FORWARD_PING = 2
+FORWARD_PONG = 3
+# Store lookups of unknown client ids that may miss per sync interval;
+# clients added on another node past that arrive with the next sync
+MAX_LOOKUP_MISSES = 64
+
+
+class ClusterError(Exception):
+    """The node owning a session didn't answer a forwarded packet"""
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)"""
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+class HashRing:
+    """
+    Consistent hashing of session ids onto nodes. Each node owns many
+    points on the ring, so adding or losing a node moves only its share
+    of sessions. Nodes marked down are skipped: their sessions go to the
+    next node on the ring.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.points = []
+        self.owners = {}
+        for node in nodes:
+            for replica in range(replicas):
+                point = self._hash(f'{node}#{replica}')
+                self.points.append(point)
+                self.owners[point] = node
+        self.points.sort()
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def owner(self, key, down=()):
+        """Node owning a key, or None if every node is down"""
+        start = bisect.bisect(self.points, self._hash(key))
+        for i in range(len(self.points)):
+            node = self.owners[self.points[(start + i) % len(self.points)]]
+            if node not in down:
+                return node
+        return None
+
+
+class StoreServer:
+    """
+    Stand-in for a shared store (e.g. Redis) that nodes keep cluster-wide
+    state in: registered clients with their keys, and each node's client
+    counters. State lives in this process's memory; run it with
+    cluster_store.py.
+    """
+
+    def __init__(self, address, secret):
+        self.address = parse_address(address)
+        self.authkey = secret.encode()
+        self.lock = threading.Lock()
+        self.clients = {}
+        # Bumped on every client change, so nodes only copy the registry
+        # when it moved
+        self.revision = 0
+        # Tells nodes this store apart from one before a restart, which
+        # they fill in again rather than take as empty
+        self.instance = secrets.token_hex(8)
+        self.node_stats = {}
+
+    def serve_forever(self):
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Cluster store listening on {self.address[0]}:{self.address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning(f"Store connection refused: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = json.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = {'ok': True, 'result': self._handle(request)}
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                conn.send_bytes(json.dumps(reply).encode())
+
+    def _handle(self, request):
+        op = request['op']
+        with self.lock:
+            if op == 'put_client':
+                self.clients[request['client_id']] = request['key']
+                self.revision += 1
+            elif op == 'put_clients':
+                self.clients.update(request['clients'])
+                self.revision += 1
+            elif op == 'remove_client':
+                if self.clients.pop(request['client_id'], None) is not None:
+                    self.revision += 1
+            elif op == 'get_client':
+                return self.clients.get(request['client_id'])
+            elif op == 'sync':
+                # A node's counters in, the registry (if changed) and the
+                # cluster-wide counters out
+                self.node_stats[request['node']] = request['stats']
+                current = request['instance'] == self.instance and request['revision'] == self.revision
+                # A copy: the reply is serialized after the lock is let go
+                return {
+                    'instance': self.instance,
+                    'revision': self.revision,
+                    'clients': None if current else dict(self.clients),
+                    'stats': self._totals()
+                }
+            else:
+                raise ValueError(f"Unknown store request {op}")
+
+    def _totals(self):
+        totals = {}
+        for stats in self.node_stats.values():
+            for client_id, client in stats.items():
+                total = totals.setdefault(client_id, {
+                    'id': client_id, 'connected': False, 'bytes_sent': 0, 'bytes_received': 0
+                })
+                total['connected'] = total['connected'] or client['connected']
+                total['bytes_sent'] += client['bytes_sent']
+                total['bytes_received'] += client['bytes_received']
+        return totals
+
+
+class StoreClient:
+    """A node's connection to the store, reconnecting after failures"""
+
+    def __init__(self, address, secret):
+        self.address = parse_address(address)
+        self.authkey = secret.encode()
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def call(self, op, **args):
+        data = json.dumps(dict(args, op=op)).encode()
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.conn is None:
+                        self.conn = Client(self.address, authkey=self.authkey)
+                    self.conn.send_bytes(data)
+                    reply = json.loads(self.conn.recv_bytes())
+                    break
+                except (OSError, EOFError):
+                    if self.conn is not None:
+                        self.conn.close()
+                        self.conn = None
+                    if attempt:
+                        raise
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+
+class ClusterNode:
+    """
+    One node of a cluster serving the same zone. A session's live state
+    (reassembly, response streams, header tables) stays on the node that
+    owns its client id on the hash ring; a node that receives a packet
+    of a session it doesn't own forwards it over UDP to the owner and
+    relays the reply. Forwarded packets are always handled where they
+    arrive, so nodes that briefly disagree about the ring can't loop.
+    Nodes exchange heartbeats; one silent for node_timeout is taken off
+    the ring (its sessions start over on the next node) until it answers
+    again. Clients and counters are shared through the store.
+    """
+
+    def __init__(self, config, server):
+        cluster_config = config['cluster']
+        self.server = server
+        self.node_id = cluster_config['node_id']
+        self.nodes = {
+            node: parse_address(address) for node, address in cluster_config['nodes'].items()
+        }
+        if self.node_id not in self.nodes:
+            raise ValueError(f"cluster.node_id {self.node_id} is not in cluster.nodes")
+        self.ring = HashRing(sorted(self.nodes))
+        self.secret = cluster_config['secret'].encode()
+        self.store = StoreClient(cluster_config['store'], cluster_config['secret'])
+        self.sync_interval = cluster_config['sync_interval']
+        self.forward_timeout = cluster_config['forward_timeout']
+        self.heartbeat_interval = cluster_config['heartbeat_interval']
+        self.node_timeout = cluster_config['node_timeout']
+
+        self.lock = threading.Lock()
+        # client id -> owning node of registered clients, cleared when a
+        # node goes down or up
+        self.owners = {}
+        self.down = set()
+        # Peers count as up until they have had node_timeout to answer
+        self.heard = {node: time.time() for node in self.nodes}
+        self.addresses = {address: node for node, address in self.nodes.items()}
+        self.pending = {}
+        self.next_request = 0
+        # client id -> time before which the store isn't asked again
+        self.unknown = {}
+        self.misses = 0
+        self.misses_since = time.time()
+        self.store_instance = None
+        self.revision = -1
+        self.stats = {}
+        self.forwarded = 0
+        self.received = 0
+        self.running = False
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.nodes[self.node_id])
+        # Forwarded packets may be held polls, so each gets a thread
+        self.executor = ThreadPoolExecutor(max_workers=cluster_config['forward_workers'])
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        logger.info(f"Cluster node {self.node_id} of {len(self.nodes)} on {self.nodes[self.node_id]}")
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def _sign(self, kind, request_id, payload):
+        header = FORWARD.pack(kind, request_id, bytes(16))[:-16]
+        return hmac.new(self.secret, header + payload, 'sha256').digest()[:16]
+
+    def _send(self, kind, request_id, payload, addr):
+        tag = self._sign(kind, request_id, payload)
+        self.sock.sendto(FORWARD.pack(kind, request_id, tag) + payload, addr)
+
+    def owner(self, client_id):
+        """Node that owns a client's session"""
+        owner = self.owners.get(client_id)
+        if owner is None:
+            with self.lock:
+                owner = self.ring.owner(client_id, self.down) or self.node_id
+                # Removed clients linger until the ring changes; a bound
+                # past the registry size keeps that in check
+                if len(self.owners) > len(self.server.client_keys) + 1024:
+                    self.owners.clear()
+                self.owners[client_id] = owner
+        return owner
+
+    def route(self, packet):
+        """
+        Reply bytes from the owning node for a packet of a session owned
+        elsewhere, or None to process it here. Packets of clients not in
+        the registry are processed here, so made-up client ids are neither
+        cached nor forwarded.
+        """
+        client_id = packet[1:17].hex()
+        if client_id not in self.server.client_keys:
+            return None
+        owner = self.owner(client_id)
+        if owner == self.node_id:
+            return None
+        try:
+            return self._forward(owner, packet)
+        except TimeoutError:
+            # No answer for the client either: it retries, by then
+            # through the next owner if the node is gone
+            raise ClusterError(f"Node {owner} did not answer")
+
+    def _forward(self, node, packet):
+        future = Future()
+        with self.lock:
+            request_id = self.next_request
+            self.next_request = (self.next_request + 1) & 0xFFFFFFFF
+            self.pending[request_id] = future
+        try:
+            self._send(FORWARD_REQUEST, request_id, packet, self.nodes[node])
+            self.forwarded += 1
+            return future.result(self.forward_timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def _receive_loop(self):
+        """Forwarded packets from other nodes and replies to ours"""
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            if len(data) < FORWARD.size:
+                continue
+            kind, request_id, tag = FORWARD.unpack_from(data)
+            payload = data[FORWARD.size:]
+            if not hmac.compare_digest(tag, self._sign(kind, request_id, payload)):
+                continue
+            if kind == FORWARD_REQUEST:
+                self.executor.submit(self._handle_forwarded, request_id, payload, addr)
+                continue
+            if kind == FORWARD_PING:
+                self._send(FORWARD_PONG, request_id, b'', addr)
+                continue
+            if kind == FORWARD_PONG:
+                node = self.addresses.get(addr)
+                if node is not None:
+                    self.heard[node] = time.time()
+                continue
+            with self.lock:
+                future = self.pending.get(request_id)
+            if future is not None and not future.done():
+                future.set_result(payload)
+
+    def _handle_forwarded(self, request_id, packet, addr):
+        self.received += 1
+        try:
+            reply = self.server.handle_packet(packet)
+        except Exception as e:
+            logger.error("Forwarded packet error: %s", e)
+            return
+        try:
+            self._send(FORWARD_REPLY, request_id, reply, addr)
+        except OSError:
+            pass
+
+    def lookup(self, client_id):
+        """
+        Fetch a client registered on another node; False if unknown. Only
+        MAX_LOOKUP_MISSES lookups per sync interval may miss, so packets
+        with random client ids can't keep the store busy.
+        """
+        now = time.time()
+        if self.unknown.get(client_id, 0) > now:
+            return False
+        with self.lock:
+            if now - self.misses_since > self.sync_interval:
+                self.misses = 0
+                self.misses_since = now
+            if self.misses >= MAX_LOOKUP_MISSES:
+                return False
+        try:
+            key = self.store.call('get_client', client_id=client_id)
+        except Exception as e:
+            logger.error(f"Cluster store error: {e}")
+            key = None
+        if key is None:
+            with self.lock:
+                self.misses += 1
+            if len(self.unknown) > 4096:
+                self.unknown = {c: t for c, t in self.unknown.items() if t > now}
+            self.unknown[client_id] = now + self.sync_interval
+            return False
+        self.server.register_client(client_id, base64.b64decode(key), publish=False)
+        return True
+
+    def publish_client(self, client_id, encryption_key):
+        self.store.call(
+            'put_client', client_id=client_id, key=base64.b64encode(encryption_key).decode()
+        )
+
+    def unpublish_client(self, client_id):
+        self.store.call('remove_client', client_id=client_id)
+
+    def _heartbeat_loop(self):
+        """Ping every peer, take silent ones off the ring and answering ones back"""
+        while self.running:
+            for node, address in self.nodes.items():
+                if node != self.node_id:
+                    try:
+                        self._send(FORWARD_PING, 0, b'', address)
+                    except OSError:
+                        pass
+            time.sleep(self.heartbeat_interval)
+            now = time.time()
+            down = {
+                node for node in self.nodes
+                if node != self.node_id and now - self.heard[node] > self.node_timeout
+            }
+            if down != self.down:
+                for node in down - self.down:
+                    logger.warning(f"Cluster node {node} is down, taking over its sessions")
+                for node in self.down - down:
+                    logger.info(f"Cluster node {node} is back")
+                with self.lock:
+                    self.down = down
+                    self.owners.clear()
+
+    def _sync_loop(self):
+        while self.running:
+            try:
+                self._sync()
+            except Exception as e:
+                logger.error(f"Cluster sync error: {e}")
+            time.sleep(self.sync_interval)
+
+    def _sync(self):
+        """Report this node's counters, pick up client changes from other nodes"""
+        local = {
+            client_id: dict(stats)
+            for client_id, stats in list(self.server.clients.items())
+        }
+        result = self.store.call(
+            'sync', node=self.node_id, instance=self.store_instance, revision=self.revision,
+            stats=local
+        )
+        self.stats = result['stats']
+        if result['instance'] != self.store_instance:
+            self._seed(result)
+            return
+        if result['clients'] is None:
+            return
+        clients = result['clients']
+        for client_id in list(self.server.client_keys):
+            if client_id not in clients:
+                self.server.remove_client(client_id, publish=False)
+        for client_id, key in clients.items():
+            if client_id not in self.server.client_keys:
+                self.server.register_client(client_id, base64.b64decode(key), publish=False)
+        self.revision = result['revision']
+
+    def _seed(self, result):
+        """
+        First sync with a store (this node or the store just started):
+        clients known here, e.g. loaded from the panel database, are added
+        to it instead of being removed for being missing, and those of
+        other nodes are picked up
+        """
+        clients = result['clients']
+        missing = {
+            client_id: base64.b64encode(key).decode()
+            for client_id, key in list(self.server.client_keys.items())
+            if client_id not in clients
+        }
+        if missing:
+            self.store.call('put_clients', clients=missing)
+            logger.info(f"Published {len(missing)} clients to the cluster store")
+        for client_id, key in clients.items():
+            if client_id not in self.server.client_keys:
+                self.server.register_client(client_id, base64.b64decode(key), publish=False)
+        self.store_instance = result['instance']
+        # The next sync reads the registry back with these in it
+        self.revision = -1
+
+    def client_stats(self):
+        """Cluster-wide counters as of the last sync"""
+        return self.stats
@@ -0,0 +1,191 @@
+"""DNS answer codecs for DNS Tunnel Pro"""
+
+import base64
+import hashlib
+import struct
+from dnslib import RR, QTYPE, TXT, AAAA, CNAME, RD
+
+# dnslib has no NULL rdata class, so it is packed as generic rdata
+QTYPE_NULL = 10
+
+# Answer types the server can carry tunnel data in
+ANSWER_TYPES = ('TXT', 'NULL', 'CNAME', 'AAAA')
+
+# Label used by the client to probe answer capacity
+PROBE_LABEL = '_probe'
+MAX_PROBE_SIZE = 4096
+
+TXT_STRING_SIZE = 255
+LABEL_SIZE = 63
+AAAA_CHUNK = 15
+
+
+def b64url_encode(data):
+    """Encode bytes to unpadded DNS-safe base64"""
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def b64url_decode(text):
+    """Decode unpadded DNS-safe base64"""
+    padding = 4 - (len(text) % 4)
+    if padding != 4:
+        text += '=' * padding
+    return base64.urlsafe_b64decode(text)
+
+
+def b32_encode(data):
+    """Encode bytes to unpadded lowercase base32 (case-insensitive)"""
+    return base64.b32encode(data).decode().rstrip('=').lower()
+
+
+def b32_decode(text):
+    """Decode unpadded base32, ignoring case"""
+    text = text.upper()
+    padding = 8 - (len(text) % 8)
+    if padding != 8:
+        text += '=' * padding
+    return base64.b32decode(text)
+
+
+def probe_pattern(nonce, size):
+    """Deterministic, incompressible probe payload shared with the client"""
+    out = bytearray()
+    counter = 0
+    while len(out) < size:
+        out += hashlib.sha256(f'{nonce}:{counter}'.encode()).digest()
+        counter += 1
+    return bytes(out[:size])
+
+
+def encode_answer(qname, qtype, data, domain):
+    """Encode bytes into answer records of the requested type"""
+    name = QTYPE.get(qtype, qtype)
+
+    if name == 'NULL':
+        if len(data) > 65535:
+            raise ValueError("Payload too large for NULL record")
+        return [RR(qname, QTYPE_NULL, rdata=RD(data), ttl=0)]
+
+    if name == 'AAAA':
+        # Resolvers may reorder records, so each one carries its index
+        framed = struct.pack('!H', len(data)) + data
+        chunks = [framed[i:i+AAAA_CHUNK] for i in range(0, len(framed), AAAA_CHUNK)]
+        if len(chunks) > 256:
+            raise ValueError("Payload too large for AAAA records")
+        records = []
+        for index, chunk in enumerate(chunks):
+            address = bytes([index]) + chunk.ljust(AAAA_CHUNK, b'\x00')
+            records.append(RR(qname, QTYPE.AAAA, rdata=AAAA(list(address)), ttl=0))
+        return records
+
+    if name == 'CNAME':
+        encoded = b32_encode(data)
+        labels = [encoded[i:i+LABEL_SIZE] for i in range(0, len(encoded), LABEL_SIZE)]
+        target = '.'.join(labels + [domain.strip('.')])
+        if len(target) > 253:
+            raise ValueError("Payload too large for CNAME record")
+        return [RR(qname, QTYPE.CNAME, rdata=CNAME(target), ttl=0)]
+
+    # TXT: one record with as many 255-byte strings as needed
+    encoded = b64url_encode(data)
+    strings = [encoded[i:i+TXT_STRING_SIZE].encode()
+               for i in range(0, len(encoded), TXT_STRING_SIZE)]
+    return [RR(qname, QTYPE.TXT, rdata=TXT(strings or [b'']), ttl=0)]
+
+
+def parse_probe(labels):
+    """
+    Parse '[filler.]<nonce>.<size>._probe' labels and return
+    (nonce, size, filler) or None. Filler labels pad the name to test how
+    long a query name survives the resolver path; they are folded into the
+    pattern seed so the answer proves they arrived intact.
+    """
+    if len(labels) < 3 or labels[-1].lower() != PROBE_LABEL:
+        return None
+    try:
+        size = int(labels[-2])
+    except ValueError:
+        return None
+    if size < 0 or size > MAX_PROBE_SIZE:
+        return None
+    filler = ''.join(labels[:-3]).lower()
+    return labels[-3].lower(), size, filler
+
+
+# Tunnel packet operations (client -> server)
+OP_DATA = 1
+OP_FETCH = 2
+# Several DATA frames, possibly of different messages, in one query
+OP_BATCH = 3
+# Held polls of several responses in one query
+OP_POLL = 4
+
+# Reply status codes (server -> client)
+ST_OK = 0
+ST_PENDING = 1
+ST_ERROR = 2
+# Chunk of a response that is still being read from the origin
+ST_PARTIAL = 3
+
+# op, client id, answer budget
+HEADER = struct.Struct('!B16sH')
+# msg id, fragment index, fragment count, parity group size (0: none)
+DATA = struct.Struct('!HHHB')
+# msg id, response offset, bytes consumed by the client so far,
+# how long the server may hold the query for data (ms)
+FETCH = struct.Struct('!HIIH')
+# status, msg id, fragments held, first missing fragment;
+# followed by a bitmap of the fragments held after it
+ACK = struct.Struct('!BHHH')
+# status, msg id, offset, response length (bytes so far while partial)
+CHUNK = struct.Struct('!BHII')
+
+# Batched frames: DATA or ACK or CHUNK header, then a length-prefixed body
+LENGTH = struct.Struct('!H')
+# poll hold in ms, then one entry per response: msg id, offset, bytes consumed
+POLL_HOLD = struct.Struct('!H')
+POLL = struct.Struct('!HII')
+
+# AES-GCM nonce and tag added to every sealed response chunk
+SEAL_OVERHEAD = 28
+
+# Response streams start with a length-prefixed JSON head
+HEAD_LENGTH = struct.Struct('!I')
+
+
+def pack_frame(header, data):
+    """One batched frame: its header, then its length-prefixed body"""
+    return header + LENGTH.pack(len(data)) + data
+
+
+def split_frames(body, header):
+    """Yield (header fields, body) for each batched frame"""
+    offset = 0
+    while offset + header.size + LENGTH.size <= len(body):
+        fields = header.unpack_from(body, offset)
+        offset += header.size
+        (length,) = LENGTH.unpack_from(body, offset)
+        offset += LENGTH.size
+        yield fields, body[offset:offset + length]
+        offset += length
+
+
+def decode_packet(labels):
+    """Reassemble a binary tunnel packet from query name labels"""
+    return b32_decode(''.join(labels))
+
+
+def error_reply(message):
+    """Build an error reply carrying a short reason"""
+    return bytes([ST_ERROR]) + message.encode()[:64]
+
+
+def recover_fragment(parity, fragments):
+    """Rebuild the one missing fragment of a group from its XOR parity"""
+    length = int.from_bytes(parity[:2], 'big')
+    size = len(parity) - 2
+    value = int.from_bytes(parity[2:], 'big')
+    for fragment in fragments:
+        length ^= len(fragment)
+        value ^= int.from_bytes(fragment.ljust(size, b'\x00'), 'big')
+    return value.to_bytes(size, 'big')[:length]
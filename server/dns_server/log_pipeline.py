@@ -0,0 +1,143 @@
+"""Non-blocking logging pipeline for DNS Tunnel Pro"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from dnslib.server import DNSLogger
+
+logger = logging.getLogger(__name__)
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out floods of warnings and errors from one client. Records
+    logged with extra={'client': ...} pass freely up to burst per window
+    seconds per client; past that only every 1/rate-th one does, tagged
+    with how many were dropped since the last one. Other records always
+    pass.
+    """
+
+    def __init__(self, burst=20, window=10.0, rate=0.01):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.every = max(int(round(1 / rate)), 1) if rate > 0 else 0
+        self.lock = threading.Lock()
+        # client -> [window start, records seen in it, dropped since last passed]
+        self.clients = {}
+
+    def filter(self, record):
+        client = getattr(record, 'client', None)
+        if client is None or record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            state = self.clients.get(client)
+            if state is None or now - state[0] >= self.window:
+                if state is None and len(self.clients) > 4096:
+                    self._prune(now)
+                dropped = state[2] if state is not None else 0
+                state = self.clients[client] = [now, 0, dropped]
+            state[1] += 1
+            seen = state[1] - self.burst
+            if seen > 0 and (not self.every or seen % self.every):
+                state[2] += 1
+                return False
+            dropped, state[2] = state[2], 0
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} similar suppressed]"
+        return True
+
+    def _prune(self, now):
+        """Forget clients that have been quiet for a window (lock held)"""
+        for client in [c for c, s in self.clients.items() if now - s[0] >= self.window]:
+            del self.clients[client]
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them. The
+    message is merged with its arguments by the writer, so arguments
+    should be immutable (or not changed after logging). When the queue is
+    full records are dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Traceback frames aren't kept alive for the writer
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                dropped = self.dropped
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': '%d log records dropped (queue full)', 'args': (dropped,),
+                }))
+                self.dropped -= dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DNSErrorLogger(DNSLogger):
+    """
+    dnslib hook that drops its per-query request/reply printing (a
+    synchronous print on every packet) and sends decoding errors to
+    logging, sampled per peer address.
+    """
+
+    def __init__(self):
+        super().__init__(log='error', prefix=False)
+
+    def log_error(self, handler, e):
+        peer = handler.client_address[0]
+        logger.warning("Invalid DNS packet from %s: %s", peer, e, extra={'client': peer})
+
+
+def setup_logging(config, console=True):
+    """
+    Route all logging through a queue to a background writer that owns
+    the rotating log file (and the console). Returns the started
+    QueueListener; stop it on shutdown to flush what is queued.
+    """
+    log_config = config['logging']
+    formatter = logging.Formatter(FORMAT)
+
+    handlers = [logging.handlers.RotatingFileHandler(
+        log_config['file'],
+        maxBytes=log_config['max_bytes'],
+        backupCount=log_config['backup_count'],
+        encoding='utf-8'
+    )]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(log_config['queue_size'])
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(
+        log_config['sample_burst'], log_config['sample_window'], log_config['sample_rate']
+    ))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log_config['level'])
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
@@ -0,0 +1,341 @@
+"""Link between the DNS server and a web panel running in another process"""
+
+import os
+import json
+import time
+import base64
+import struct
+import logging
+import threading
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger(__name__)
+
+STATS_MAGIC = b'DTS1'
+# magic, slot count, slots in use, time of the last publish
+STATS_HEADER = struct.Struct('!4sIId')
+# Each slot: sequence number (odd while being written), then the counters
+STATS_SEQUENCE = struct.Struct('!I')
+# client id, connected, bytes sent, bytes received
+STATS_SLOT = struct.Struct('!16s?QQ')
+SLOT_SIZE = STATS_SEQUENCE.size + STATS_SLOT.size
+
+
+class StatsTable:
+    """
+    Client counters in a shared memory block. One thread of the DNS
+    process writes, any number of panel processes read without locks:
+    a slot's sequence number is odd while it is being written, and a
+    reader retries a slot whose number changed under it.
+    """
+
+    def __init__(self, memory, slots):
+        self.memory = memory
+        self.buf = memory.buf
+        self.slots = slots
+        # Writer state
+        self.index = {}
+        self.free = []
+        self.used = 0
+
+    @classmethod
+    def create(cls, name, slots):
+        try:
+            # Left over from a process that didn't shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        memory = shared_memory.SharedMemory(
+            name, create=True, size=STATS_HEADER.size + slots * SLOT_SIZE
+        )
+        table = cls(memory, slots)
+        STATS_HEADER.pack_into(table.buf, 0, STATS_MAGIC, slots, 0, time.time())
+        return table
+
+    @classmethod
+    def attach(cls, name):
+        """Open the table of a running server (FileNotFoundError if none)"""
+        try:
+            memory = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13 an attached block is unlinked when the
+            # attaching process exits, unless it is kept from the tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                memory = shared_memory.SharedMemory(name)
+            finally:
+                resource_tracker.register = register
+        magic, slots, _, _ = STATS_HEADER.unpack_from(memory.buf, 0)
+        if magic != STATS_MAGIC:
+            memory.close()
+            raise FileNotFoundError(f"No stats table in shared memory block {name}")
+        return cls(memory, slots)
+
+    def publish(self, clients):
+        """Write the counters of every client, freeing slots of removed ones"""
+        for client_id in [c for c in self.index if c not in clients]:
+            slot = self.index.pop(client_id)
+            self._write(slot, bytes(16), False, 0, 0)
+            self.free.append(slot)
+        skipped = 0
+        for client_id, stats in list(clients.items()):
+            slot = self.index.get(client_id)
+            if slot is None:
+                slot = self._allocate(client_id)
+                if slot is None:
+                    skipped += 1
+                    continue
+            self._write(
+                slot, bytes.fromhex(client_id), stats.get('connected', False),
+                stats.get('bytes_sent', 0), stats.get('bytes_received', 0)
+            )
+        STATS_HEADER.pack_into(self.buf, 0, STATS_MAGIC, self.slots, self.used, time.time())
+        if skipped:
+            logger.warning(f"Stats table full: counters of {skipped} clients not published")
+
+    def retire(self):
+        """Mark the table as no longer published, so readers attach again at once"""
+        STATS_HEADER.pack_into(self.buf, 0, STATS_MAGIC, self.slots, self.used, 0.0)
+
+    def _allocate(self, client_id):
+        if self.free:
+            slot = self.free.pop()
+        elif self.used < self.slots:
+            slot = self.used
+            self.used += 1
+        else:
+            return None
+        self.index[client_id] = slot
+        return slot
+
+    def _write(self, slot, raw_id, connected, sent, received):
+        offset = STATS_HEADER.size + slot * SLOT_SIZE
+        (sequence,) = STATS_SEQUENCE.unpack_from(self.buf, offset)
+        STATS_SEQUENCE.pack_into(self.buf, offset, sequence + 1)
+        STATS_SLOT.pack_into(
+            self.buf, offset + STATS_SEQUENCE.size, raw_id, connected, sent, received
+        )
+        STATS_SEQUENCE.pack_into(self.buf, offset, (sequence + 2) & 0xFFFFFFFF)
+
+    def published(self):
+        """Time of the writer's last publish"""
+        return STATS_HEADER.unpack_from(self.buf, 0)[3]
+
+    def read(self):
+        """Return {client id: stats} in the shape of get_client_stats()"""
+        _, _, used, _ = STATS_HEADER.unpack_from(self.buf, 0)
+        clients = {}
+        for slot in range(min(used, self.slots)):
+            offset = STATS_HEADER.size + slot * SLOT_SIZE
+            while True:
+                (before,) = STATS_SEQUENCE.unpack_from(self.buf, offset)
+                fields = STATS_SLOT.unpack_from(self.buf, offset + STATS_SEQUENCE.size)
+                (after,) = STATS_SEQUENCE.unpack_from(self.buf, offset)
+                if before == after and not before & 1:
+                    break
+            raw_id, connected, sent, received = fields
+            if raw_id == bytes(16):
+                continue
+            client_id = raw_id.hex()
+            clients[client_id] = {
+                'id': client_id,
+                'connected': connected,
+                'bytes_sent': sent,
+                'bytes_received': received
+            }
+        return clients
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class PanelBridge:
+    """
+    DNS side of an out-of-process panel: publishes client counters to the
+    shared stats table every interval and serves client add/remove
+    requests on a local authenticated socket.
+    """
+
+    def __init__(self, config, dns_server):
+        panel_config = config['web_panel']
+        self.dns_server = dns_server
+        self.table_name = panel_config['stats_table']
+        self.slots = panel_config['stats_slots']
+        self.interval = panel_config['stats_interval']
+        self.address = panel_config['control_socket']
+        self.authkey = panel_config['secret_key'].encode()
+        self.table = None
+        self.listener = None
+        self.running = False
+
+    def start(self):
+        clients = len(self.dns_server.get_client_stats())
+        self.table = StatsTable.create(self.table_name, self._size(clients))
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        self.running = True
+        threading.Thread(target=self._publish_loop, daemon=True).start()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logger.info(f"Panel bridge on {self.address}, stats in shared memory {self.table_name}")
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+        if self.table is not None:
+            self.table.close(unlink=True)
+            self.table = None
+
+    def _publish_loop(self):
+        while self.running:
+            table = self.table
+            if table is None:
+                return
+            try:
+                clients = self.dns_server.get_client_stats()
+                if len(clients) > table.slots:
+                    table = self._grow(len(clients))
+                table.publish(clients)
+            except Exception as e:
+                logger.error(f"Stats publish error: {e}")
+            time.sleep(self.interval)
+
+    def _size(self, clients):
+        """Slots for a number of clients, with room for as many again"""
+        return max(self.slots, 2 * clients)
+
+    def _grow(self, clients):
+        """
+        Replace a table that ran out of slots with a larger one under the
+        same name; panels see the old one retired and attach to the new
+        """
+        old = self.table
+        self.table = StatsTable.create(self.table_name, self._size(clients))
+        logger.warning(f"Stats table grown from {old.slots} to {self.table.slots} slots "
+                       f"for {clients} clients")
+        old.retire()
+        old.close()
+        return self.table
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self.running:
+                    logger.warning(f"Panel connection refused: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        """Answer one panel connection's requests until it closes"""
+        with conn:
+            while self.running:
+                try:
+                    request = json.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = {'ok': True, 'result': self._handle(request)}
+                except Exception as e:
+                    logger.error(f"Panel request error: {e}")
+                    # Bad arguments are told apart, so the panel answers 400
+                    reply = {'ok': False, 'error': str(e), 'invalid': isinstance(e, ValueError)}
+                conn.send_bytes(json.dumps(reply).encode())
+
+    def _handle(self, request):
+        op = request['op']
+        if op == 'register':
+            self.dns_server.register_client(
+                request['client_id'], base64.b64decode(request['key'])
+            )
+        elif op == 'remove':
+            self.dns_server.remove_client(request['client_id'])
+        elif op == 'profile':
+            return self.dns_server.profile(request['seconds'])
+        else:
+            raise ValueError(f"Unknown panel request {op}")
+
+
+class RemoteTunnel:
+    """
+    Panel side of the bridge, standing in for the DNS server object the
+    panel otherwise calls directly. Counters are read from shared memory;
+    client changes go over the control socket.
+    """
+
+    def __init__(self, config):
+        panel_config = config['web_panel']
+        self.table_name = panel_config['stats_table']
+        self.interval = panel_config['stats_interval']
+        self.address = panel_config['control_socket']
+        self.authkey = panel_config['secret_key'].encode()
+        self.lock = threading.Lock()
+        self.table = None
+        self.conn = None
+
+    def get_client_stats(self):
+        with self.lock:
+            # A table nobody has published to for a while belongs to a
+            # server that has gone (or restarted under the same name)
+            if self.table is not None and time.time() - self.table.published() > 5 * self.interval + 5:
+                self.table.close()
+                self.table = None
+            if self.table is None:
+                try:
+                    self.table = StatsTable.attach(self.table_name)
+                except FileNotFoundError:
+                    return {}
+            return self.table.read()
+
+    def register_client(self, client_id, encryption_key):
+        self._call({
+            'op': 'register',
+            'client_id': client_id,
+            'key': base64.b64encode(encryption_key).decode()
+        })
+
+    def remove_client(self, client_id):
+        self._call({'op': 'remove', 'client_id': client_id})
+
+    def profile(self, seconds):
+        # On a connection of its own: the shared one would be held for
+        # the whole profile
+        with Client(self.address, family='AF_UNIX', authkey=self.authkey) as conn:
+            conn.send_bytes(json.dumps({'op': 'profile', 'seconds': seconds}).encode())
+            reply = json.loads(conn.recv_bytes())
+        if not reply['ok']:
+            if reply.get('invalid'):
+                raise ValueError(reply['error'])
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def _call(self, request):
+        data = json.dumps(request).encode()
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.conn is None:
+                        self.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                    self.conn.send_bytes(data)
+                    reply = json.loads(self.conn.recv_bytes())
+                    break
+                except (OSError, EOFError):
+                    # The server restarted: reconnect once
+                    if self.conn is not None:
+                        self.conn.close()
+                        self.conn = None
+                    if attempt:
+                        raise
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
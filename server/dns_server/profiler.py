@@ -0,0 +1,170 @@
+"""Sampling profiler for a running DNS Tunnel Pro server"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Stage a sample is charged to: the innermost frame in one of these
+# modules (or their submodules) decides. Calls into C show up as their
+# innermost Python caller.
+CATEGORIES = (
+    ('codec', ('dns_server.codec', 'tunnel_codec')),
+    ('crypto', ('cryptography',)),
+    ('upstream', ('requests', 'urllib3', 'http.client', 'ssl')),
+    ('dnslib', ('dnslib',)),
+)
+
+# Innermost frames of threads waiting for work: counted, not walked
+WAITS = {
+    ('threading', 'wait'),
+    ('threading', '_wait_for_tstate_lock'),
+    ('queue', 'get'),
+    ('selectors', 'select'),
+    ('socket', 'accept'),
+    ('concurrent.futures.thread', '_worker'),
+    ('multiprocessing.connection', '_recv'),
+}
+
+# One profile at a time: two samplers would each see the other
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken"""
+
+
+class _Code:
+    """What the sampler needs of a code object, worked out once"""
+
+    __slots__ = ('label', 'category', 'waits')
+
+    def __init__(self, frame):
+        code = frame.f_code
+        module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+        self.label = f"{module}:{code.co_name}"
+        self.category = next(
+            (category for category, modules in CATEGORIES
+             if any(module == m or module.startswith(m + '.') for m in modules)),
+            None
+        )
+        self.waits = (module, code.co_name) in WAITS
+
+
+def sample_stacks(seconds, interval=0.01, max_depth=64):
+    """
+    Sample the stacks of every other thread each interval for a number of
+    seconds and return the profile: collapsed stacks (one "f1;f2;f3
+    count" line per distinct stack, outermost first, as flamegraph.pl
+    and speedscope read them) and wall time per category and per
+    innermost function of each category. Threads waiting for work are
+    only counted as idle; ones sleeping in C (time.sleep, recv) look
+    busy in their caller. Raises ProfilerBusy if a profile is running.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        codes = {}
+        stacks = Counter()
+        idle = 0
+        samples = 0
+        me = threading.get_ident()
+        cpu = time.thread_time()
+        started = time.monotonic()
+        deadline = started + seconds
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = codes.get(frame.f_code)
+                if code is None:
+                    code = codes[frame.f_code] = _Code(frame)
+                if code.waits:
+                    idle += 1
+                    continue
+                # Code objects only: stacks are labelled once sampling is over
+                stack = []
+                while frame is not None and len(stack) < max_depth:
+                    if frame.f_code not in codes:
+                        codes[frame.f_code] = _Code(frame)
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stacks[tuple(stack)] += 1
+            frame = None
+            samples += 1
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        elapsed = time.monotonic() - started
+        cpu = time.thread_time() - cpu
+    finally:
+        _running.release()
+
+    # Each thread sample stands for the time between samples
+    weight = elapsed / samples
+    categories = Counter()
+    functions = {}
+    folded = Counter()
+    for stack, count in stacks.items():
+        infos = [codes[code] for code in stack]
+        category = next((info for info in infos if info.category), None)
+        if category is None:
+            categories['other'] += count
+        else:
+            categories[category.category] += count
+            functions.setdefault(category.category, Counter())[category.label] += count
+        folded[';'.join(info.label for info in reversed(infos))] += count
+    categories['idle'] += idle
+
+    return {
+        'seconds': round(elapsed, 3),
+        'interval': interval,
+        'samples': samples,
+        # Share of a CPU the sampler itself used
+        'overhead': round(cpu / elapsed, 4),
+        'categories': {
+            name: round(count * weight, 3) for name, count in categories.most_common()
+        },
+        'functions': {
+            name: [[label, round(count * weight, 3)] for label, count in counter.most_common(20)]
+            for name, counter in functions.items()
+        },
+        'collapsed': ''.join(f"{stack} {count}\n" for stack, count in folded.most_common()),
+    }
+
+
+def install_signal_handler(config, dns_server):
+    """
+    Take a profile of config['profiler']['seconds'] on the configured
+    signal (e.g. kill -USR2 <pid>) and write it to the output directory
+    as <name>.folded and <name>.json. Main thread only.
+    """
+    profiler_config = config['profiler']
+    signum = getattr(signal, profiler_config['signal'])
+
+    def run():
+        try:
+            profile = dns_server.profile(profiler_config['seconds'])
+        except ProfilerBusy as e:
+            logger.warning(f"Profile not taken: {e}")
+            return
+        directory = profiler_config['output_dir']
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, time.strftime('profile-%Y%m%d-%H%M%S'))
+        with open(base + '.folded', 'w') as f:
+            f.write(profile.pop('collapsed'))
+        with open(base + '.json', 'w') as f:
+            json.dump(profile, f, indent=2)
+        logger.info(f"Profile written to {base}.folded and {base}.json")
+
+    # The handler only starts the sampler: the main thread isn't held up
+    signal.signal(signum, lambda signo, frame: threading.Thread(
+        target=run, name='profiler', daemon=True
+    ).start())
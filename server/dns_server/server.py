@@ -5,16 +5,97 @@ import threading
 import logging
 import base64
 import json
-from dnslib import DNSRecord, DNSHeader, RR, QTYPE, A
-from dnslib.server import DNSServer, BaseResolver
+import time
+import sqlite3
+import itertools
+import math
+from dnslib import DNSRecord, DNSHeader, RR, QTYPE, RCODE, A
+from dnslib.server import DNSServer, DNSHandler, BaseResolver
 import requests
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dns_server.codec import (
+    ANSWER_TYPES, encode_answer, parse_probe, probe_pattern, decode_packet, error_reply,
+    OP_DATA, OP_FETCH, OP_BATCH, OP_POLL, ST_OK, ST_PENDING, ST_PARTIAL, ST_ERROR,
+    HEADER, DATA, FETCH, ACK, CHUNK, LENGTH, POLL_HOLD, POLL, SEAL_OVERHEAD, HEAD_LENGTH,
+    pack_frame, split_frames
+)
+from dns_server.session import ClientSession
+from dns_server.crypto_session import CryptoSession, SERVER_TO_CLIENT
+from dns_server.header_table import HeaderTableError
+from dns_server.log_pipeline import DNSErrorLogger
+from dns_server.profiler import sample_stacks
+from dns_server.cluster import ClusterNode
+from dns_server.stream import MemoryBudget, ResponseBuffer, StreamError, StreamAborted
 
 logger = logging.getLogger(__name__)
 
+# Origin bodies are read and buffered in pieces of this size
+READ_SIZE = 65536
+
+# UDP answer size for a query without EDNS (RFC 1035)
+CLASSIC_UDP_SIZE = 512
+
+
+class RateLimiter:
+    """Token buckets per key (e.g. source address), refilled at rate per second"""
+    
+    def __init__(self, rate, burst, max_keys=65536):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    def allow(self, key):
+        """Take a token for key if there is one"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if key not in self.buckets and len(self.buckets) >= self.max_keys:
+                # Full buckets are no different from absent ones
+                self.buckets = {
+                    k: (t, l) for k, (t, l) in self.buckets.items()
+                    if t + (now - l) * self.rate < self.burst
+                }
+                if len(self.buckets) >= self.max_keys:
+                    return False
+            if tokens < 1:
+                self.buckets[key] = tokens, now
+                return False
+            self.buckets[key] = tokens - 1, now
+            return True
+
+
+class TunnelDNSHandler(DNSHandler):
+    """dnslib's handler with UDP answers capped at the requester's EDNS size"""
+    
+    def get_reply(self, data):
+        request = DNSRecord.parse(data)
+        self.server.logger.log_request(self, request)
+        reply = self.server.resolver.resolve(request, self)
+        self.server.logger.log_reply(self, reply)
+        rdata = reply.pack()
+        if self.protocol == 'udp' and len(rdata) > self._udp_size(request):
+            # dnslib's truncate() drops the question too, which resolvers
+            # reject instead of retrying over TCP
+            truncated = request.reply()
+            truncated.header.tc = 1
+            rdata = truncated.pack()
+            self.server.logger.log_truncated(self, truncated)
+        return rdata
+    
+    @staticmethod
+    def _udp_size(request):
+        """Largest UDP answer the requester takes: its EDNS payload size, or 512"""
+        for rr in request.ar:
+            if rr.rtype == QTYPE.OPT:
+                return max(rr.rclass, CLASSIC_UDP_SIZE)
+        return CLASSIC_UDP_SIZE
+
 
 class DNSTunnelResolver(BaseResolver):
     """Custom DNS resolver with tunneling support"""
@@ -24,6 +105,15 @@ class DNSTunnelResolver(BaseResolver):
         self.tunnel_server = tunnel_server
         self.domain = config['dns']['domain']
         self.doh_resolver = config['dns']['doh_resolver']
+        # Probes are answered without a client id: limited per source
+        # address so the zone can't be used to reflect large answers. The
+        # source is the recursive resolver, so every client behind one
+        # shares its limit
+        self.probe_limiter = None
+        if config['dns']['probe_rate']:
+            self.probe_limiter = RateLimiter(
+                config['dns']['probe_rate'], config['dns']['probe_burst']
+            )
         
     def resolve(self, request, handler):
         """Resolve DNS request"""
@@ -31,29 +121,44 @@ class DNSTunnelResolver(BaseResolver):
         qname = str(request.q.qname)
         qtype = QTYPE[request.q.qtype]
         
-        logger.debug(f"DNS Query: {qname} ({qtype})")
+        # Per-query logging is lazy: nothing is formatted unless enabled
+        logger.debug("DNS Query: %s (%s)", qname, qtype)
         
-        # Check if this is our tunnel domain
-        if self.domain in qname:
-            # Extract tunnel data from subdomain
+        # Check if this is our tunnel domain (resolvers may randomise case)
+        labels = self._tunnel_labels(qname)
+        if labels is not None:
             try:
-                subdomain = qname.replace(f'.{self.domain}.', '').replace(f'.{self.domain}', '')
-                
-                # Decode tunnel data
-                if subdomain and subdomain != self.domain:
-                    data = self._decode_tunnel_data(subdomain)
-                    if data:
-                        # Process tunnel request
-                        response = self.tunnel_server.process_request(data)
-                        
-                        # Encode response in DNS answer
-                        encoded_response = self._encode_tunnel_response(response)
-                        
-                        # Add to reply
-                        reply.add_answer(
-                            RR(qname, QTYPE.TXT, rdata=encoded_response, ttl=0)
-                        )
+                if labels:
+                    probe = parse_probe(labels)
+                    if probe:
+                        peer = handler.client_address[0]
+                        if self.probe_limiter is not None and not self.probe_limiter.allow(peer):
+                            logger.debug("Probe from %s over the rate limit", peer)
+                            # Refused, not empty: clients read an empty answer
+                            # as "does not fit" and retry a refusal later
+                            reply.header.rcode = RCODE.REFUSED
+                            return reply
+                        # Capacity probe: answer with a known pattern
+                        nonce, size, filler = probe
+                        try:
+                            data = probe_pattern(nonce + filler, size)
+                            for rr in self._encode_answer(request, data):
+                                reply.add_answer(rr)
+                        except ValueError as e:
+                            # Oversized probes are expected, the client reads
+                            # the empty answer as "does not fit"
+                            logger.debug("Probe not answered: %s", e)
                         return reply
+                    
+                    packet = decode_packet(labels)
+                    
+                    # Process tunnel packet
+                    response = self.tunnel_server.process_packet(packet)
+                    
+                    # Encode response in DNS answer of the queried type
+                    for rr in self._encode_answer(request, response):
+                        reply.add_answer(rr)
+                    return reply
                 
                 # Default response for tunnel domain
                 reply.add_answer(
@@ -61,7 +166,8 @@ class DNSTunnelResolver(BaseResolver):
                 )
                 
             except Exception as e:
-                logger.error(f"Tunnel processing error: {e}")
+                peer = handler.client_address[0]
+                logger.error("Tunnel processing error: %s", e, extra={'client': peer})
                 reply.add_answer(
                     RR(qname, QTYPE.A, rdata=A('127.0.0.1'), ttl=60)
                 )
@@ -72,51 +178,26 @@ class DNSTunnelResolver(BaseResolver):
                 if upstream_reply:
                     return upstream_reply
             except Exception as e:
-                logger.error(f"DoH query error: {e}")
+                peer = handler.client_address[0]
+                logger.error("DoH query error: %s", e, extra={'client': peer})
         
         return reply
     
-    def _decode_tunnel_data(self, subdomain):
-        """Decode data from DNS subdomain"""
-        try:
-            # Remove any trailing dots and split by dots
-            parts = subdomain.strip('.').split('.')
-            
-            # Reconstruct base64 data
-            encoded = ''.join(parts)
-            
-            # Decode base64 (DNS-safe alphabet)
-            encoded = encoded.replace('-', '+').replace('_', '/')
-            padding = 4 - (len(encoded) % 4)
-            if padding != 4:
-                encoded += '=' * padding
-            
-            decoded = base64.b64decode(encoded)
-            return json.loads(decoded)
-        except Exception as e:
-            logger.debug(f"Failed to decode tunnel data: {e}")
+    def _tunnel_labels(self, qname):
+        """Return the labels below the tunnel domain, or None if not ours"""
+        labels = qname.rstrip('.').split('.')
+        domain_labels = self.domain.strip('.').lower().split('.')
+        suffix = [label.lower() for label in labels[-len(domain_labels):]]
+        if suffix != domain_labels:
             return None
+        return labels[:-len(domain_labels)]
     
-    def _encode_tunnel_response(self, response):
-        """Encode response data for DNS reply"""
-        try:
-            # Serialize to JSON
-            json_data = json.dumps(response)
-            
-            # Encode to base64
-            encoded = base64.b64encode(json_data.encode()).decode()
-            
-            # Make DNS-safe
-            encoded = encoded.replace('+', '-').replace('/', '_').replace('=', '')
-            
-            # Split into chunks if needed (DNS TXT record limit)
-            max_chunk = 255
-            chunks = [encoded[i:i+max_chunk] for i in range(0, len(encoded), max_chunk)]
-            
-            return chunks[0] if chunks else ''
-        except Exception as e:
-            logger.error(f"Failed to encode response: {e}")
-            return ''
+    def _encode_answer(self, request, data):
+        """Encode bytes as answer records matching the query type"""
+        qtype = request.q.qtype
+        if QTYPE.get(qtype, None) not in ANSWER_TYPES:
+            qtype = QTYPE.TXT
+        return encode_answer(request.q.qname, qtype, data, self.domain)
     
     def _query_doh(self, qname, qtype):
         """Query upstream DoH resolver"""
@@ -153,7 +234,7 @@ class DNSTunnelResolver(BaseResolver):
                 return reply
                 
         except Exception as e:
-            logger.debug(f"DoH query failed: {e}")
+            logger.debug("DoH query failed: %s", e)
         
         return None
 
@@ -165,8 +246,35 @@ class DNSTunnelServer:
         self.config = config
         self.clients = {}
         self.client_keys = {}
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
         self.running = False
         
+        # Completed messages are processed off the DNS handler threads
+        tunnel_config = config['tunnel']
+        self.message_timeout = tunnel_config['message_timeout']
+        self.stream_idle_timeout = tunnel_config['stream_idle_timeout']
+        self.stream_window = tunnel_config['stream_window']
+        self.max_poll_hold = tunnel_config['max_poll_hold']
+        # Must not be below the clients' header_table_size
+        self.header_table_size = tunnel_config['header_table_size']
+        # Each held poll keeps a DNS handler thread waiting
+        self.held_polls = threading.BoundedSemaphore(tunnel_config['max_held_polls'])
+        self.executor = ThreadPoolExecutor(max_workers=tunnel_config['workers'])
+        # Bodies that outgrow the stream window are finished here, so
+        # slow clients don't hold the workers every client shares
+        self.body_executor = ThreadPoolExecutor(
+            max_workers=tunnel_config['body_readers'], thread_name_prefix='body-reader'
+        )
+        
+        # Response bytes buffered for all clients share one budget
+        self.buffer_budget = MemoryBudget(tunnel_config['buffer_budget'])
+        self.sweep_thread = None
+        
+        # With several nodes behind the zone's NS records, sessions are
+        # owned by one node and shared state lives in the cluster store
+        self.cluster = ClusterNode(config, self) if config['cluster']['enabled'] else None
+        
         # Create resolver
         self.resolver = DNSTunnelResolver(config, self)
         
@@ -174,7 +282,9 @@ class DNSTunnelServer:
         self.dns_server = DNSServer(
             self.resolver,
             port=config['dns']['port'],
-            address='0.0.0.0'
+            address='0.0.0.0',
+            logger=DNSErrorLogger(),
+            handler=TunnelDNSHandler
         )
         
         logger.info("DNS Tunnel Server initialized")
@@ -182,17 +292,29 @@ class DNSTunnelServer:
     def start(self):
         """Start DNS server"""
         self.running = True
+        self.sweep_thread = threading.Thread(target=self._sweep_loop, daemon=True)
+        self.sweep_thread.start()
+        if self.cluster is not None:
+            self.cluster.start()
         logger.info(f"DNS Server listening on port {self.config['dns']['port']}")
         self.dns_server.start()
     
     def stop(self):
         """Stop DNS server"""
         self.running = False
+        if self.cluster is not None:
+            self.cluster.stop()
         self.dns_server.stop()
         logger.info("DNS Server stopped")
     
-    def register_client(self, client_id, encryption_key):
-        """Register a new client"""
+    def register_client(self, client_id, encryption_key, publish=True):
+        """Register a new client (on every node, unless publish is off)"""
+        if publish and self.cluster is not None:
+            self.cluster.publish_client(client_id, encryption_key)
+        self._add_client(client_id, encryption_key)
+        logger.info(f"Client registered: {client_id}")
+    
+    def _add_client(self, client_id, encryption_key):
         self.client_keys[client_id] = encryption_key
         self.clients[client_id] = {
             'id': client_id,
@@ -200,94 +322,429 @@ class DNSTunnelServer:
             'bytes_sent': 0,
             'bytes_received': 0
         }
-        logger.info(f"Client registered: {client_id}")
     
-    def process_request(self, data):
-        """Process tunnel request from client"""
+    def load_clients(self, database):
+        """
+        Register the active clients of the panel database. In a cluster
+        they reach the store on the node's first sync with it. Returns
+        how many were loaded.
+        """
+        if not os.path.exists(database):
+            return 0
+        conn = sqlite3.connect(database)
         try:
-            client_id = data.get('client_id')
-            encrypted_payload = data.get('payload')
-            
-            if not client_id or client_id not in self.client_keys:
-                return {'error': 'Invalid client'}
-            
-            # Decrypt payload
-            key = self.client_keys[client_id]
-            aesgcm = AESGCM(key)
+            rows = conn.execute(
+                'SELECT client_id, encryption_key FROM client WHERE is_active = 1'
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # The panel hasn't created its tables yet
+            return 0
+        finally:
+            conn.close()
+        for client_id, key in rows:
+            self._add_client(client_id, base64.b64decode(key))
+        logger.info(f"Loaded {len(rows)} clients from {database}")
+        return len(rows)
+    
+    def process_packet(self, packet):
+        """Process a tunnel packet from a client and build the reply bytes"""
+        if self.cluster is not None and len(packet) >= HEADER.size:
+            # Sessions owned by another node are served there
+            reply = self.cluster.route(packet)
+            if reply is not None:
+                return reply
+        return self.handle_packet(packet)
+    
+    def handle_packet(self, packet):
+        """Process a tunnel packet on this node"""
+        client_id = 'unknown'
+        try:
+            op, client_raw, budget = HEADER.unpack_from(packet)
+            body = packet[HEADER.size:]
+            client_id = client_raw.hex()
             
-            payload_bytes = base64.b64decode(encrypted_payload)
-            nonce = payload_bytes[:12]
-            ciphertext = payload_bytes[12:]
+            if client_id not in self.client_keys:
+                # It may have just been added on another node
+                if self.cluster is None or not self.cluster.lookup(client_id):
+                    return error_reply('Invalid client')
             
-            plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-            request_data = json.loads(plaintext)
+            session = self._get_session(client_id)
+            if session is None:
+                return error_reply('Invalid client')
             
             # Update client stats
             if client_id in self.clients:
                 self.clients[client_id]['connected'] = True
-                self.clients[client_id]['bytes_received'] += len(payload_bytes)
+                self.clients[client_id]['bytes_received'] += len(packet)
             
-            # Process the actual request
-            response_data = self._handle_proxy_request(request_data)
+            if op == OP_DATA:
+                header, bitmap = self._receive_fragment(
+                    session, client_id, *DATA.unpack_from(body), body[DATA.size:],
+                    budget - ACK.size
+                )
+                return header + bitmap
             
-            # Encrypt response
-            response_json = json.dumps(response_data)
-            nonce = os.urandom(12)
-            ciphertext = aesgcm.encrypt(nonce, response_json.encode(), None)
-            encrypted_response = base64.b64encode(nonce + ciphertext).decode()
+            if op == OP_BATCH:
+                # Frames of several messages, each answered with its own SACK
+                frames = list(split_frames(body, DATA))
+                share = max(budget // max(len(frames), 1) - ACK.size - LENGTH.size, 0)
+                replies = [
+                    pack_frame(*self._receive_fragment(session, client_id, *fields, data, share))
+                    for fields, data in frames
+                ]
+                return bytes([ST_OK]) + b''.join(replies)
             
-            # Update stats
-            if client_id in self.clients:
-                self.clients[client_id]['bytes_sent'] += len(encrypted_response)
+            if op == OP_FETCH:
+                msg_id, offset, acked, hold_ms = FETCH.unpack_from(body)
+                message = session.get_message(msg_id)
+                if message is None:
+                    return error_reply('Unknown message')
+                stream = message.response
+                if stream is None:
+                    return bytes([ST_PENDING]) + msg_id.to_bytes(2, 'big')
+                
+                # Bytes the client has consumed no longer need buffering
+                stream.acknowledge(acked)
+                if hold_ms:
+                    self._hold_poll(session, lambda: stream.readable(offset), hold_ms)
+                try:
+                    result = self._seal_chunk(
+                        session, client_id, stream, msg_id, offset, budget - CHUNK.size
+                    )
+                except StreamError as e:
+                    return error_reply(str(e))
+                if result is None:
+                    return bytes([ST_PENDING]) + msg_id.to_bytes(2, 'big')
+                header, sealed = result
+                return header + sealed
             
-            return {
-                'client_id': client_id,
-                'payload': encrypted_response
-            }
+            if op == OP_POLL:
+                return self._poll(session, client_id, body, budget)
+            
+            return error_reply('Unknown operation')
             
         except Exception as e:
-            logger.error(f"Request processing error: {e}")
-            return {'error': str(e)}
+            logger.error("Packet processing error: %s", e, extra={'client': client_id})
+            return error_reply(str(e))
+    
+    def _receive_fragment(self, session, client_id, msg_id, index, count, group, data, sack_size):
+        """Store one upstream fragment, return its ACK header and SACK bitmap"""
+        message, ready, (base, bitmap) = session.add_fragment(
+            msg_id, index, count, group, data, sack_size
+        )
+        if ready:
+            # The buffer exists before the origin is contacted so
+            # fetches can wait on it
+            message.response = ResponseBuffer(
+                self.stream_window, self.buffer_budget, session.notify
+            )
+            self.executor.submit(self._process_message, client_id, message)
+        return ACK.pack(ST_OK, msg_id, len(message.fragments), base), bitmap
+    
+    def _seal_chunk(self, session, client_id, stream, msg_id, offset, room):
+        """
+        Seal the response bytes at an offset that fit in room bytes,
+        return (chunk header, sealed chunk) or None if not produced yet
+        """
+        chunk = self._read_chunk(stream, msg_id, offset, room)
+        if chunk is None:
+            return None
+        return self._seal_chunks(session, client_id, [chunk])[0]
+    
+    def _read_chunk(self, stream, msg_id, offset, room):
+        """
+        Take the response bytes at an offset that fit in room bytes once
+        sealed, return (chunk header, chunk) or None if not produced yet
+        """
+        result = stream.read(offset, max(room - SEAL_OVERHEAD, 1))
+        if result is None:
+            return None
+        
+        # Only the requested chunk, sized for this answer
+        chunk, end, finished = result
+        status = ST_OK if finished else ST_PARTIAL
+        return CHUNK.pack(status, msg_id, offset, end), chunk
+    
+    def _seal_chunks(self, session, client_id, chunks):
+        """Seal (chunk header, chunk) pairs in one batch, return (chunk header, sealed chunk) pairs"""
+        # The header is authenticated so chunks can't be spliced
+        sealed = session.crypto.seal_batch([(chunk, header) for header, chunk in chunks])
+        if client_id in self.clients:
+            self.clients[client_id]['bytes_sent'] += sum(map(len, sealed))
+        return [(header, s) for (header, _), s in zip(chunks, sealed)]
+    
+    def _poll(self, session, client_id, body, budget):
+        """Answer held polls of several responses with every chunk that is ready"""
+        (hold_ms,) = POLL_HOLD.unpack_from(body)
+        entries = []
+        for position in range(POLL_HOLD.size, len(body) - POLL.size + 1, POLL.size):
+            msg_id, offset, acked = POLL.unpack_from(body, position)
+            message = session.get_message(msg_id)
+            stream = message.response if message is not None else None
+            if stream is not None:
+                stream.acknowledge(acked)
+            entries.append((msg_id, offset, message, stream))
+        
+        if hold_ms:
+            self._hold_poll(session, lambda: any(
+                message is None or (stream is not None and stream.readable(offset))
+                for _, offset, message, stream in entries
+            ), hold_ms)
+        
+        replies = []
+        chunks = []
+        room = budget - 1
+        for msg_id, offset, message, stream in entries:
+            if room < CHUNK.size + LENGTH.size:
+                break
+            if message is None:
+                replies.append(pack_frame(CHUNK.pack(ST_ERROR, msg_id, offset, 0), b''))
+                room -= CHUNK.size + LENGTH.size
+                continue
+            if stream is None or room < CHUNK.size + LENGTH.size + SEAL_OVERHEAD + 1:
+                continue
+            try:
+                chunk = self._read_chunk(stream, msg_id, offset, room - CHUNK.size - LENGTH.size)
+            except StreamError:
+                replies.append(pack_frame(CHUNK.pack(ST_ERROR, msg_id, offset, 0), b''))
+                room -= CHUNK.size + LENGTH.size
+                continue
+            if chunk is not None:
+                chunks.append(chunk)
+                room -= CHUNK.size + LENGTH.size + len(chunk[1]) + SEAL_OVERHEAD
+        # Chunks are sealed together once the reply is laid out; the
+        # client finds them by message and offset, not position
+        if chunks:
+            replies.extend(
+                pack_frame(*sealed) for sealed in self._seal_chunks(session, client_id, chunks)
+            )
+        return bytes([ST_OK]) + b''.join(replies)
+    
+    def _hold_poll(self, session, ready, hold_ms):
+        """Long-poll: keep a query open until ready() holds or the hold runs out"""
+        if not self.held_polls.acquire(blocking=False):
+            return
+        try:
+            session.wait_ready(ready, min(hold_ms / 1000, self.max_poll_hold))
+        finally:
+            self.held_polls.release()
+    
+    def _get_session(self, client_id):
+        """Get or create the reassembly session of a client"""
+        with self.sessions_lock:
+            session = self.sessions.get(client_id)
+            if session is None:
+                key = self.client_keys.get(client_id)
+                if key is None:
+                    return None
+                session = ClientSession(
+                    client_id,
+                    CryptoSession(key, SERVER_TO_CLIENT),
+                    self.message_timeout,
+                    self.stream_idle_timeout,
+                    self.header_table_size
+                )
+                self.sessions[client_id] = session
+            return session
+    
+    def _sweep_loop(self):
+        """Evict abandoned responses and idle sessions"""
+        while self.running:
+            time.sleep(5)
+            cutoff = time.time() - self.message_timeout
+            with self.sessions_lock:
+                sessions = list(self.sessions.items())
+            for client_id, session in sessions:
+                if session.expire() == 0 and session.last_seen < cutoff:
+                    with self.sessions_lock:
+                        if self.sessions.get(client_id) is session:
+                            del self.sessions[client_id]
+                    logger.debug("Session of %s evicted", client_id)
+    
+    def _process_message(self, client_id, message):
+        """Decrypt a reassembled request, run it and stream the response"""
+        session = self._get_session(client_id)
+        if session is None:
+            return
+        
+        # Chunks are sealed individually when the client fetches them
+        stream = message.response
+        try:
+            try:
+                # Decrypt payload; a request delivered again (a late
+                # duplicate or a replay) is refused, not run twice
+                plaintext = session.crypto.open(message.assemble(), replay=True)
+                request_data = json.loads(plaintext)
+                request_data['headers'] = self._decode_headers(session, request_data)
+            except Exception as e:
+                logger.error("Request processing error: %s", e, extra={'client': client_id})
+                head, body = self._error_response(e)
+                if isinstance(e, HeaderTableError):
+                    # The session was lost (e.g. a restart): the client
+                    # must start its header table over
+                    head['header_table_reset'] = True
+                self._write_response(stream, head, body)
+            else:
+                # Process the actual request
+                rest = self._handle_proxy_request(session, message, request_data)
+                if rest is not None:
+                    # A body that outgrew the window is finished by a body
+                    # reader, or waits for one: waiting for a slow client
+                    # must not hold one of the workers all clients share
+                    self.body_executor.submit(self._stream_body, client_id, message, *rest)
+                    return
+            stream.finish()
+        except StreamAborted:
+            logger.debug("Response %s of %s abandoned", message.msg_id, client_id)
+        except Exception as e:
+            logger.error("Response streaming error: %s", e, extra={'client': client_id})
+            stream.finish(e)
+    
+    def _stream_body(self, client_id, message, response, piece, pieces):
+        """Write the rest of a response body as fast as the client fetches it"""
+        stream = message.response
+        try:
+            with response:
+                stream.write(piece)
+                for piece in pieces:
+                    stream.write(piece)
+            stream.finish()
+        except StreamAborted:
+            logger.debug("Response %s of %s abandoned", message.msg_id, client_id)
+        except Exception as e:
+            logger.error("Response streaming error: %s", e, extra={'client': client_id})
+            stream.finish(e)
+    
+    def _decode_headers(self, session, request_data):
+        """
+        Apply the client's acknowledgements of response header blocks and
+        return the request headers, decoding an indexed header block
+        """
+        acks = request_data.get('header_acks')
+        if acks and acks[0] == session.response_headers.table_id:
+            for block_id in acks[1:]:
+                session.response_headers.acknowledge(block_id)
+        
+        headers = request_data.get('headers') or {}
+        if 'fields' in headers:
+            return dict(session.request_headers.decode(headers))
+        return headers
     
-    def _handle_proxy_request(self, request_data):
-        """Handle proxied HTTP request"""
+    def _handle_proxy_request(self, session, message, request_data):
+        """
+        Handle proxied HTTP request, streaming the response into the
+        buffer while it has room. Returns None once the response is
+        written, or (response, piece, pieces) for the rest of a body that
+        would have to wait for the client.
+        """
+        stream = message.response
         try:
             url = request_data.get('url')
             method = request_data.get('method', 'GET')
             headers = request_data.get('headers', {})
             body = request_data.get('body')
+            if body:
+                body = base64.b64decode(body)
             
-            # Make the request
+            # Make the request, the body is read as the client consumes it
             response = requests.request(
                 method=method,
                 url=url,
                 headers=headers,
                 data=body,
                 timeout=10,
-                allow_redirects=True
+                allow_redirects=True,
+                stream=True
             )
-            
-            return {
-                'status_code': response.status_code,
-                'headers': dict(response.headers),
-                'body': base64.b64encode(response.content).decode()
+        except Exception as e:
+            logger.error("Proxy request error: %s", e, extra={'client': session.client_id})
+            self._write_response(stream, *self._error_response(e))
+            return None
+        
+        handed_on = False
+        try:
+            # The body is decoded and de-chunked by requests, so the origin
+            # length only holds for identity-encoded bodies
+            response_headers = {
+                name: value for name, value in response.headers.items()
+                if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
             }
+            length = response.headers.get('Content-Length')
+            if length and response.headers.get('Content-Encoding', 'identity') == 'identity':
+                response_headers['Content-Length'] = length
             
-        except Exception as e:
-            logger.error(f"Proxy request error: {e}")
-            return {
-                'error': str(e),
-                'status_code': 500
+            # Headers go as a block against the session's header table
+            block, message.header_block = session.response_headers.encode(
+                response_headers.items()
+            )
+            head = {
+                'status_code': response.status_code,
+                'reason': response.reason,
+                'headers': block
             }
+            pieces = itertools.chain([self._head_bytes(head)], response.iter_content(READ_SIZE))
+            for piece in pieces:
+                if not stream.fits(len(piece)):
+                    handed_on = True
+                    return response, piece, pieces
+                stream.write(piece)
+        finally:
+            if not handed_on:
+                response.close()
+        return None
+    
+    def _head_bytes(self, head):
+        """A response head as it starts the stream: length-prefixed JSON"""
+        head_json = json.dumps(head, separators=(',', ':')).encode()
+        return HEAD_LENGTH.pack(len(head_json)) + head_json
+    
+    def _write_head(self, stream, head):
+        """Start a response stream with its head"""
+        stream.write(self._head_bytes(head))
+    
+    def _write_response(self, stream, head, body):
+        self._write_head(stream, head)
+        stream.write(body)
+    
+    def _error_response(self, error):
+        """Build a 502 response describing a failed request"""
+        body = str(error).encode()
+        head = {
+            'status_code': 502,
+            'reason': 'Bad Gateway',
+            'headers': {'Content-Type': 'text/plain', 'Content-Length': str(len(body))},
+            'error': str(error)
+        }
+        return head, body
     
     def get_client_stats(self):
-        """Get statistics for all clients"""
+        """Get statistics for all clients (cluster-wide in cluster mode)"""
+        if self.cluster is not None:
+            return self.cluster.client_stats()
         return self.clients
     
-    def remove_client(self, client_id):
-        """Remove a client"""
+    def profile(self, seconds):
+        """
+        Sample this process' thread stacks for up to profiler.max_seconds.
+        Raises ValueError for a duration that isn't a finite number.
+        """
+        profiler_config = self.config['profiler']
+        seconds = float(seconds)
+        if not math.isfinite(seconds):
+            raise ValueError(f"Invalid profile duration {seconds}")
+        seconds = min(max(seconds, 0.1), profiler_config['max_seconds'])
+        return sample_stacks(seconds, profiler_config['interval'])
+    
+    def remove_client(self, client_id, publish=True):
+        """Remove a client (from every node, unless publish is off)"""
+        if publish and self.cluster is not None:
+            self.cluster.unpublish_client(client_id)
         if client_id in self.clients:
             del self.clients[client_id]
         if client_id in self.client_keys:
             del self.client_keys[client_id]
+        with self.sessions_lock:
+            session = self.sessions.pop(client_id, None)
+        if session is not None:
+            session.close()
         logger.info(f"Client removed: {client_id}")
@@ -0,0 +1,156 @@
+"""Tunnel session state for DNS Tunnel Pro"""
+
+import time
+import threading
+from dns_server.codec import recover_fragment
+from dns_server.header_table import HeaderEncoder, HeaderDecoder
+
+# Largest SACK bitmap sent back with a fragment acknowledgement
+MAX_SACK_BYTES = 128
+
+
+class InboundMessage:
+    """Upstream message being reassembled from fragments"""
+
+    def __init__(self, msg_id, count, group=0):
+        self.msg_id = msg_id
+        self.count = count
+        self.group = group
+        self.fragments = {}
+        self.parity = {}
+        self.base = 0
+        self.created = time.time()
+        self.last_active = self.created
+        self.dispatched = False
+        self.response = None
+        # Id of the header block sent with the response, until acknowledged
+        self.header_block = None
+
+    @property
+    def complete(self):
+        return len(self.fragments) == self.count
+
+    def assemble(self):
+        return b''.join(self.fragments[i] for i in range(self.count))
+
+    def add(self, index, data):
+        """Store a data or parity fragment, rebuilding a lost one if possible"""
+        if index < self.count:
+            self.fragments.setdefault(index, data)
+            if self.group:
+                self._recover(index // self.group)
+        elif self.group and index - self.count < -(-self.count // self.group):
+            group = index - self.count
+            self.parity.setdefault(group, data)
+            self._recover(group)
+        while self.base in self.fragments:
+            self.base += 1
+
+    def _recover(self, group):
+        """XOR parity fills in a group missing exactly one fragment"""
+        parity = self.parity.get(group)
+        if parity is None:
+            return
+        indexes = range(group * self.group, min((group + 1) * self.group, self.count))
+        missing = [i for i in indexes if i not in self.fragments]
+        if len(missing) == 1:
+            others = [self.fragments[i] for i in indexes if i != missing[0]]
+            self.fragments[missing[0]] = recover_fragment(parity, others)
+
+    def sack(self, size):
+        """Return (first missing index, bitmap of held fragments after it)"""
+        size = min(size, MAX_SACK_BYTES)
+        bitmap = bytearray(max(min(size, -(-(self.count - self.base) // 8)), 0))
+        for offset in range(len(bitmap) * 8):
+            if self.base + offset in self.fragments:
+                bitmap[offset // 8] |= 1 << (offset % 8)
+        return self.base, bytes(bitmap)
+
+
+class ClientSession:
+    """Per-client reassembly state, independent of the resolver path"""
+
+    def __init__(self, client_id, crypto, message_timeout=120, stream_idle_timeout=30,
+                 header_table_size=4096):
+        self.client_id = client_id
+        self.crypto = crypto
+        self.message_timeout = message_timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        # Header tables shared with the client, one per direction
+        self.request_headers = HeaderDecoder(header_table_size)
+        self.response_headers = HeaderEncoder(header_table_size)
+        self.messages = {}
+        self.lock = threading.Lock()
+        self.last_seen = time.time()
+        # Signalled whenever any response of the session gets data
+        self.data_ready = threading.Condition()
+
+    def add_fragment(self, msg_id, index, count, group, data, sack_size=0):
+        """
+        Store a fragment, return the message, whether it just completed,
+        and its SACK state (first missing index, bitmap)
+        """
+        with self.lock:
+            self.last_seen = time.time()
+            self._expire()
+            message = self.messages.get(msg_id)
+            if message is None or message.count != count or message.group != group:
+                message = InboundMessage(msg_id, count, group)
+                self.messages[msg_id] = message
+            message.last_active = self.last_seen
+            message.add(index, data)
+            ready = message.complete and not message.dispatched
+            if ready:
+                message.dispatched = True
+            return message, ready, message.sack(sack_size)
+
+    def get_message(self, msg_id):
+        """Return a message by id or None"""
+        with self.lock:
+            self.last_seen = time.time()
+            message = self.messages.get(msg_id)
+            if message is not None:
+                message.last_active = self.last_seen
+            return message
+
+    def notify(self):
+        with self.data_ready:
+            self.data_ready.notify_all()
+
+    def wait_ready(self, ready, timeout):
+        """Block until ready() holds for this session's responses or the timeout"""
+        with self.data_ready:
+            self.data_ready.wait_for(ready, timeout)
+
+    def expire(self):
+        """Drop stale messages, return how many are left"""
+        with self.lock:
+            self._expire()
+            return len(self.messages)
+
+    def close(self):
+        """Drop every message and release its buffered response"""
+        with self.lock:
+            for message in self.messages.values():
+                self._drop(message)
+            self.messages.clear()
+
+    def _expire(self):
+        """
+        Drop uploads idle past the message timeout and responses the
+        client stopped fetching (lock held)
+        """
+        now = time.time()
+        for msg_id, message in list(self.messages.items()):
+            timeout = self.message_timeout if message.response is None else self.stream_idle_timeout
+            if message.last_active < now - timeout:
+                self._drop(message)
+                del self.messages[msg_id]
+
+    def _drop(self, message):
+        """Release what a dropped message holds"""
+        if message.response is not None:
+            message.response.abort()
+        if message.header_block is not None:
+            # The client can no longer fetch, so its header block is done
+            self.response_headers.release(message.header_block)
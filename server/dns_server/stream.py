@@ -0,0 +1,156 @@
+"""Bounded response buffering for DNS Tunnel Pro"""
+
+import threading
+
+
+class StreamError(Exception):
+    """A fetch asked for bytes the stream can no longer provide"""
+
+
+class StreamAborted(Exception):
+    """The stream was abandoned while its producer was writing"""
+
+
+class MemoryBudget:
+    """Global cap on response bytes buffered across all sessions"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def reserve(self, size, cancelled):
+        """Wait until size bytes fit in the budget; False if cancelled first"""
+        with self.cond:
+            # A lone oversized reservation is let through so it can't stall forever
+            while self.used and self.used + size > self.limit:
+                if cancelled():
+                    return False
+                self.cond.wait(1)
+            self.used += size
+            return True
+
+    def fits(self, size):
+        """Whether reserve(size) would return without waiting"""
+        with self.cond:
+            return not self.used or self.used + size <= self.limit
+
+    def release(self, size):
+        with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+
+
+class ResponseBuffer:
+    """
+    Sliding window over one response stream. The origin reader appends
+    at the end and blocks while the window is full; bytes are dropped
+    from the front once the client acknowledges them, so a response of
+    any size holds at most capacity bytes.
+    """
+
+    def __init__(self, capacity, budget, listener=None):
+        self.capacity = capacity
+        self.budget = budget
+        self.listener = listener
+        self.cond = threading.Condition()
+        self.data = bytearray()
+        self.base = 0
+        self.finished = False
+        self.error = None
+        self.aborted = False
+
+    @property
+    def end(self):
+        """Stream offset just past the last buffered byte"""
+        return self.base + len(self.data)
+
+    def write(self, data):
+        """Append bytes, waiting for window and budget space (backpressure)"""
+        view = memoryview(data)
+        while view:
+            with self.cond:
+                while not self.aborted and len(self.data) >= self.capacity:
+                    self.cond.wait(1)
+                if self.aborted:
+                    raise StreamAborted()
+                piece = view[:self.capacity - len(self.data)]
+
+            if not self.budget.reserve(len(piece), lambda: self.aborted):
+                raise StreamAborted()
+
+            with self.cond:
+                if self.aborted:
+                    self.budget.release(len(piece))
+                    raise StreamAborted()
+                self.data += piece
+                self.cond.notify_all()
+            self._notify()
+            view = view[len(piece):]
+
+    def fits(self, size):
+        """Whether write(data) of size bytes would return without waiting"""
+        with self.cond:
+            if len(self.data) + size > self.capacity:
+                return False
+        return self.budget.fits(size)
+
+    def finish(self, error=None):
+        """Mark the end of the stream, optionally because the origin failed"""
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+        self._notify()
+
+    def acknowledge(self, offset):
+        """Drop bytes below an offset the client has consumed"""
+        with self.cond:
+            count = min(offset, self.end) - self.base
+            if count <= 0:
+                return
+            del self.data[:count]
+            self.base += count
+            self.cond.notify_all()
+        self.budget.release(count)
+        self._notify()
+
+    def readable(self, offset):
+        """Whether a read at an offset would return now"""
+        return self.end > offset or self.finished or self.aborted
+
+    def _notify(self):
+        """Tell whoever holds polls on this stream that it changed"""
+        if self.listener is not None:
+            self.listener()
+
+    def read(self, offset, size):
+        """
+        Return (chunk, end, finished) for up to size bytes at an offset,
+        or None if they haven't been produced yet.
+        """
+        with self.cond:
+            if self.aborted:
+                raise StreamError('Stream evicted')
+            if offset < self.base:
+                raise StreamError('Chunk already acknowledged')
+            if offset >= self.end and not self.finished:
+                return None
+            if offset >= self.end and self.error is not None:
+                raise StreamError('Origin read failed')
+            start = offset - self.base
+            chunk = bytes(self.data[start:start + size])
+            return chunk, self.end, self.finished and self.error is None
+
+    def abort(self):
+        """Release the buffered bytes and stop the producer"""
+        with self.cond:
+            if self.aborted:
+                return
+            self.aborted = True
+            count = len(self.data)
+            self.data = bytearray()
+            self.base += count
+            self.cond.notify_all()
+        self.budget.release(count)
+        self._notify()
@@ -6,6 +6,9 @@ Copyright (c) 2025 Mr-X-01
 
 import os
 import sys
+import atexit
+import signal
+import multiprocessing
 import threading
 import logging
 from pathlib import Path
@@ -14,39 +17,44 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from dns_server.server import DNSTunnelServer
-from web_panel.app import create_app
+from dns_server.panel_bridge import PanelBridge
+from web_panel.app import create_app, run_app, run_panel
 from config.config_loader import load_config
-
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/server.log'),
-        logging.StreamHandler()
-    ]
-)
+from dns_server.log_pipeline import setup_logging
+from dns_server.profiler import install_signal_handler
 
 logger = logging.getLogger(__name__)
 
 
 def main():
     """Main entry point"""
-    logger.info("=" * 60)
-    logger.info("DNS Tunnel Pro Server Starting...")
-    logger.info("=" * 60)
-    
-    # Load configuration
-    config = load_config()
+    # Load configuration (a path may be given, e.g. one per cluster node)
+    config = load_config(sys.argv[1] if len(sys.argv) > 1 else None)
     
     # Create necessary directories
     os.makedirs('logs', exist_ok=True)
+    os.makedirs(os.path.dirname(config['logging']['file']) or '.', exist_ok=True)
     os.makedirs('database', exist_ok=True)
     os.makedirs('../client_configs', exist_ok=True)
     
+    # Setup logging: records are queued and written (with rotation) by a
+    # background thread, so a slow disk never stalls DNS handlers
+    listener = setup_logging(config)
+    atexit.register(listener.stop)
+    # A plain exit on SIGTERM, so the cleanup registered with atexit runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    logger.info("=" * 60)
+    logger.info("DNS Tunnel Pro Server Starting...")
+    logger.info("=" * 60)
+    
     # Initialize DNS server
     logger.info("Initializing DNS Tunnel Server...")
     dns_server = DNSTunnelServer(config)
+    # Clients created in the panel before this start
+    dns_server.load_clients(config['web_panel']['database'])
+    # kill -USR2 <pid> writes a profile of the running server
+    install_signal_handler(config, dns_server)
     
     # Start DNS server in background thread
     dns_thread = threading.Thread(target=dns_server.start, daemon=True)
@@ -55,30 +63,45 @@ def main():
     
     # Start web panel
     logger.info("Initializing Web Panel...")
-    app = create_app(config, dns_server)
-    
-    ssl_context = (
-        config['web_panel']['ssl_cert'],
-        config['web_panel']['ssl_key']
-    )
-    
+    mode = config['web_panel']['mode']
+    if mode not in ('process', 'thread', 'external'):
+        raise ValueError(f"Unknown web_panel.mode: {mode}")
     host = config['web_panel']['host']
     port = config['web_panel']['port']
     
-    logger.info(f"✓ Web Panel starting on https://{host}:{port}")
+    if mode == 'thread':
+        app = create_app(config, dns_server)
+    else:
+        # The panel runs in another process, so page renders, TLS and
+        # database work don't take GIL time from the DNS handlers
+        bridge = PanelBridge(config, dns_server).start()
+        atexit.register(bridge.stop)
+    
+    if mode == 'process':
+        # Spawned, not forked: the DNS threads are already running
+        panel = multiprocessing.get_context('spawn').Process(
+            target=run_panel, args=(config,), name='web-panel', daemon=True
+        )
+        panel.start()
+    
+    if mode == 'external':
+        logger.info("✓ Web Panel expected as a separate process (web_panel.wsgi)")
+    else:
+        logger.info(f"✓ Web Panel starting on https://{host}:{port}")
     logger.info("=" * 60)
     logger.info("Server is ready!")
     logger.info(f"Access Web Panel: https://YOUR_IP:{port}")
     logger.info("=" * 60)
     
-    # Run Flask app
-    app.run(
-        host=host,
-        port=port,
-        ssl_context=ssl_context,
-        debug=False,
-        threaded=True
-    )
+    if mode == 'thread':
+        # Run Flask app
+        run_app(app, config)
+        return
+    
+    if mode == 'process':
+        panel.join()
+        logger.error(f"Web panel process exited with code {panel.exitcode}")
+    dns_thread.join()
 
 
 if __name__ == '__main__':
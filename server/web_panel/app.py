@@ -1,19 +1,32 @@
 """Web Panel for DNS Tunnel Pro"""
 
 import os
+import time
 import secrets
+import threading
 import json
 import base64
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+import math
+import logging
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, Response
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, or_, and_, bindparam
 from werkzeug.security import generate_password_hash, check_password_hash
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+logger = logging.getLogger(__name__)
+
 db = SQLAlchemy()
 login_manager = LoginManager()
 
+# A client counts as online if seen this recently (seconds)
+ONLINE_WINDOW = 300
+# Clients per page of the client list and /api/stats
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 
 class User(UserMixin, db.Model):
     """User model for web panel"""
@@ -32,25 +45,187 @@ class User(UserMixin, db.Model):
 
 class Client(db.Model):
     """Client model"""
+    # Active clients by activity: the dashboard's list and online count
+    __table_args__ = (db.Index('ix_client_active_last_seen', 'is_active', 'last_seen'),)
+    
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.String(64), unique=True, nullable=False)
-    name = db.Column(db.String(100), nullable=False)
+    client_id = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False, index=True)
     encryption_key = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime, index=True)
     is_active = db.Column(db.Boolean, default=True)
     bytes_sent = db.Column(db.BigInteger, default=0)
     bytes_received = db.Column(db.BigInteger, default=0)
     notes = db.Column(db.Text)
 
 
+# Client list orderings: the keyset is (column, id)
+SORTS = {
+    'created': Client.id,
+    'name': Client.name,
+    'last_seen': Client.last_seen,
+    'traffic': Client.bytes_sent + Client.bytes_received,
+}
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets page reads run alongside the stats writer instead of
+    waiting for (or blocking) it; a writer waits for another one
+    rather than failing at once
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
+def _encode_cursor(client, sort):
+    value = getattr(client, sort) if sort in ('name', 'last_seen') else client.id
+    if sort == 'traffic':
+        value = (client.bytes_sent or 0) + (client.bytes_received or 0)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, client.id]).encode()).decode()
+
+
+def _decode_cursor(cursor, sort):
+    """Return (sort value, id) of a cursor, ValueError if it is malformed"""
+    try:
+        value, client_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == 'last_seen' and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(client_id)
+    except Exception:
+        raise ValueError(f"Bad cursor: {cursor}")
+
+
+def _after(column, value, last_id, descending):
+    """Rows past (value, last_id) in the given order; SQLite sorts NULLs first"""
+    if descending:
+        if value is None:
+            return and_(column.is_(None), Client.id < last_id)
+        return or_(column < value, and_(column == value, Client.id < last_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), Client.id > last_id), column.isnot(None))
+    return or_(column > value, and_(column == value, Client.id > last_id))
+
+
+def client_page(args):
+    """
+    One page of clients for the list arguments q (name substring or
+    client id prefix), status (active, disabled), sort (see SORTS),
+    order (asc, desc), limit and after (the previous page's cursor).
+    Pages are read by keyset, so any page costs the same as the first.
+    Returns (clients, total matching, cursor of the next page or None).
+    """
+    sort = args.get('sort', 'created')
+    if sort not in SORTS:
+        sort = 'created'
+    descending = args.get('order', 'desc') != 'asc'
+    try:
+        limit = min(max(int(args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    
+    query = Client.query
+    search = args.get('q', '').strip()
+    if search:
+        query = query.filter(or_(
+            Client.name.contains(search, autoescape=True),
+            Client.client_id.startswith(search.lower(), autoescape=True)
+        ))
+    status = args.get('status')
+    if status == 'active':
+        query = query.filter_by(is_active=True)
+    elif status == 'disabled':
+        query = query.filter_by(is_active=False)
+    total = query.count()
+    
+    column = SORTS[sort]
+    if args.get('after'):
+        value, last_id = _decode_cursor(args['after'], sort)
+        query = query.filter(_after(column, value, last_id, descending))
+    if descending:
+        query = query.order_by(column.desc(), Client.id.desc())
+    else:
+        query = query.order_by(column.asc(), Client.id.asc())
+    clients = query.limit(limit + 1).all()
+    
+    cursor = _encode_cursor(clients[limit - 1], sort) if len(clients) > limit else None
+    return clients[:limit], total, cursor
+
+
+def client_totals():
+    """Active clients, those seen lately and their traffic, counted by SQLite"""
+    total, traffic = db.session.query(
+        func.count(Client.id),
+        func.coalesce(func.sum(Client.bytes_sent + Client.bytes_received), 0)
+    ).filter_by(is_active=True).one()
+    online = Client.query.filter_by(is_active=True).filter(
+        Client.last_seen >= datetime.utcnow() - timedelta(seconds=ONLINE_WINDOW)
+    ).count()
+    return total, online, traffic
+
+
+def sync_stats(app, dns_server, interval):
+    """
+    Copy the DNS server's client counters into the database every
+    interval, writing only clients whose counters moved since the last
+    write (connected ones are also marked seen, so last_seen is when
+    traffic was last counted), in one statement per kind of change
+    """
+    table = Client.__table__
+    counters = table.update().where(table.c.client_id == bindparam('cid')).values(
+        bytes_sent=bindparam('sent'), bytes_received=bindparam('received')
+    )
+    seen = counters.values(last_seen=bindparam('seen'))
+    written = {}
+    while True:
+        time.sleep(interval)
+        try:
+            now = datetime.utcnow()
+            changed, connected = [], []
+            for client_id, stats in dns_server.get_client_stats().items():
+                row = {
+                    'cid': client_id,
+                    'sent': stats.get('bytes_sent', 0),
+                    'received': stats.get('bytes_received', 0)
+                }
+                if written.get(client_id) == (row['sent'], row['received']):
+                    continue
+                if stats.get('connected'):
+                    row['seen'] = now
+                    connected.append(row)
+                else:
+                    changed.append(row)
+            with app.app_context():
+                if changed:
+                    db.session.execute(counters, changed)
+                if connected:
+                    db.session.execute(seen, connected)
+                db.session.commit()
+            for row in changed + connected:
+                written[row['cid']] = (row['sent'], row['received'])
+        except Exception as e:
+            logger.error(f"Client stats sync error: {e}")
+
+
 def create_app(config, dns_server):
-    """Create Flask application"""
+    """
+    Create Flask application. dns_server is the DNSTunnelServer itself
+    when the panel shares its process, or a RemoteTunnel otherwise.
+    """
     app = Flask(__name__)
     
     # Configuration
     app.config['SECRET_KEY'] = config['web_panel']['secret_key']
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database/tunnel.db'
+    # Flask-SQLAlchemy 3 would put a relative path under the instance folder
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(
+        config['web_panel']['database']
+    )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # Initialize extensions
@@ -63,7 +238,11 @@ def create_app(config, dns_server):
     app.tunnel_config = config
     
     with app.app_context():
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
         db.create_all()
+        # create_all() leaves tables that already exist alone
+        for index in Client.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
         
         # Create admin user if not exists
         admin = User.query.filter_by(username=config['web_panel']['admin_user']).first()
@@ -76,33 +255,32 @@ def create_app(config, dns_server):
             db.session.add(admin)
             db.session.commit()
     
+    # Counters reach the database in the background, not on page views
+    if dns_server is not None:
+        threading.Thread(
+            target=sync_stats,
+            args=(app, dns_server, config['web_panel']['stats_sync_interval']),
+            name='stats-sync', daemon=True
+        ).start()
+    
     @login_manager.user_loader
     def load_user(user_id):
         return User.query.get(int(user_id))
     
+    @app.context_processor
+    def template_globals():
+        return {'now': datetime.utcnow(), 'online_window': ONLINE_WINDOW}
+    
     # Routes
     @app.route('/')
     @login_required
     def index():
         """Dashboard"""
-        clients = Client.query.filter_by(is_active=True).all()
-        stats = dns_server.get_client_stats()
-        
-        # Update client stats from DNS server
-        for client in clients:
-            if client.client_id in stats:
-                client_stats = stats[client.client_id]
-                client.bytes_sent = client_stats.get('bytes_sent', 0)
-                client.bytes_received = client_stats.get('bytes_received', 0)
-                if client_stats.get('connected'):
-                    client.last_seen = datetime.utcnow()
-        
-        db.session.commit()
-        
-        total_clients = len(clients)
-        active_clients = sum(1 for c in clients if c.last_seen and 
-                           (datetime.utcnow() - c.last_seen).seconds < 300)
-        total_traffic = sum(c.bytes_sent + c.bytes_received for c in clients)
+        total_clients, active_clients, total_traffic = client_totals()
+        # Most recently seen first
+        clients = Client.query.filter_by(is_active=True).order_by(
+            Client.last_seen.desc(), Client.id.desc()
+        ).limit(10).all()
         
         return render_template('dashboard.html',
                              clients=clients,
@@ -140,9 +318,12 @@ def create_app(config, dns_server):
     @app.route('/clients')
     @login_required
     def clients_list():
-        """List all clients"""
-        clients = Client.query.all()
-        return render_template('clients.html', clients=clients)
+        """List clients a page at a time, with search and sorting"""
+        try:
+            clients, total, cursor = client_page(request.args)
+        except ValueError:
+            abort(400)
+        return render_template('clients.html', clients=clients, total=total, cursor=cursor)
     
     @app.route('/clients/add', methods=['GET', 'POST'])
     @login_required
@@ -241,6 +422,12 @@ def create_app(config, dns_server):
         client.is_active = not client.is_active
         db.session.commit()
         
+        # Disabled clients lose their key on the DNS server
+        if client.is_active:
+            dns_server.register_client(client.client_id, base64.b64decode(client.encryption_key))
+        else:
+            dns_server.remove_client(client.client_id)
+        
         status = 'enabled' if client.is_active else 'disabled'
         flash(f'Client "{client.name}" {status}!', 'success')
         return redirect(url_for('client_detail', client_id=client_id))
@@ -262,17 +449,58 @@ def create_app(config, dns_server):
         
         return render_template('settings.html')
     
+    @app.route('/admin/profile')
+    @login_required
+    def admin_profile():
+        """
+        Sample the DNS server's thread stacks for ?seconds= (default from
+        the config) and return the profile as JSON, or with
+        ?format=collapsed the collapsed stacks for flamegraph tools
+        """
+        if not current_user.is_admin:
+            abort(403)
+        try:
+            seconds = float(request.args.get('seconds', config['profiler']['seconds']))
+        except ValueError:
+            abort(400)
+        if not math.isfinite(seconds):
+            abort(400)
+        try:
+            profile = dns_server.profile(seconds)
+        except ValueError:
+            abort(400)
+        except Exception as e:
+            # Most likely another profile is running
+            return jsonify({'error': str(e)}), 409
+        
+        if request.args.get('format') == 'collapsed':
+            return Response(profile['collapsed'], mimetype='text/plain', headers={
+                'Content-Disposition': f'attachment; filename=profile-{int(time.time())}.folded'
+            })
+        return jsonify(profile)
+    
     @app.route('/api/stats')
     @login_required
     def api_stats():
-        """API endpoint for statistics"""
-        clients = Client.query.filter_by(is_active=True).all()
+        """
+        API endpoint for statistics: totals, and one page of clients (same
+        arguments as the client list; follow 'next' for the rest)
+        """
+        total_clients, _, total_traffic = client_totals()
+        args = request.args.to_dict()
+        args.setdefault('status', 'active')
+        try:
+            clients, matching, cursor = client_page(args)
+        except ValueError:
+            abort(400)
         stats = dns_server.get_client_stats()
         
         return jsonify({
-            'total_clients': len(clients),
+            'total_clients': total_clients,
             'active_clients': len([c for c in stats.values() if c.get('connected')]),
-            'total_traffic': sum(c.bytes_sent + c.bytes_received for c in clients),
+            'total_traffic': total_traffic,
+            'matching_clients': matching,
+            'next': cursor,
             'clients': [
                 {
                     'id': c.client_id,
@@ -286,3 +514,41 @@ def create_app(config, dns_server):
         })
     
     return app
+
+
+def run_app(app, config):
+    """Serve the panel with Flask's threaded server over TLS"""
+    app.run(
+        host=config['web_panel']['host'],
+        port=config['web_panel']['port'],
+        ssl_context=(config['web_panel']['ssl_cert'], config['web_panel']['ssl_key']),
+        debug=False,
+        threaded=True
+    )
+
+
+def run_panel(config):
+    """Entry point of the panel process started by main.py"""
+    from dns_server.log_pipeline import setup_logging
+    from dns_server.panel_bridge import RemoteTunnel
+    
+    # The DNS process owns the server log file
+    setup_logging(dict(config, logging=dict(config['logging'], file=config['web_panel']['log_file'])))
+    
+    # Don't outlive the DNS process if it is killed without cleanup
+    parent = os.getppid()
+    
+    def watch_parent():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+    
+    threading.Thread(target=watch_parent, daemon=True).start()
+    
+    # Lower CPU priority: on a busy host the DNS process runs first
+    if config['web_panel']['nice']:
+        os.nice(config['web_panel']['nice'])
+    try:
+        run_app(create_app(config, RemoteTunnel(config)), config)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,18 @@
+"""
+WSGI entry point for running the web panel under gunicorn next to a
+server started with web_panel.mode: external, e.g. from the server dir:
+
+    gunicorn -w 2 -b 0.0.0.0:8443 --certfile ssl/cert.pem --keyfile ssl/key.pem web_panel.wsgi:app
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from web_panel.app import create_app
+from config.config_loader import load_config
+from dns_server.panel_bridge import RemoteTunnel
+
+config = load_config()
+app = create_app(config, RemoteTunnel(config))